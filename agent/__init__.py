@@ -1,2 +1,18 @@
-from .main_agent import agent
-from .context import StackAndHeapContext
\ No newline at end of file
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .context import StackAndHeapContext
+    from .main_agent import agent
+
+__all__ = ["agent", "StackAndHeapContext"]
+
+
+def __getattr__(name: str) -> Any:
+    # 按需导入：只用到 agent.utils / agent.context 时不加载 agents SDK 和模型
+    if name == "agent":
+        from .main_agent import agent
+        return agent
+    if name == "StackAndHeapContext":
+        from .context import StackAndHeapContext
+        return StackAndHeapContext
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
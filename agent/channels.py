@@ -0,0 +1,159 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from typing import List
+
+
+class UserChannel(ABC):
+    """
+    agent 与用户之间的异步通道。send_message 工具通过 `ask` 发送消息并等待回复，
+    等待期间不会阻塞事件循环。
+    """
+
+    def __init__(self, timeout: float | None = None):
+        self.timeout = timeout  # 等待回复的超时（秒），None 表示一直等待
+
+    async def ask(self, content: str) -> str | None:
+        """发送消息并等待回复；超时返回 None"""
+        try:
+            return await asyncio.wait_for(self._ask(content), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    @abstractmethod
+    async def _ask(self, content: str) -> str:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class StdinChannel(UserChannel):
+    """在线程中读取标准输入，事件循环中的其它任务照常运行"""
+
+    def __init__(self, timeout: float | None = None, echo: bool = True):
+        super().__init__(timeout)
+        self.echo = echo  # 流式模式下消息已经边生成边显示，不必再打印一遍
+        self._pending: asyncio.Future[str] | None = None
+        self._timed_out = False  # 上一次提问是否超时（或被取消）而没有收到回复
+
+    async def _ask(self, content: str) -> str:
+        if self.echo:
+            print(f"User received message: {content}")
+        if self._timed_out:
+            # 上一次提问超时后、这次提问之前输入的一行答的是旧问题，丢弃
+            if self._pending is not None and self._pending.done():
+                self._pending = None
+            self._timed_out = False
+        # input() 无法被取消：超时时还没输入完的读取保留下来，在这次提问之后输入完成，作为这次的回复
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.ensure_future(
+                asyncio.to_thread(input, "Your reply: "))
+        try:
+            reply = await asyncio.shield(self._pending)
+        except asyncio.CancelledError:
+            self._timed_out = True
+            raise
+        self._pending = None
+        return reply
+
+
+class QueueChannel(UserChannel):
+    """
+    基于 asyncio.Queue 的通道，供同一进程中的其它协程（HTTP 服务、测试脚本等）扮演用户：
+    用 `next_message()` 取 agent 发出的消息，用 `reply()` 回复。
+    """
+
+    def __init__(self, timeout: float | None = None):
+        super().__init__(timeout)
+        self.outbox: asyncio.Queue[str] = asyncio.Queue()
+        self.inbox: asyncio.Queue[str] = asyncio.Queue()
+        self.waiting = False  # agent 是否正在等待回复
+        self._timed_out = False  # 上一次提问是否超时（或被取消）而没有收到回复
+
+    async def _ask(self, content: str) -> str:
+        if self._timed_out:
+            # 上一次提问超时后才到达的回复答的是旧问题，不能当作这次提问的回答
+            while not self.inbox.empty():
+                self.inbox.get_nowait()
+            self._timed_out = False
+        await self.outbox.put(content)
+        self.waiting = True
+        try:
+            return await self.inbox.get()
+        except asyncio.CancelledError:
+            self._timed_out = True
+            raise
+        finally:
+            self.waiting = False
+
+    def reply(self, text: str) -> None:
+        self.inbox.put_nowait(text)
+
+    async def next_message(self) -> str:
+        return await self.outbox.get()
+
+    async def drain(self, wait: float = 0) -> List[str]:
+        """取出所有待读消息；没有消息时最多等待 wait 秒"""
+        messages: List[str] = []
+        if self.outbox.empty() and wait > 0:
+            try:
+                messages.append(await asyncio.wait_for(self.outbox.get(), wait))
+            except asyncio.TimeoutError:
+                return messages
+        while not self.outbox.empty():
+            messages.append(self.outbox.get_nowait())
+        return messages
+
+
+class SocketChannel(QueueChannel):
+    """
+    在本地 TCP 端口上提供通道：客户端每收到一行 JSON `{"message": ...}`，
+    回复一行文本作为用户的回答。同一时刻只服务一个客户端。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, timeout: float | None = None):
+        super().__init__(timeout)
+        self.host = host
+        self.port = port
+        self._server: asyncio.Server | None = None
+        self._client_lock = asyncio.Lock()
+        self._clients: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        if self._server is None:
+            self._server = await asyncio.start_server(self._serve, self.host, self.port)
+
+    async def _ask(self, content: str) -> str:
+        await self.start()
+        return await super()._ask(content)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._clients.add(task)
+        async with self._client_lock:
+            try:
+                while True:
+                    message = await self.next_message()
+                    writer.write(json.dumps({'message': message}, ensure_ascii=False).encode('utf-8') + b'\n')
+                    await writer.drain()
+                    line = await reader.readline()
+                    if not line:
+                        # 客户端断开：把消息放回，等待下一个客户端
+                        self.outbox.put_nowait(message)
+                        break
+                    self.reply(line.decode('utf-8').rstrip('\r\n'))
+            except asyncio.CancelledError:
+                pass  # close() 时取消
+            finally:
+                writer.close()
+                self._clients.discard(task)  # type: ignore
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._clients):
+                task.cancel()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,95 @@
+import json
+import os
+import re
+from typing import Any, Dict, List
+from .context import StackAndHeapContext
+from .message_log import MessageLog
+
+CHECKPOINT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+
+class CheckpointStore:
+    """
+    按名称持久化的检查点。每个检查点存为相对父检查点的增量 `<root>/<name>.json`：
+    {"parent": 父检查点名或 null, "base_length": 父检查点的消息数, "messages": 新增的消息, "state": 其余字段}。
+
+    检查点写入后不再修改。加载时沿父链还原并缓存，从同一检查点加载出的上下文共享消息日志，
+    因此从一个预热好的上下文分出成百上千个会话时，内存和磁盘只随各自新增的消息增长。
+    """
+
+    def __init__(self, root: str = 'logs/checkpoints'):
+        self.root = root
+        self._cache: Dict[str, StackAndHeapContext] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        if not CHECKPOINT_NAME_PATTERN.match(name):
+            raise ValueError(f'Invalid checkpoint name: {name!r}')
+        return os.path.join(self.root, f'{name}.json')
+
+    def names(self) -> List[str]:
+        return sorted(name[:-len('.json')] for name in os.listdir(self.root) if name.endswith('.json'))
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def save(self, name: str, ctx: StackAndHeapContext, parent: str | None = None) -> None:
+        """
+        保存 ctx 为检查点 name。给出 parent 时只写入 parent 之后新增的消息，
+        要求 ctx 的消息日志以 parent 的全部消息为前缀（即 ctx 由 parent 分支而来）
+        """
+        path = self._path(name)
+        if os.path.exists(path):
+            raise FileExistsError(f'Checkpoint {name!r} already exists.')
+        base_length = 0
+        if parent is not None:
+            base = self._load_frozen(parent)
+            if not ctx.chat_history.shares_prefix(base.chat_history):
+                raise ValueError(f'Context does not descend from checkpoint {parent!r}.')
+            base_length = len(base.chat_history)
+        data: Dict[str, Any] = {
+            'parent': parent,
+            'base_length': base_length,
+            'messages': ctx.chat_history.items_from(base_length),
+            'state': ctx.model_dump(mode='json', exclude={'chat_history'}),
+        }
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._cache[name] = ctx.fork()
+
+    def load(self, name: str) -> StackAndHeapContext:
+        """加载检查点，返回一个可以自由修改的分支"""
+        return self._load_frozen(name).fork()
+
+    def _load_frozen(self, name: str) -> StackAndHeapContext:
+        if (cached := self._cache.get(name)) is not None:
+            return cached
+        with open(self._path(name), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data['parent'] is not None:
+            history = self._load_frozen(data['parent']).chat_history.fork()
+            if len(history) != data['base_length']:
+                raise ValueError(f'Checkpoint {name!r} expects {data["base_length"]} messages '
+                                 f'from {data["parent"]!r}, found {len(history)}.')
+            history.extend(data['messages'])
+        else:
+            history = MessageLog(data['messages'])
+        ctx = StackAndHeapContext.model_validate(data['state'] | {'chat_history': history})
+        self._cache[name] = ctx
+        return ctx
+
+    def parent_of(self, name: str) -> str | None:
+        with open(self._path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)['parent']
+
+    def delete(self, name: str) -> None:
+        """删除检查点；仍被其它检查点作为父检查点引用时拒绝删除"""
+        children = [other for other in self.names() if other != name and self.parent_of(other) == name]
+        if children:
+            raise ValueError(f'Checkpoint {name!r} is the parent of {children}.')
+        os.remove(self._path(name))
+        self._cache.pop(name, None)
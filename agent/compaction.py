@@ -0,0 +1,78 @@
+from __future__ import annotations
+import json
+from typing import TYPE_CHECKING, Dict, List, Mapping
+
+if TYPE_CHECKING:
+    from agents import TResponseInputItem
+
+# 这些工具的有效信息在调用参数里（例如 brainstorm 的 thinking），压缩时省略参数；
+# 其余工具省略输出（例如 read_note_sections 读到的 note 内容）
+ELIDE_ARGUMENTS_OF = {'brainstorm'}
+
+# 短于该长度的内容不值得替换
+MIN_ELIDE_CHARS = 200
+
+
+def compact_conversation(items: List[TResponseInputItem],
+                         keep_last: Mapping[str, int]) -> List[TResponseInputItem]:
+    """
+    对构建好的对话做压缩：每个配置了窗口的工具，只保留最近 N 次调用的完整内容，
+    更早的参数/输出替换为简短占位符。返回新列表，被替换的消息是新 dict，不影响 chat_history。
+    """
+    if not keep_last:
+        return items
+    names: Dict[str, str] = {}
+    for item in items:
+        if item.get('type') == 'function_call':
+            names[item['call_id']] = item['name']  # type: ignore
+
+    seen: Dict[str, int] = {}
+    elided_calls: set[str] = set()
+    # 从后往前数：每个工具的最近 N 次调用保持原样
+    for item in reversed(items):
+        if item.get('type') != 'function_call':
+            continue
+        name = item['name']  # type: ignore
+        if name not in keep_last:
+            continue
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > keep_last[name]:
+            elided_calls.add(item['call_id'])  # type: ignore
+    if not elided_calls:
+        return items
+
+    result: List[TResponseInputItem] = []
+    for item in items:
+        call_id = item.get('call_id')
+        if call_id in elided_calls:
+            name = names[call_id]  # type: ignore
+            if name in ELIDE_ARGUMENTS_OF and item.get('type') == 'function_call':
+                item = _elide_arguments(item)
+            elif name not in ELIDE_ARGUMENTS_OF and item.get('type') == 'function_call_output':
+                item = _elide_output(item, name)
+        result.append(item)
+    return result
+
+
+def _elide_arguments(item: TResponseInputItem) -> TResponseInputItem:
+    arguments: str = item['arguments']  # type: ignore
+    if len(arguments) < MIN_ELIDE_CHARS:
+        return item
+    try:
+        parsed = json.loads(arguments)
+    except json.JSONDecodeError:
+        parsed = None
+    if isinstance(parsed, dict):
+        elided = {k: f'[elided: {len(v)} chars from an earlier call]' if isinstance(v, str) else v
+                  for k, v in parsed.items()}
+    else:
+        elided = {'elided': f'{len(arguments)} chars from an earlier call'}
+    return {**item, 'arguments': json.dumps(elided, ensure_ascii=False)}  # type: ignore
+
+
+def _elide_output(item: TResponseInputItem, name: str) -> TResponseInputItem:
+    output = item.get('output')
+    if not isinstance(output, str) or len(output) < MIN_ELIDE_CHARS:
+        return item
+    first_line = output.split('\n', 1)[0][:100]
+    return {**item, 'output': f'{first_line}\n[elided: {len(output)} chars of earlier {name} output]'}  # type: ignore
@@ -1,16 +1,75 @@
-
-from typing import List, Literal
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, List, Literal
 import json
-from agents import TResponseInputItem
-from .utils import find_the_first_message_of_type, apply_patch
-from pydantic import BaseModel, Field
+from .note import AppliedHunk, NoteDocument, describe_change, section_changes, section_from_lines
+from .note_index import NoteIndex, NoteSelection, message_text
+from .patch_matching import PatchMatcher
+from .journal import Journal
+from .channels import StdinChannel, UserChannel
+from .message_log import MessageLog
+from .prompt_cache import PrefixReport, PrefixTracker
+from .tokens import default_counter
+from .compaction import compact_conversation
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 import os
 
+if TYPE_CHECKING:
+    from agents import TResponseInputItem
+    from .parallel import ParallelSubtaskRunner
+    from .web_search import WebSearch
+
+ConversationLayout = Literal["note_first", "note_last"]
+
 
 class Subtask(BaseModel):
     task_id: str = "main"
     goal: str = "main"
-    messages: List[TResponseInputItem] = Field(default_factory=list)
+    message_ids: List[int] = Field(default_factory=list)  # 指向 chat_history 的消息 id
+    start_call_id: str | None = None  # 发起该 subtask 的 start_subtask 调用 id，多工具轮次中据此划分消息
+
+    _token_count: int | None = PrivateAttr(default=None)  # 本 frame 消息的 token 数缓存
+
+
+class FrameMark(BaseModel):
+    """StackAndHeapContext.mark_frames() 记下的栈状态"""
+    frames: List[Subtask]  # 栈中 frame 对象本身（不是副本）
+    lengths: List[int]  # 各 frame 当时的消息数
+    stage: Literal["main_loop", "summarizing"]
+    overlays: int  # 当时的 overlay 数；之后新增的 overlay 按插入顺序排在后面
+
+
+class PendingSummary(BaseModel):
+    """一次临时弹出：frame 已从栈上移除，总结（note patch 与返回值）仍在后台进行"""
+    message_id: int  # 父 frame 中待替换的 function_call_output
+    removed: int
+    parent_task_id: str
+    frames: List[Subtask]  # 弹出前的栈，后台据此重建总结阶段的对话
+
+
+def pop_summary_output(removed: int, return_value: str, parent_task_id: str) -> str:
+    return f'[{removed} messages removed] You have terminated the subtask with summary "{return_value}". You are now working on subtask: {parent_task_id}.'
+
+
+class NoteChange(BaseModel):
+    index: int  # 修改前的分节下标
+    old: List[List[str]]  # 被替换的分节（各分节的 header 行和内容行）
+    new: List[List[str]]
+
+
+class NoteDelta(BaseModel):
+    """一次 note 修改，只记录被替换的分节，用于撤销/重做和向模型展示修改内容"""
+    version: int  # 修改后的版本号
+    patch: str
+    changes: List[NoteChange]
+
+    def describe(self, undo: bool = False) -> str:
+        """以 '@@ header' 加 '-' / '+' 行的形式列出修改；undo 时给出撤销的方向"""
+        lines: List[str] = []
+        for change in self.changes:
+            old = [section_from_lines(section) for section in change.old]
+            new = [section_from_lines(section) for section in change.new]
+            lines += describe_change(new, old) if undo else describe_change(old, new)
+        return '\n'.join(lines) or '(no changes)'
 
 
 DEFAULT_note = \
@@ -23,7 +82,83 @@ class StackAndHeapContext(BaseModel):
     stack: List[Subtask] = [Subtask()]
     note: str = DEFAULT_note
     current_stage: Literal["main_loop", "summarizing"] = "main_loop"
-    chat_history: List[TResponseInputItem] = Field(default_factory=list)
+    chat_history: MessageLog = Field(default_factory=MessageLog)
+    # 对 chat_history 中消息的改写（如 pop_subtask 的总结），只在构建对话时合并
+    overlays: Dict[int, Dict[str, Any]] = Field(default_factory=dict)
+    # note_first: note 放在第一条消息中（默认）；
+    # note_last: 前缀只包含各 frame 的消息，note 和当前任务放在末尾，使前缀跨轮保持不变以命中 prompt cache
+    conversation_layout: ConversationLayout = "note_first"
+    # full: 每次请求注入完整 note；relevant: 只注入与当前 frame 相关的分节（BM25），
+    # 总量不超过 note_injection_budget 个 token，其余分节只列出标题，需要时用 read_note_sections 读取。
+    # 总结阶段需要按原文写 patch，始终注入完整 note
+    note_injection: Literal["full", "relevant"] = "full"
+    note_injection_budget: int = 2000
+    # note 的版本号，每次修改（包括撤销/重做）加一；note_history 保存最近 note_history_limit 次修改，
+    # note_redo 保存已撤销、尚可重做的修改，新的修改会清空它
+    note_version: int = 0
+    note_history: List[NoteDelta] = Field(default_factory=list)
+    note_redo: List[NoteDelta] = Field(default_factory=list)
+    note_history_limit: int = 20
+    # token 预算（None 表示不限制）。超出时 warn 只在系统提示中提醒，
+    # finish 则强制当前 subtask 进入 summarizing -> pop_subtask 流程
+    frame_token_budget: int | None = None
+    total_token_budget: int | None = None
+    budget_policy: Literal["warn", "finish"] = "warn"
+    # 对话压缩：工具名 -> 保留完整内容的最近调用次数，更早的 brainstorm 参数/工具输出以占位符代替。
+    # 例如 {"brainstorm": 3, "apply_patch_to_note": 1}；为空则不压缩。chat_history 始终保留完整内容
+    compaction_keep_last: Dict[str, int] = Field(default_factory=dict)
+    # 已临时弹出、总结仍在后台进行的 frame（见 summarizer.BackgroundSummarizer）
+    pending_summaries: List[PendingSummary] = Field(default_factory=list)
+
+    _journal: Journal | None = PrivateAttr(default=None)
+    _prefix_tracker: PrefixTracker = PrivateAttr(default_factory=PrefixTracker)
+    _note_document: NoteDocument | None = PrivateAttr(default=None)
+    _user_channel: UserChannel = PrivateAttr(default_factory=StdinChannel)
+    _subtask_runner: 'ParallelSubtaskRunner | None' = PrivateAttr(default=None)
+    _web_search: 'WebSearch | None' = PrivateAttr(default=None)
+    _message_tokens: Dict[int, int] = PrivateAttr(default_factory=dict)
+    _note_tokens: tuple[str, int] | None = PrivateAttr(default=None)
+    _note_index: NoteIndex = PrivateAttr(default_factory=NoteIndex)
+    _checkpoints: Dict[str, 'StackAndHeapContext'] = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode='before')
+    @classmethod
+    def _migrate_legacy_frames(cls, data: Any) -> Any:
+        """兼容旧格式：Subtask 直接保存 messages 副本"""
+        if not isinstance(data, dict) or not any('messages' in frame for frame in data.get('stack', [])):
+            return data
+        history: List[Dict[str, Any]] = list(data.get('chat_history', []))
+        overlays: Dict[int, Dict[str, Any]] = dict(data.get('overlays', {}))
+        by_content: Dict[str, List[int]] = {}
+        by_call_id: Dict[tuple, List[int]] = {}
+        for i, m in enumerate(history):
+            by_content.setdefault(json.dumps(m, sort_keys=True), []).append(i)
+            if 'call_id' in m:
+                by_call_id.setdefault((m.get('type'), m['call_id']), []).append(i)
+        used: set[int] = set()
+
+        def take(candidates: List[int]) -> int | None:
+            return next((i for i in candidates if i not in used), None)
+
+        stack = []
+        for frame in data['stack']:
+            message_ids = []
+            for message in frame.get('messages', []):
+                message_id = take(by_content.get(json.dumps(message, sort_keys=True), []))
+                if message_id is None and 'call_id' in message:
+                    # 被 pop_subtask 原地改写过的 output：按 call_id 找回原消息，差异记为 overlay
+                    message_id = take(by_call_id.get((message.get('type'), message['call_id']), []))
+                    if message_id is not None:
+                        overlays[message_id] = {k: v for k, v in message.items()
+                                                if history[message_id].get(k) != v}
+                if message_id is None:
+                    history.append(message)
+                    message_id = len(history) - 1
+                used.add(message_id)
+                message_ids.append(message_id)
+            stack.append({k: v for k, v in frame.items() if k != 'messages'}
+                         | {'message_ids': message_ids})
+        return data | {'stack': stack, 'chat_history': history, 'overlays': overlays}
 
     def save(self, path: str) -> None:
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -36,49 +171,475 @@ class StackAndHeapContext(BaseModel):
             data = json.load(f)
         return cls.model_validate(data)
 
-    def push_subtask(self, subtask_id: str, subtask_goal: str):
-        self.stack.append(Subtask(task_id=subtask_id,
-                          goal=subtask_goal, messages=[]))
+    @classmethod
+    def open_journal(cls, path: str, snapshot_every: int = 500) -> 'StackAndHeapContext':
+        """以 journal 模式打开会话：若已有快照/日志则重放恢复，之后的每次变更都追加到日志中"""
+        journal = Journal(path, snapshot_every=snapshot_every)
+        state, records = journal.read()
+        ctx = cls.model_validate(state) if state is not None else cls()
+        for op, args in records:
+            ctx._replay(op, args)
+        ctx._journal = journal
+        if journal.torn_tail or journal.needs_snapshot():
+            ctx.compact_journal()
+        return ctx
+
+    def compact_journal(self) -> None:
+        """写入完整快照并截断日志"""
+        assert self._journal, "Journal mode is not enabled."
+        self._journal.write_snapshot(self.model_dump(mode='json'))
+
+    def sync(self) -> None:
+        """journal 模式下把本轮的记录刷到磁盘"""
+        if self._journal:
+            self._journal.sync()
+
+    def close_journal(self) -> None:
+        """关闭日志文件并退出 journal 模式，之后的修改不再写入该日志"""
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def _record(self, op: str, **args: Any) -> None:
+        if self._journal is None:
+            return
+        self._journal.append(op, args)
+        if self._journal.needs_snapshot():
+            self.compact_journal()
+
+    def _replay(self, op: str, args: Dict[str, Any]) -> None:
+        match op:
+            case "add_messages":
+                self.add_messages(args['messages'])
+            case "push_subtask":
+                self.push_subtask(args['subtask_id'], args['subtask_goal'], args.get('start_call_id'))
+            case "pop_subtask":
+                self.pop_subtask(args['return_value'], args.get('pending', False))
+            case "resolve_pending_summary":
+                self.resolve_pending_summary(args['message_id'], args['return_value'], args['notice'])
+            case "apply_patch_to_note":
+                self.apply_patch_to_note(args['patch'])
+            case "undo_note":
+                self.undo_note()
+            case "redo_note":
+                self.redo_note()
+            case "set_stage":
+                self.set_stage(args['stage'])
+            case "checkpoint":
+                self.checkpoint(args['name'])
+            case _:
+                raise ValueError(f'Unknown journal op: {op}')
+
+    # ---- 分支与检查点 ----
+
+    def fork(self) -> 'StackAndHeapContext':
+        """
+        copy-on-write 分支：消息日志和 note 与当前上下文共享，栈的 id 列表和 overlay 各自复制，
+        之后两边的修改互不影响。分支不继承 journal；用户通道和已有的检查点沿用。
+        """
+        forked = StackAndHeapContext.model_construct(
+            **{name: getattr(self, name) for name in type(self).model_fields},
+        )
+        forked.stack = [subtask.model_copy(update={'message_ids': list(subtask.message_ids)})
+                        for subtask in self.stack]
+        forked.chat_history = self.chat_history.fork()
+        forked.overlays = dict(self.overlays)
+        forked.pending_summaries = list(self.pending_summaries)
+        forked.note_history = list(self.note_history)
+        forked.note_redo = list(self.note_redo)
+        forked.compaction_keep_last = dict(self.compaction_keep_last)
+        forked._user_channel = self._user_channel
+        forked._subtask_runner = self._subtask_runner
+        forked._web_search = self._web_search
+        forked._message_tokens = dict(self._message_tokens)
+        forked._note_tokens = self._note_tokens
+        forked._note_index = self._note_index
+        forked._checkpoints = dict(self._checkpoints)
+        return forked
+
+    def checkpoint(self, name: str) -> None:
+        """记下当前状态。检查点是一个不再修改的分支，与当前上下文共享消息"""
+        self._checkpoints[name] = self.fork()
+        self._record('checkpoint', name=name)
+
+    @property
+    def checkpoints(self) -> List[str]:
+        return list(self._checkpoints)
+
+    def get_checkpoint(self, name: str) -> 'StackAndHeapContext':
+        """返回检查点本身（只读，需要修改时先 fork()）"""
+        if name not in self._checkpoints:
+            raise KeyError(f'Unknown checkpoint: {name}')
+        return self._checkpoints[name]
+
+    def drop_checkpoint(self, name: str) -> None:
+        self._checkpoints.pop(name, None)
+
+    def rollback(self, name: str) -> None:
+        """
+        回到检查点时的状态，检查点本身保留，可以多次回滚。
+        journal 模式下回滚后立即写入快照；内存中的检查点不进入快照，重启后只能恢复最近一次快照之后创建的检查点
+        """
+        restored = self.get_checkpoint(name).fork()
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(restored, field))
+        self._note_document = None
+        self._message_tokens = restored._message_tokens
+        self._note_tokens = restored._note_tokens
+        if self._journal is not None:
+            self.compact_journal()
+
+    def mark_frames(self) -> FrameMark:
+        """记下栈中的 frame 及其消息数、阶段和 overlay 数，供 restore_frames 回到此刻。只复制栈的引用，O(栈深度)"""
+        return FrameMark(frames=list(self.stack), lengths=[len(subtask.message_ids) for subtask in self.stack],
+                         stage=self.current_stage, overlays=len(self.overlays))
+
+    def restore_frames(self, mark: FrameMark) -> None:
+        """
+        把栈和阶段恢复到 mark_frames() 时的状态，用于丢弃一次失败的运行中压入/弹出的 frame。
+        运行中只会压入新 frame、向已有 frame 和 overlay 追加内容，因此截断回记下的长度即可；
+        note 及其版本历史保留当前值，运行期间完成的后台总结改写的（已有的）overlay 也保留。
+        journal 模式下恢复后立即写入快照
+        """
+        for subtask, length in zip(mark.frames, mark.lengths):
+            del subtask.message_ids[length:]
+            subtask._token_count = None
+        self.stack = list(mark.frames)
+        self.current_stage = mark.stage
+        for message_id in list(self.overlays)[mark.overlays:]:
+            del self.overlays[message_id]
+            self._message_tokens.pop(message_id, None)
+        if self._journal is not None:
+            self.compact_journal()
+
+    @property
+    def user_channel(self) -> UserChannel:
+        """send_message 使用的用户通道，默认从标准输入读取"""
+        return self._user_channel
 
-    def pop_subtask(self, return_value: str):
-        """弹出最后一个subtask"""
+    def set_user_channel(self, channel: UserChannel) -> None:
+        self._user_channel = channel
+
+    @property
+    def subtask_runner(self) -> 'ParallelSubtaskRunner | None':
+        """start_parallel_subtasks 使用的并行子任务执行器，未设置时该工具不可用"""
+        return self._subtask_runner
+
+    def set_subtask_runner(self, runner: 'ParallelSubtaskRunner | None') -> None:
+        self._subtask_runner = runner
+
+    @property
+    def web_search(self) -> 'WebSearch | None':
+        """web_search / fetch_pages 工具使用的搜索客户端，未设置时这两个工具不可用"""
+        return self._web_search
+
+    def set_web_search(self, client: 'WebSearch | None') -> None:
+        self._web_search = client
+
+    def set_stage(self, stage: Literal["main_loop", "summarizing"]):
+        self.current_stage = stage
+        self._record('set_stage', stage=stage)
+
+    def push_subtask(self, subtask_id: str, subtask_goal: str, start_call_id: str | None = None):
+        subtask = Subtask(task_id=subtask_id, goal=subtask_goal, start_call_id=start_call_id)
+        if self.frame_token_budget is not None or self.total_token_budget is not None:
+            # 有预算时每轮都会查询用量，新 frame 为空，直接从 0 开始增量计数；否则留给 frame_tokens 按需计算
+            subtask._token_count = 0
+        self.stack.append(subtask)
+        self._record('push_subtask', subtask_id=subtask_id,
+                     subtask_goal=subtask_goal, start_call_id=start_call_id)
+
+    def pop_subtask(self, return_value: str, pending: bool = False) -> int:
+        """
+        弹出最后一个subtask，返回写入父 frame 的总结消息 id。
+        pending=True 时为临时弹出：总结在后台进行，先记下弹出前的栈，完成后用 resolve_pending_summary 补上返回值
+        """
         assert len(self.stack) > 1, "No subtask to pop."
+        frames = [subtask.model_copy(update={'message_ids': list(subtask.message_ids)})
+                  for subtask in self.stack] if pending else []
         top_subtask = self.stack.pop() if self.stack else None
         assert top_subtask, "No subtask to pop."
-        if top_subtask.messages[0]['type'] == 'reasoning':   # type: ignore
-            self.stack[-1].messages.append(top_subtask.messages[0])
-        first_function_call_message = find_the_first_message_of_type(
-            top_subtask.messages, 'function_call')
-        assert first_function_call_message, "No function call message found in the popped subtask."
-        self.stack[-1].messages.append(first_function_call_message)
-        subtask_start_function_call_output = find_the_first_message_of_type(
-            top_subtask.messages, 'function_call_output')
-        assert subtask_start_function_call_output, "No function call output message found in the popped subtask."
-        output = f'[{len(top_subtask.messages)} messages removed] You have terminated the subtask with summary "{return_value}". You are now working on subtask: {self.stack[-1].task_id}.'
-        subtask_start_function_call_output['output'] = output  # type: ignore
-        self.stack[-1].messages.append(subtask_start_function_call_output)
+        parent_ids = self.stack[-1].message_ids
+        moved_from = len(parent_ids)
+        top_ids = top_subtask.message_ids
+        if self.chat_history[top_ids[0]].get('type') == 'reasoning':
+            parent_ids.append(top_ids[0])
+        first_function_call_id = self.find_first_message_id_of_type(
+            top_ids, 'function_call')
+        assert first_function_call_id is not None, "No function call message found in the popped subtask."
+        parent_ids.append(first_function_call_id)
+        subtask_start_output_id = self.find_first_message_id_of_type(
+            top_ids, 'function_call_output')
+        assert subtask_start_output_id is not None, "No function call output message found in the popped subtask."
+        if pending:
+            self.pending_summaries.append(PendingSummary(
+                message_id=subtask_start_output_id, removed=len(top_ids),
+                parent_task_id=self.stack[-1].task_id, frames=frames))
+            output = f'[{len(top_ids)} messages removed] You have terminated the subtask. Its summary is being written to the note in the background. You are now working on subtask: {self.stack[-1].task_id}.'
+        else:
+            output = pop_summary_output(len(top_ids), return_value, self.stack[-1].task_id)
+        self.overlays[subtask_start_output_id] = {'output': output}
+        self._message_tokens.pop(subtask_start_output_id, None)
+        parent_ids.append(subtask_start_output_id)
+        self._count_into(self.stack[-1], parent_ids[moved_from:])
+        if pending:
+            self._record('pop_subtask', return_value=return_value, pending=True)
+        else:
+            self._record('pop_subtask', return_value=return_value)
+        return subtask_start_output_id
+
+    def resolve_pending_summary(self, message_id: int, return_value: str, notice: str = ''):
+        """后台总结完成：把临时弹出时的占位输出替换为真正的总结"""
+        pending = next(p for p in self.pending_summaries if p.message_id == message_id)
+        self.pending_summaries.remove(pending)
+        output = pop_summary_output(pending.removed, return_value, pending.parent_task_id)
+        self.overlays[message_id] = {'output': output + notice}
+        self._message_tokens.pop(message_id, None)
+        for subtask in self.stack:
+            if message_id in subtask.message_ids:
+                subtask._token_count = None
+        self._record('resolve_pending_summary', message_id=message_id,
+                     return_value=return_value, notice=notice)
+
+    def find_first_message_id_of_type(self, message_ids: List[int], msg_type: str) -> int | None:
+        for message_id in message_ids:
+            if self.chat_history[message_id].get('type') == msg_type:
+                return message_id
+        return None
+
+    def frame_messages(self, subtask: Subtask) -> List[TResponseInputItem]:
+        """物化某个 subtask 的消息（已合并 overlay）"""
+        return self.chat_history.materialize(subtask.message_ids, self.overlays)
 
     def build_conversation(self) -> List[TResponseInputItem]:
         conversation: List[TResponseInputItem] = []
-        conversation.append({
-            'role': 'user',
-            'content': f'<system>以下是你的可编辑文本型note:\n```note\n{self.note}\n```\nLaunched. You are now working on task: {self.stack[-1].task_id}</system>'
-        })
+        warnings = ''.join(f'\n{w}' for w in self.budget_warnings())
+        if self.conversation_layout == "note_last":
+            conversation.append({
+                'role': 'user',
+                'content': '<system>Launched. 你的可编辑文本型note和当前任务会在对话末尾给出。</system>'
+            })
+        else:
+            conversation.append({
+                'role': 'user',
+                'content': f'<system>以下是你的可编辑文本型note:\n{self.note_for_prompt()}\nLaunched. You are now working on task: {self.stack[-1].task_id}{warnings}</system>'
+            })
 
+        frames: List[TResponseInputItem] = []
         for subtask in self.stack:
-            conversation.extend(subtask.messages)
+            frames.extend(self.frame_messages(subtask))
+        conversation.extend(compact_conversation(frames, self.compaction_keep_last))
+
+        if self.conversation_layout == "note_last":
+            conversation.append({
+                'role': 'user',
+                'content': f'<system>以下是你的可编辑文本型note:\n{self.note_for_prompt()}\nYou are now working on task: {self.stack[-1].task_id}{warnings}</system>'
+            })
         return conversation
 
+    def note_for_prompt(self) -> str:
+        """请求中的 note 部分：完整 note，或 relevant 模式下选出的分节加上其余分节的标题"""
+        selection = self.note_selection()
+        if selection is None or not selection.omitted:
+            return f'```note\n{self.note}\n```'
+        headers = ', '.join(section.header for section in selection.omitted if section.header is not None)
+        return (f'```note\n{selection.render()}\n```\n'
+                f'（只展开了与当前任务相关的分节。其余分节：{headers}。需要时用 read_note_sections 读取）')
+
+    def note_selection(self) -> NoteSelection | None:
+        """relevant 模式下按当前 frame 的 task_id/goal 和最近的消息选出的 note 分节；其它情况返回 None"""
+        if self.note_injection != "relevant" or self.current_stage == "summarizing":
+            return None
+        return self._note_index.select(self.note_document, self.note_query(), self.note_injection_budget)
+
+    def note_query(self, recent: int = 6) -> str:
+        """检索 note 用的文本：各 frame 的目标（当前 frame 重复一次以加权）和当前 frame 最近 recent 条消息"""
+        top = self.stack[-1]
+        parts = [f'{subtask.task_id} {subtask.goal}' for subtask in self.stack]
+        parts.append(f'{top.task_id} {top.goal}')
+        parts += [message_text(m) for m in self.chat_history.materialize(top.message_ids[-recent:], self.overlays)]
+        return '\n'.join(parts)
+
+    def prefix_report(self, conversation: List[TResponseInputItem]) -> PrefixReport:
+        """与上一次调用时的对话比较，报告逐字节相同的前缀（即可被 prompt cache 复用的部分）"""
+        return self._prefix_tracker.report(conversation)
+
     def add_messages(self, messages: List[TResponseInputItem]):
-        self.chat_history.extend(messages)
-        # 如果有成功地调用pop_subtask，则不添加任何消息。返回值会被pop_subtask直接添加到父subtask中
-        if first_function_call := find_the_first_message_of_type(messages, 'function_call'):
-            if first_function_call['name'] == 'pop_subtask':  # type: ignore
-                first_output = find_the_first_message_of_type(
-                    messages, 'function_call_output')
-                if 'error' not in first_output['output']:  # type: ignore
-                    return
-        self.stack[-1].messages.extend(messages)
-
-    def apply_patch_to_note(self, patch: str):
-        self.note = apply_patch(patch, self.note)
+        message_ids = self.chat_history.extend(messages)
+        self._record('add_messages', messages=messages)
+        # 如果有成功地调用pop_subtask，则不添加任何消息。返回值会被pop_subtask直接添加到父subtask中。
+        # 多工具轮次中 pop_subtask 之前可能还有 summarizing 阶段的其它调用，它们同样属于被弹出的 subtask
+        if self._popped_in(messages):
+            return
+        for subtask, ids in self._route_messages(messages, message_ids):
+            subtask.message_ids.extend(ids)
+            self._count_into(subtask, ids)
+
+    @staticmethod
+    def _popped_in(messages: List[TResponseInputItem]) -> bool:
+        pop_call_ids = {m['call_id'] for m in messages  # type: ignore
+                        if m.get('type') == 'function_call' and m.get('name') == 'pop_subtask'}
+        return any(m.get('type') == 'function_call_output' and m.get('call_id') in pop_call_ids
+                   and 'error' not in m['output'] for m in messages)  # type: ignore
+
+    def _route_messages(self, messages: List[TResponseInputItem],
+                        message_ids: range) -> List[tuple[Subtask, List[int]]]:
+        """
+        把一次运行产生的消息分配到各 frame。单工具轮次中全部属于栈顶；
+        多工具轮次中途可能 start_subtask，该调用之前的消息属于原来的 frame，
+        从该调用（及紧挨着的 reasoning）开始属于新 frame，工具输出跟随对应的调用。
+        """
+        call_ids = {m.get('call_id') for m in messages if m.get('type') == 'function_call'}
+        first_new = len(self.stack)
+        while (first_new > 1 and not self.stack[first_new - 1].message_ids
+               and self.stack[first_new - 1].start_call_id in call_ids):
+            first_new -= 1
+        if first_new == len(self.stack):
+            return [(self.stack[-1], list(message_ids))]
+
+        starts = {self.stack[i].start_call_id: i for i in range(first_new, len(self.stack))}
+        targets: List[int] = []
+        call_targets: Dict[str, int] = {}
+        current = first_new - 1
+        for index, message in enumerate(messages):
+            call_id = message.get('call_id')
+            if message.get('type') == 'function_call' and call_id in starts:
+                current = starts[call_id]
+                if targets and messages[index - 1].get('type') == 'reasoning':
+                    targets[-1] = current
+            if message.get('type') == 'function_call_output' and call_id in call_targets:
+                targets.append(call_targets[call_id])
+                continue
+            if message.get('type') == 'function_call':
+                call_targets[call_id] = current  # type: ignore
+            targets.append(current)
+
+        routed: Dict[int, List[int]] = {}
+        for message_id, target in zip(message_ids, targets):
+            routed.setdefault(target, []).append(message_id)
+        return [(self.stack[i], ids) for i, ids in sorted(routed.items())]
+
+    # ---- token 计数与预算 ----
+
+    def message_tokens(self, message_id: int) -> int:
+        """单条消息（合并 overlay 后）的 token 数，按 id 缓存"""
+        count = self._message_tokens.get(message_id)
+        if count is None:
+            message = self.chat_history.materialize([message_id], self.overlays)[0]
+            count = self._message_tokens[message_id] = default_counter.count_item(message)
+        return count
+
+    def frame_tokens(self, subtask: Subtask) -> int:
+        if subtask._token_count is None:
+            subtask._token_count = sum(self.message_tokens(i) for i in subtask.message_ids)
+        return subtask._token_count
+
+    def _count_into(self, subtask: Subtask, message_ids) -> None:
+        # 只在已经计算过的情况下增量更新；从未查询过预算时不产生计数开销
+        if subtask._token_count is not None:
+            subtask._token_count += sum(self.message_tokens(i) for i in message_ids)
+
+    def note_tokens(self) -> int:
+        if self._note_tokens is None or self._note_tokens[0] is not self.note:
+            self._note_tokens = (self.note, default_counter.count_text(self.note))
+        return self._note_tokens[1]
+
+    def conversation_tokens(self) -> int:
+        """build_conversation() 结果的 token 估计（不含 instructions 和工具定义）"""
+        return self.note_tokens() + sum(self.frame_tokens(subtask) for subtask in self.stack)
+
+    def budget_warnings(self) -> List[str]:
+        warnings: List[str] = []
+        if self.frame_token_budget is not None and len(self.stack) > 1 and self.current_stage == "main_loop":
+            used = self.frame_tokens(self.stack[-1])
+            if used > self.frame_token_budget:
+                warnings.append(
+                    f'Subtask {self.stack[-1].task_id} uses {used} tokens, over its budget of {self.frame_token_budget}. Wrap it up and call finish_subtask soon.')
+        if self.total_token_budget is not None:
+            used = self.conversation_tokens()
+            if used > self.total_token_budget:
+                warnings.append(
+                    f'The context uses {used} tokens, over the total budget of {self.total_token_budget}. Finish subtasks you no longer need.')
+        return warnings
+
+    def enforce_budget(self) -> bool:
+        """budget_policy 为 finish 时，若超出预算则强制当前 subtask 进入 summarizing 阶段；返回是否触发"""
+        if self.budget_policy != "finish" or self.current_stage != "main_loop" or len(self.stack) == 1:
+            return False
+        warnings = self.budget_warnings()
+        if not warnings:
+            return False
+        self.add_messages([{
+            'type': 'message',
+            'role': 'user',
+            'content': f'<system>{" ".join(warnings)} The subtask has been finished automatically. Summarize it into the note and pop it.</system>'
+        }])
+        self.set_stage("summarizing")
+        return True
+
+    @property
+    def note_document(self) -> NoteDocument:
+        """note 的分节索引结构；note 字段被外部直接赋值时自动重建"""
+        if self._note_document is None or self._note_document.render() is not self.note:
+            self._note_document = NoteDocument.from_text(self.note, PatchMatcher())
+        return self._note_document
+
+    def apply_patch_to_note(self, patch: str) -> List[AppliedHunk]:
+        document = self.note_document
+        before = list(document.sections)
+        applied = document.apply_patch(patch)
+        self.note = document.render()
+        self.note_version += 1
+        self.note_history.append(NoteDelta(version=self.note_version, patch=patch, changes=[
+            NoteChange(index=index, old=[s.all_lines() for s in old], new=[s.all_lines() for s in new])
+            for index, old, new in section_changes(before, document.sections)]))
+        del self.note_history[:max(0, len(self.note_history) - self.note_history_limit)]
+        self.note_redo = []
+        self._record('apply_patch_to_note', patch=patch)
+        return applied
+
+    @property
+    def last_note_delta(self) -> NoteDelta | None:
+        return self.note_history[-1] if self.note_history else None
+
+    def undo_note(self) -> NoteDelta:
+        """撤销最近一次 note 修改，返回被撤销的修改"""
+        if not self.note_history:
+            raise ValueError('There is no note change to undo.')
+        delta = self.note_history[-1]
+        self._splice_note(delta, undo=True)
+        self.note_history.pop()
+        self.note_redo.append(delta)
+        self._record('undo_note')
+        return delta
+
+    def redo_note(self) -> NoteDelta:
+        """重做最近一次撤销的 note 修改，返回重做的修改"""
+        if not self.note_redo:
+            raise ValueError('There is no undone note change to redo.')
+        delta = self.note_redo[-1]
+        self._splice_note(delta, undo=False)
+        self.note_redo.pop()
+        self.note_history.append(delta)
+        self._record('redo_note')
+        return delta
+
+    def _splice_note(self, delta: NoteDelta, undo: bool) -> None:
+        """
+        把 delta 涉及的分节换回修改前（undo）或修改后的内容。按下标升序处理：
+        撤销时前面的修改已经换回，下标就是修改前的下标；重做时要加上前面修改造成的偏移
+        """
+        document = self.note_document
+        sections = list(document.sections)
+        shift = 0
+        for change in delta.changes:
+            current, target = (change.new, change.old) if undo else (change.old, change.new)
+            start = change.index if undo else change.index + shift
+            if [s.all_lines() for s in sections[start:start + len(current)]] != current:
+                raise ValueError(f'The note has been changed outside the recorded history since version '
+                                 f'{delta.version}; cannot {"undo" if undo else "redo"} it.')
+            sections[start:start + len(current)] = [section_from_lines(lines) for lines in target]
+            shift += len(target) - len(current)
+        document.replace_sections(0, len(document.sections), sections)
+        self.note = document.render()
+        self.note_version += 1
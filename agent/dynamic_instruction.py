@@ -52,6 +52,8 @@ flowchart TD
 
 ### 执行规则（Operational Rules）
 - start_subtask 策略：当需要拆分子任务或限定上下文时使用 start_subtask(subtask_id, subtask_goal)，并在随后的 brainstorm 中细化子目标、所需信息与退出标准（何时 finish_subtask，返回什么）。
+- 并行子任务：若干互不依赖的子目标（例如几次独立的查询）可以用 start_parallel_subtasks 同时进行（如果该工具可用）。它们各自把结果写入 note，不能与用户沟通；全部完成后你会得到所有返回值，以及未能合并进 note 的冲突 patch。
+- 网络搜索：需要查资料时用 web_search（如果该工具可用），把需要的多个查询放进同一次调用，它们会并发执行；需要网页全文时用 fetch_pages。
 - 结束判定：满足其一即可视为“结束”：
   - 子目标达成；
   - 证据显示在合理资源约束内不可达成。
@@ -76,6 +78,6 @@ def subtask_summarizer_instructions(cm: StackAndHeapContext) -> str:
 </goal>
 
 <working_principles>
-使用apply_patch_to_note工具将总结内容以patch的形式应用到note中。
+使用apply_patch_to_note工具将总结内容以patch的形式应用到note中。工具只返回本次的修改和note的新版本号；改错了可以用undo_note_patch撤销，需要查看完整note时用read_note_sections。
 <working_principle>
 """
@@ -0,0 +1,395 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import time
+from abc import abstractmethod
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Sequence
+from agents import Agent, ItemHelpers, ModelSettings, RunConfig, Usage, set_tracing_disabled
+from agents.models.interface import Model, ModelTracing
+from .channels import UserChannel
+from .context import StackAndHeapContext
+from .runtime import run_turn
+from .scripted_model import ScriptedModel, ScriptedReplyModel, default_script
+from .sessions import SESSION_ID_PATTERN
+from .telemetry import Telemetry
+
+logger = logging.getLogger(__name__)
+
+END_OF_CONVERSATION = '[END]'
+
+USER_SIMULATOR_INSTRUCTIONS = """你在扮演一位正在与 AI 助手聊天的用户。你的人设：
+{persona}
+
+每次只输出这位用户的一条回复，不要解释，也不要替助手说话。
+对话目标已经达成，或者这位用户不想再继续时，只回复 {end}。"""
+
+# --scripted-agent 且未指定 user_model 时，模拟用户依次给出的回复（不访问模型）
+SCRIPTED_USER_REPLIES = ('好的，请继续。', '可以，就按这个来。', f'谢谢，就这些。{END_OF_CONVERSATION}')
+
+
+@dataclass
+class Persona:
+    """
+    一个评估用的用户。replies 与 persona 二选一：
+    replies 为脚本用户依次给出的回复；persona 为人设描述，由模型扮演用户。
+    context 覆盖该会话 StackAndHeapContext 的字段（例如 {"note_injection": "relevant"}），max_turns 覆盖轮数上限
+    """
+    id: str
+    replies: List[str] | None = None
+    persona: str | None = None
+    max_turns: int | None = None
+    max_replies: int = 20  # 模拟用户最多回复的次数
+    context: Dict[str, Any] = field(default_factory=dict)
+
+
+def load_personas(path: str) -> List[Persona]:
+    """读取 JSONL 格式的 persona 文件（每行一个 Persona，空行和 # 开头的行忽略）"""
+    personas: List[Persona] = []
+    known = {f.name for f in fields(Persona)}
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            data = json.loads(line)
+            if unknown := set(data) - known:
+                raise ValueError(f'{path}:{number}: unknown persona fields {sorted(unknown)}')
+            persona = Persona(**data)
+            if not SESSION_ID_PATTERN.match(persona.id):
+                raise ValueError(f'{path}:{number}: invalid persona id {persona.id!r}')
+            if (persona.replies is None) == (persona.persona is None):
+                raise ValueError(f'{path}:{number}: persona {persona.id!r} needs exactly one of replies/persona')
+            personas.append(persona)
+    ids = [persona.id for persona in personas]
+    if duplicates := sorted(id for id, count in Counter(ids).items() if count > 1):
+        raise ValueError(f'Duplicate persona ids: {duplicates}')
+    return personas
+
+
+class EvaluationChannel(UserChannel):
+    """
+    评估用的用户通道：记录对话，finished 表示用户已经结束对话，会话在本轮后停止。
+    给出回复失败时异常记录在 error 中（在 send_message 里它只会变成一次工具错误），会话据此以 error 结束
+    """
+
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.finished = False
+        self.error: Exception | None = None
+        self.dialogue: List[Dict[str, str]] = []
+
+    async def _ask(self, content: str) -> str:
+        self.dialogue.append({'role': 'agent', 'content': content})
+        try:
+            reply = await self._reply(content)
+        except Exception as e:
+            self.error = e
+            raise
+        if reply or not self.finished:
+            self.dialogue.append({'role': 'user', 'content': reply})
+        return reply
+
+    @abstractmethod
+    async def _reply(self, content: str) -> str:
+        ...
+
+    @property
+    def replies(self) -> int:
+        return sum(1 for turn in self.dialogue if turn['role'] == 'user')
+
+
+class ScriptedUserChannel(EvaluationChannel):
+    """依次给出脚本中的回复；回复用完后 agent 再发消息时结束对话"""
+
+    def __init__(self, replies: Sequence[str]):
+        super().__init__()
+        self.script = list(replies)
+
+    async def _reply(self, content: str) -> str:
+        if self.replies >= len(self.script):
+            self.finished = True
+            return ''
+        return self.script[self.replies]
+
+
+class SimulatedUserChannel(EvaluationChannel):
+    """由模型按人设扮演用户。模型回复 END_OF_CONVERSATION 或达到 max_replies 时结束对话；usage 累计模拟用户的模型用量"""
+
+    def __init__(self, persona: str, model: Model, max_replies: int = 20):
+        super().__init__()
+        self.instructions = USER_SIMULATOR_INSTRUCTIONS.format(persona=persona, end=END_OF_CONVERSATION)
+        self.model = model
+        self.max_replies = max_replies
+        self.usage = Usage()
+
+    async def _reply(self, content: str) -> str:
+        if self.replies >= self.max_replies:
+            self.finished = True
+            return ''
+        # 在模拟用户的视角中，agent 的消息是 user，用户自己的回复是 assistant
+        input: List[Any] = [{'role': 'user' if turn['role'] == 'agent' else 'assistant', 'content': turn['content']}
+                            for turn in self.dialogue]
+        response = await self.model.get_response(
+            self.instructions, input, ModelSettings(), [], None, [], ModelTracing.DISABLED,
+            previous_response_id=None, conversation_id=None, prompt=None)
+        self.usage.add(response.usage)
+        reply = '\n'.join(text for item in response.output if (text := ItemHelpers.extract_last_text(item)))
+        if END_OF_CONVERSATION in reply:
+            self.finished = True
+            reply = reply.replace(END_OF_CONVERSATION, '')
+        return reply.strip()
+
+
+@dataclass
+class EvaluationConfig:
+    out_dir: str = 'logs/evaluation'
+    max_turns: int = 30  # 每个会话最多运行的轮数（run_turn 次数）
+    sessions_per_process: int = 8  # 每个进程中同时运行的会话数
+    multi_tool: bool = False
+    scripted_agent: bool = False  # 用 ScriptedModel 代替真实模型驱动 agent，模拟用户也用本地脚本回复（离线冒烟测试）
+    user_model: str | None = None  # 模拟用户使用的模型名；None 表示使用主模型（scripted_agent 时为本地脚本）
+    context: Dict[str, Any] = field(default_factory=dict)  # 所有会话共用的 StackAndHeapContext 字段覆盖
+
+    def transcript_path(self, session_id: str) -> str:
+        return os.path.join(self.out_dir, 'transcripts', f'{session_id}.json')
+
+
+@dataclass
+class SessionStats:
+    session: str
+    status: str  # finished: 用户结束了对话；turn_cap: 达到轮数上限；error: 运行出错
+    turns: int = 0
+    model_calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    max_stack_depth: int = 1  # 各轮结束时栈深度的最大值
+    final_stack_depth: int = 1
+    patches_applied: int = 0
+    patch_failures: int = 0
+    approximate_patches: int = 0
+    tool_calls: int = 0
+    tool_errors: int = 0
+    user_replies: int = 0
+    user_model_calls: int = 0  # 模拟用户的模型调用和 token，不计入上面 agent 的用量
+    user_input_tokens: int = 0
+    user_output_tokens: int = 0
+    note_tokens: int = 0
+    wall_s: float = 0.0
+    error: str | None = None
+
+
+class RecordingTelemetry(Telemetry):
+    """在写入 JSONL 的同时按会话保留每轮记录，会话结束时据此汇总。bind 出的句柄共享同一个 records"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.records: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+
+    def export(self, record: Dict[str, Any]) -> None:
+        super().export(record)
+        self.records[record['session']].append(record)
+
+
+def session_stats(session_id: str, records: List[Dict[str, Any]], ctx: StackAndHeapContext,
+                  status: str, wall_s: float, user_replies: int, error: str | None = None,
+                  user_usage: Usage | None = None) -> SessionStats:
+    tools = [tool for record in records for tool in record['tools']]
+    user_usage = user_usage or Usage()
+    return SessionStats(
+        session=session_id,
+        status=status,
+        turns=len(records),
+        model_calls=sum(record['model_calls'] for record in records),
+        input_tokens=sum(record['input_tokens'] for record in records),
+        output_tokens=sum(record['output_tokens'] for record in records),
+        cached_tokens=sum(record['cached_tokens'] for record in records),
+        max_stack_depth=max([record['stack_depth'] for record in records] + [len(ctx.stack)]),
+        final_stack_depth=len(ctx.stack),
+        patches_applied=sum(record['patches'].get('exact', 0) + record['patches'].get('approximate', 0)
+                            for record in records),
+        patch_failures=sum(record['patches'].get('failed', 0) for record in records),
+        approximate_patches=sum(record['patches'].get('approximate', 0) for record in records),
+        tool_calls=len(tools),
+        tool_errors=sum(1 for tool in tools if tool['status'] == 'error'),
+        user_replies=user_replies,
+        user_model_calls=user_usage.requests,
+        user_input_tokens=user_usage.input_tokens,
+        user_output_tokens=user_usage.output_tokens,
+        note_tokens=ctx.note_tokens(),
+        wall_s=round(wall_s, 3),
+        error=error,
+    )
+
+
+class _Shard:
+    """一个工作进程中的会话：共享 agent、模型和 telemetry，同时最多运行 sessions_per_process 个"""
+
+    def __init__(self, config: EvaluationConfig):
+        from .main_agent import agent, multi_tool_agent
+        from .model import build_model, get_stage_models, load_env
+        from .model import model as main_model
+        self.config = config
+        self.agent: Agent[StackAndHeapContext] = multi_tool_agent if config.multi_tool else agent
+        self.stage_models = {} if config.scripted_agent else get_stage_models()
+        self.user_model: Model = ScriptedReplyModel(SCRIPTED_USER_REPLIES) if config.scripted_agent else main_model
+        if config.user_model:
+            load_env()
+            self.user_model = build_model(config.user_model, os.getenv("API_KEY"), os.getenv("BASE_URL"))
+        os.makedirs(os.path.join(config.out_dir, 'transcripts'), exist_ok=True)
+        self.telemetry = RecordingTelemetry(os.path.join(config.out_dir, 'metrics', f'{os.getpid()}.jsonl'))
+
+    def _context(self, persona: Persona) -> StackAndHeapContext:
+        ctx = StackAndHeapContext(**(self.config.context | persona.context))
+        if self.config.scripted_agent and '## Log' not in ctx.note:
+            ctx.note = ctx.note.rstrip('\n') + '\n\n## Log\n'  # default_script 的 patch 写在 "## Log" 下
+        return ctx
+
+    def _channel(self, persona: Persona) -> EvaluationChannel:
+        if persona.replies is not None:
+            return ScriptedUserChannel(persona.replies)
+        return SimulatedUserChannel(persona.persona or '', self.user_model, persona.max_replies)
+
+    async def run(self, personas: Sequence[Persona]) -> List[SessionStats]:
+        semaphore = asyncio.Semaphore(self.config.sessions_per_process)
+
+        async def limited(persona: Persona) -> SessionStats:
+            async with semaphore:
+                return await self.run_session(persona)
+
+        try:
+            return list(await asyncio.gather(*(limited(persona) for persona in personas)))
+        finally:
+            self.telemetry.close()
+
+    async def run_session(self, persona: Persona) -> SessionStats:
+        ctx = self._context(persona)
+        channel = self._channel(persona)
+        ctx.set_user_channel(channel)
+        run_config = RunConfig(model=ScriptedModel(default_script())) if self.config.scripted_agent else None
+        telemetry = self.telemetry.bind(persona.id)
+        status, error = 'turn_cap', None
+        start = time.perf_counter()
+        try:
+            for _ in range(persona.max_turns or self.config.max_turns):
+                await run_turn(ctx, self.agent, run_config=run_config, stage_models=self.stage_models,
+                               telemetry=telemetry)
+                if channel.error is not None:
+                    logger.error('User channel of evaluation session %s failed: %r', persona.id, channel.error)
+                    status, error = 'error', f'user channel failed: {channel.error!r}'
+                    break
+                if channel.finished:
+                    status = 'finished'
+                    break
+        except Exception as e:
+            logger.exception('Evaluation session %s failed', persona.id)
+            status, error = 'error', repr(e)
+        stats = session_stats(persona.id, self.telemetry.records.pop(persona.id, []), ctx, status,
+                              time.perf_counter() - start, channel.replies, error,
+                              channel.usage if isinstance(channel, SimulatedUserChannel) else None)
+        write_transcript(self.config.transcript_path(persona.id), persona, stats, channel.dialogue, ctx)
+        return stats
+
+
+def write_transcript(path: str, persona: Persona, stats: SessionStats, dialogue: List[Dict[str, str]],
+                     ctx: StackAndHeapContext) -> None:
+    data = {
+        'persona': asdict(persona),
+        'stats': asdict(stats),
+        'dialogue': dialogue,
+        'note': ctx.note,
+        'stack': [subtask.task_id for subtask in ctx.stack],
+        'messages': ctx.model_dump(mode='json', include={'chat_history'})['chat_history'],
+    }
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def run_shard(personas: Sequence[Persona], config: EvaluationConfig) -> List[SessionStats]:
+    """工作进程的入口：在一个事件循环中运行这一组会话（模型的连接池绑定事件循环，每个进程只用一个）"""
+    set_tracing_disabled(True)  # 批量评估不上传 trace
+    return asyncio.run(_Shard(config).run(personas))
+
+
+def run_evaluation(personas: Sequence[Persona], config: EvaluationConfig, processes: int = 1,
+                   resume: bool = False) -> Dict[str, Any]:
+    """
+    把 personas 轮流分给 processes 个工作进程，每个进程用 asyncio 并发运行各自的会话。
+    每个会话的对话、最终 note 和统计写入 `<out_dir>/transcripts/<id>.json`，
+    全部结束后写出 `<out_dir>/sessions.jsonl`（每个会话一行统计）和 `<out_dir>/summary.json`（汇总）。
+    resume 时跳过已有 transcript 的会话，沿用其中的统计
+    """
+    os.makedirs(os.path.join(config.out_dir, 'transcripts'), exist_ok=True)
+    results: Dict[str, SessionStats] = {}
+    pending: List[Persona] = []
+    for persona in personas:
+        path = config.transcript_path(persona.id)
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                results[persona.id] = SessionStats(**json.load(f)['stats'])
+        else:
+            pending.append(persona)
+    processes = max(1, min(processes, len(pending)))
+    shards = [pending[i::processes] for i in range(processes)]
+    start = time.perf_counter()
+    if processes == 1:
+        results |= {stats.session: stats for stats in run_shard(pending, config)} if pending else {}
+    else:
+        # spawn：子进程不继承父进程中的事件循环、连接池和线程
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(run_shard, shard, config): shard for shard in shards}
+            for future in as_completed(futures):
+                try:
+                    results |= {stats.session: stats for stats in future.result()}
+                except Exception as e:
+                    logger.exception('Evaluation worker failed')
+                    results |= {persona.id: SessionStats(persona.id, 'error', error=f'worker failed: {e!r}')
+                                for persona in futures[future]}
+    ordered = [results[persona.id] for persona in personas]
+    summary = aggregate(ordered) | {'processes': processes, 'wall_s': round(time.perf_counter() - start, 3)}
+    with open(os.path.join(config.out_dir, 'sessions.jsonl'), 'w', encoding='utf-8') as f:
+        for stats in ordered:
+            f.write(json.dumps(asdict(stats), ensure_ascii=False) + '\n')
+    with open(os.path.join(config.out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary | {'config': asdict(config)}, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def _distribution(values: Sequence[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        'mean': round(statistics.mean(ordered), 3),
+        'p50': round(ordered[len(ordered) // 2], 3),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+AGGREGATED_FIELDS = ('turns', 'model_calls', 'input_tokens', 'output_tokens', 'max_stack_depth',
+                     'patch_failures', 'tool_errors', 'user_replies', 'note_tokens', 'wall_s')
+
+
+def aggregate(results: Sequence[SessionStats]) -> Dict[str, Any]:
+    """各会话统计的汇总：按状态计数、总量，以及主要指标的 mean/p50/p95/max"""
+    if not results:
+        return {'sessions': 0}
+    applied = sum(stats.patches_applied for stats in results)
+    failed = sum(stats.patch_failures for stats in results)
+    return {
+        'sessions': len(results),
+        'status': dict(Counter(stats.status for stats in results)),
+        'totals': {name: round(sum(getattr(stats, name) for stats in results), 3)
+                   for name in ('turns', 'model_calls', 'input_tokens', 'output_tokens', 'cached_tokens',
+                                'patches_applied', 'patch_failures', 'tool_calls', 'tool_errors',
+                                'user_model_calls', 'user_input_tokens', 'user_output_tokens')},
+        'patch_failure_rate': round(failed / (applied + failed), 4) if applied + failed else 0.0,
+        'per_session': {name: _distribution([getattr(stats, name) for stats in results])
+                        for name in AGGREGATED_FIELDS},
+    }
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Dict, Tuple
+from urllib.parse import parse_qs, urlsplit
+from .sessions import SessionManager
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+MAX_BODY_BYTES = 1 << 20
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def serve_http(manager: SessionManager, host: str = '127.0.0.1', port: int = 8080) -> asyncio.Server:
+    """
+    本地 HTTP 接口（仅依赖标准库）：
+
+      POST   /sessions                    创建会话，body 可选 {"session_id": ...}
+      GET    /sessions                    列出会话状态
+      GET    /sessions/<id>               会话状态
+      GET    /sessions/<id>/messages?wait=秒  取出 agent 发给用户的消息（可长轮询）
+      POST   /sessions/<id>/reply         回复用户消息，body {"text": ...}
+      DELETE /sessions/<id>               停止会话
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, payload = await _dispatch(manager, reader)
+        except HttpError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            logger.exception('HTTP handler failed')
+            status, payload = 500, {'error': repr(e)}
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+            f'Content-Type: application/json; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('ascii') + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, Any]]:
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise HttpError(400, 'Malformed request line')
+    method, target, _ = parts
+    content_length = 0
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-length':
+            try:
+                content_length = int(value.strip())
+            except ValueError:
+                raise HttpError(400, 'Invalid Content-Length') from None
+            if content_length < 0:
+                raise HttpError(400, 'Invalid Content-Length')
+    if content_length > MAX_BODY_BYTES:
+        raise HttpError(400, 'Request body too large')
+    body: Dict[str, Any] = {}
+    if content_length:
+        try:
+            body = json.loads(await reader.readexactly(content_length))
+        except json.JSONDecodeError:
+            raise HttpError(400, 'Body must be JSON')
+        if not isinstance(body, dict):
+            raise HttpError(400, 'Body must be a JSON object')
+    return method, target, body
+
+
+async def _dispatch(manager: SessionManager, reader: asyncio.StreamReader) -> Tuple[int, Any]:
+    method, target, body = await _read_request(reader)
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    path = url.path.rstrip('/')
+
+    if path == '/sessions':
+        if method == 'GET':
+            return 200, [s.describe() for s in manager.sessions.values()]
+        if method == 'POST':
+            session_id = body.get('session_id')
+            if session_id is not None and not isinstance(session_id, str):
+                raise HttpError(400, '"session_id" must be a string')
+            try:
+                session = manager.create_session(session_id)
+            except ValueError as e:
+                raise HttpError(400, str(e))
+            return 201, session.describe()
+        raise HttpError(405, 'Method not allowed')
+
+    match = re.fullmatch(r'/sessions/([^/]+)(?:/(messages|reply))?', path)
+    if not match:
+        raise HttpError(404, 'Not found')
+    session_id, action = match.groups()
+    try:
+        session = manager.get(session_id)
+    except KeyError:
+        raise HttpError(404, f'Unknown session: {session_id}')
+
+    if action is None:
+        if method == 'GET':
+            return 200, session.describe()
+        if method == 'DELETE':
+            await manager.stop(session_id)
+            return 200, session.describe()
+    elif action == 'messages' and method == 'GET':
+        try:
+            wait = float(query.get('wait', ['0'])[0])
+        except ValueError:
+            raise HttpError(400, 'Query parameter "wait" must be a number') from None
+        if not 0 <= wait:  # 同时拒绝 nan
+            raise HttpError(400, 'Query parameter "wait" must not be negative')
+        wait = min(wait, 60.0)
+        return 200, {'messages': await session.channel.drain(wait)}
+    elif action == 'reply' and method == 'POST':
+        text = body.get('text')
+        if not isinstance(text, str):
+            raise HttpError(400, 'Body must contain a string "text"')
+        manager.reply(session_id, text)
+        return 200, session.describe()
+    raise HttpError(405, 'Method not allowed')
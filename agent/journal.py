@@ -0,0 +1,108 @@
+import json
+import os
+from typing import Any, Dict, Iterator, Tuple
+
+
+class Journal:
+    """
+    StackAndHeapContext 的追加式持久化日志。
+
+    每次状态变更（add_messages / push_subtask / pop_subtask / apply_patch_to_note / set_stage）
+    追加一行紧凑的 JSON 记录到 `<name>.jsonl`；每累计 `snapshot_every` 条记录，
+    就把完整状态写入 `<name>.snapshot.json` 并截断日志（compaction）。
+    加载时先读快照，再按顺序重放 seq 大于快照 seq 的记录。
+    """
+
+    def __init__(self, path: str, snapshot_every: int = 500):
+        self.path = path
+        self.snapshot_path = os.path.splitext(path)[0] + '.snapshot.json'
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.pending = 0  # 自上次快照以来的记录数
+        self.torn_tail = False  # 读取时发现末尾有写了一半的记录
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def append(self, op: str, args: Dict[str, Any]) -> None:
+        self.seq += 1
+        self.pending += 1
+        record = {'seq': self.seq, 'op': op, 'args': args}
+        f = self._open()
+        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        f.write('\n')
+        f.flush()
+
+    def needs_snapshot(self) -> bool:
+        return self.pending >= self.snapshot_every
+
+    def sync(self) -> None:
+        """把已追加的记录刷到磁盘（每轮调用一次即可）"""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def write_snapshot(self, state: Dict[str, Any]) -> None:
+        """原子地写入快照，然后截断日志"""
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'seq': self.seq, 'state': state}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # 快照已落盘，此后即使截断前崩溃，重放时也会按 seq 跳过旧记录
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        with open(self.path, "w", encoding="utf-8"):
+            pass
+        self.pending = 0
+
+    def read(self) -> Tuple[Dict[str, Any] | None, Iterator[Tuple[str, Dict[str, Any]]]]:
+        """返回 (快照状态, 需要重放的 (op, args) 迭代器)，并把 seq 推进到最后一条记录"""
+        state = None
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            state = snapshot['state']
+            snapshot_seq = snapshot['seq']
+        self.seq = snapshot_seq
+        self.pending = 0
+
+        def records() -> Iterator[Tuple[str, Dict[str, Any]]]:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 最后一行可能因崩溃而只写了一半
+                        self.torn_tail = True
+                        break
+                    if record['seq'] <= snapshot_seq:
+                        continue
+                    self.seq = record['seq']
+                    self.pending += 1
+                    yield record['op'], record['args']
+
+        return state, records()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
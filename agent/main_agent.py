@@ -1,15 +1,31 @@
-from agents import Agent
-from .tools import brainstorm, pop_subtask, start_subtask, send_message, apply_patch_to_note, finish_subtask
+from agents import Agent, ModelSettings, StopAtTools
+from .tools import (brainstorm, pop_subtask, start_subtask, start_parallel_subtasks, send_message,
+                    apply_patch_to_note, undo_note_patch, redo_note_patch, finish_subtask,
+                    read_note_sections, web_search, fetch_pages)
 from .model import model
 from .dynamic_instruction import dynamic_instructions
+from .telemetry import instrumented_tool
 
 NAME = "main-agent"
 
+# 面向用户或切换阶段的工具，调用后结束本轮
+TURN_ENDING_TOOLS = ["send_message", "finish_subtask", "pop_subtask"]
+
 agent = Agent(
     name=NAME,
     instructions=dynamic_instructions,
     model=model,
-    tools=[brainstorm, pop_subtask, start_subtask,
-           send_message, apply_patch_to_note, finish_subtask],
+    # 包装后的工具只在 run_turn 启用 telemetry 时记录耗时和结果
+    tools=[instrumented_tool(tool) for tool in (brainstorm, pop_subtask, start_subtask, start_parallel_subtasks,
+                                                send_message, apply_patch_to_note, undo_note_patch,
+                                                redo_note_patch, finish_subtask, read_note_sections,
+                                                web_search, fetch_pages)],
     tool_use_behavior="stop_on_first_tool"
 )
+
+# 多工具模式：brainstorm / start_subtask / apply_patch_to_note / web_search 等执行后在同一次运行中继续，
+# 只有 TURN_ENDING_TOOLS 结束本轮。每次只允许一个工具调用，栈的变化按调用顺序生效
+multi_tool_agent = agent.clone(
+    tool_use_behavior=StopAtTools(stop_at_tool_names=TURN_ENDING_TOOLS),
+    model_settings=ModelSettings(parallel_tool_calls=False),
+)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import bisect
+import itertools
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Mapping
+from pydantic_core import core_schema
+
+if TYPE_CHECKING:
+    from agents import TResponseInputItem
+
+
+class MessageLog:
+    """
+    追加式消息存储。每条消息只存一份，消息的 id 就是它在日志中的下标。
+
+    Subtask 只保存 id 列表；对某条消息的改写（例如 pop_subtask 写入的总结）
+    以 overlay 的形式另存，物化时合并，不修改日志中的原始消息。
+
+    fork() 得到的分支与原日志共享已有的消息：分支时原日志的尾部被封存为只读段，
+    之后双方各自向新的尾部追加，互不影响（copy-on-write）。
+    """
+
+    def __init__(self, items: Iterable[TResponseInputItem] = ()):
+        self._sealed: List[List[TResponseInputItem]] = []  # 可能与其它分支共享的只读段
+        self._offsets: List[int] = []  # 每个只读段第一条消息的 id
+        self._sealed_len = 0
+        self._items: List[TResponseInputItem] = list(items)  # 本分支独有的尾部，id 从 _sealed_len 开始
+
+    def __len__(self) -> int:
+        return self._sealed_len + len(self._items)
+
+    def __iter__(self) -> Iterator[TResponseInputItem]:
+        return itertools.chain(*self._sealed, self._items)
+
+    def __getitem__(self, message_id: int) -> TResponseInputItem:
+        if message_id < 0:
+            message_id += len(self)
+        if message_id >= self._sealed_len:
+            return self._items[message_id - self._sealed_len]
+        if message_id < 0:
+            raise IndexError(message_id)
+        k = bisect.bisect_right(self._offsets, message_id) - 1
+        return self._sealed[k][message_id - self._offsets[k]]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, MessageLog):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'MessageLog({len(self)} items)'
+
+    def append(self, item: TResponseInputItem) -> int:
+        self._items.append(item)
+        return len(self) - 1
+
+    def extend(self, items: Iterable[TResponseInputItem]) -> range:
+        start = len(self)
+        self._items.extend(items)
+        return range(start, len(self))
+
+    def items_from(self, start: int) -> List[TResponseInputItem]:
+        return [self[i] for i in range(start, len(self))]
+
+    def fork(self) -> 'MessageLog':
+        """返回共享当前全部消息的分支日志"""
+        if self._items:
+            self._sealed.append(self._items)
+            self._offsets.append(self._sealed_len)
+            self._sealed_len += len(self._items)
+            self._items = []
+        forked = MessageLog()
+        forked._sealed = list(self._sealed)
+        forked._offsets = list(self._offsets)
+        forked._sealed_len = self._sealed_len
+        return forked
+
+    def shares_prefix(self, other: 'MessageLog') -> bool:
+        """other 的全部消息是否构成本日志的前缀。同源分支按共享段判断，否则逐条比较"""
+        if len(other) > len(self):
+            return False
+        if not other._items and len(other._sealed) <= len(self._sealed) \
+                and all(a is b for a, b in zip(other._sealed, self._sealed)):
+            return True
+        return all(self[i] == item for i, item in enumerate(other))
+
+    def materialize(self, message_ids: Iterable[int],
+                    overlays: Mapping[int, Dict[str, Any]] | None = None) -> List[TResponseInputItem]:
+        """按 id 取出消息，并合并 overlay（返回新 dict，不影响日志）"""
+        items = self._items if not self._sealed else self
+        if not overlays:
+            return [items[i] for i in message_ids]
+        result: List[TResponseInputItem] = []
+        for i in message_ids:
+            overlay = overlays.get(i)
+            result.append({**items[i], **overlay} if overlay else items[i])  # type: ignore
+        return result
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: Any) -> core_schema.CoreSchema:
+        # 序列化为普通列表；反序列化时不逐条校验消息结构，保证大日志的加载速度
+        def validate(value: Any) -> 'MessageLog':
+            if isinstance(value, MessageLog):
+                return value
+            if isinstance(value, list):
+                return cls(value)
+            raise ValueError('MessageLog must be a list of messages')
+
+        return core_schema.no_info_plain_validator_function(
+            validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda log: list(log)),
+        )
@@ -1,14 +1,127 @@
-from agents.extensions.models.litellm_model import LitellmModel
-import dotenv
+from agents import ModelSettings
+from agents.models.interface import Model
+from functools import cache
+from typing import Any, Callable, Dict
+from .resilient_model import ResilientModel, RetryPolicy
+from .response_cache import CachedModel, ResponseCache
 import os
 
-dotenv.load_dotenv()
-api_key = os.getenv("API_KEY") 
-base_url = os.getenv("BASE_URL")
-model_name = os.getenv("MODEL_NAME") or ''
-assert model_name, "MODEL_NAME environment variable must be set."
-model=LitellmModel(
-    model=model_name,
-    api_key=api_key,
-    base_url=base_url
-)
\ No newline at end of file
+
+class LazyModel(Model):
+    """
+    第一次请求时才构建的模型：读取 .env、导入 litellm 和检查配置都推迟到这时，
+    导入 agent 包、构建上下文或只跑本地替身模型的进程不必承担这部分启动开销。
+    """
+
+    def __init__(self, factory: Callable[[], Model]):
+        self._factory = factory
+        self._model: Model | None = None
+
+    @property
+    def model(self) -> Model:
+        if self._model is None:
+            self._model = self._factory()
+        return self._model
+
+    async def get_response(self, *args: Any, **kwargs: Any):
+        return await self.model.get_response(*args, **kwargs)
+
+    def stream_response(self, *args: Any, **kwargs: Any):
+        return self.model.stream_response(*args, **kwargs)
+
+
+@cache
+def load_env() -> None:
+    import dotenv
+    dotenv.load_dotenv()
+
+
+@cache
+def response_cache() -> ResponseCache | None:
+    """
+    响应缓存：LLM_CACHE=read_write 命中时不再调用模型，未命中时写入；
+    LLM_CACHE=replay 为严格回放，未命中直接报错（崩溃复现、回归测试、CI）
+    """
+    load_env()
+    if not (cache_mode := os.getenv("LLM_CACHE")):
+        return None
+    assert cache_mode in ("read_write", "replay"), "LLM_CACHE must be read_write or replay."
+    return ResponseCache(os.getenv("LLM_CACHE_DIR") or 'logs/llm_cache',
+                         max_bytes=int(os.getenv("LLM_CACHE_MAX_MB") or 512) * 1024 * 1024)
+
+
+@cache
+def retry_policy() -> RetryPolicy:
+    """
+    模型请求的超时与重试：LLM_ATTEMPT_TIMEOUT 单次请求超时（秒），LLM_MAX_ATTEMPTS 最多尝试次数，
+    LLM_HEDGE_AFTER 请求超过该秒数未返回时发出对冲请求（留空不对冲）
+    """
+    load_env()
+    defaults = RetryPolicy()
+    return RetryPolicy(
+        attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT") or defaults.attempt_timeout),  # type: ignore[arg-type]
+        max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS") or defaults.max_attempts),
+        hedge_after=float(hedge) if (hedge := os.getenv("LLM_HEDGE_AFTER")) else None,
+    )
+
+
+@cache
+def shared_http_client() -> Any:
+    """
+    所有 OpenAI 兼容请求共用的连接池（litellm.aclient_session），复用 keep-alive 连接。
+    LLM_MAX_CONNECTIONS 为连接数上限。httpx 的连接绑定事件循环，进程中应只有一个事件循环使用它
+    """
+    import httpx
+    import litellm
+    load_env()
+    max_connections = int(os.getenv("LLM_MAX_CONNECTIONS") or 32)
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=60),
+        timeout=httpx.Timeout(None, connect=10),  # 整体超时由 ResilientModel 控制
+        follow_redirects=True,
+    )
+    litellm.aclient_session = client
+    return client
+
+
+def build_model(model_name: str, api_key: str | None, base_url: str | None) -> Model:
+    """LitellmModel，外面依次包上超时/重试/对冲和（可选的）响应缓存。缓存命中时不经过重试逻辑"""
+    from agents.extensions.models.litellm_model import LitellmModel
+    shared_http_client()
+    # 重试由 ResilientModel 负责，关闭 litellm 内 openai 客户端自带的重试，避免重试次数相乘
+    built: Model = ResilientModel(LitellmModel(model=model_name, api_key=api_key, base_url=base_url),
+                                  retry_policy(), attempt_settings=ModelSettings(extra_args={'max_retries': 0}))
+    if (cache := response_cache()) is not None:
+        built = CachedModel(built, cache, namespace=model_name, mode=os.getenv("LLM_CACHE"))  # type: ignore[arg-type]
+    return built
+
+
+@cache
+def _main_model() -> Model:
+    load_env()
+    model_name = os.getenv("MODEL_NAME") or ''
+    assert model_name, "MODEL_NAME environment variable must be set."
+    return build_model(model_name, os.getenv("API_KEY"), os.getenv("BASE_URL"))
+
+
+@cache
+def _summarizer_model() -> Model:
+    load_env()
+    if not (model_name := os.getenv("SUMMARIZER_MODEL_NAME")):
+        return _main_model()
+    return build_model(model_name,
+                       os.getenv("SUMMARIZER_API_KEY") or os.getenv("API_KEY"),
+                       os.getenv("SUMMARIZER_BASE_URL") or os.getenv("BASE_URL"))
+
+
+model = LazyModel(_main_model)
+
+# 总结阶段（summarizing）可以使用更便宜/更快的模型；未配置时与主模型相同
+summarizer_model = LazyModel(_summarizer_model)
+
+
+def get_stage_models() -> Dict[str, Model]:
+    """阶段 -> 模型。未列出的阶段使用 agent 自身的模型（或 RunConfig 中的覆盖）"""
+    load_env()
+    return {"summarizing": summarizer_model} if os.getenv("SUMMARIZER_MODEL_NAME") else {}
@@ -0,0 +1,450 @@
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterable, List, Tuple
+from .patch_matching import PatchMatcher, PatchMatchError, merge_replacement, normalize_line
+
+
+BEGIN = '*** Begin Patch'
+END = '*** End Patch'
+HUNK_START = '@@'
+END_OF_FILE = '*** End of File'
+
+
+@dataclass
+class Hunk:
+    header: str
+    lines: List[str]
+
+
+def to_lines(s: str) -> List[str]:
+    # 统一换行：\r\n 或 \r -> \n
+    s = s.replace('\r\n', '\n').replace('\r', '\n')
+    return s.split('\n')
+
+
+def is_section_header(line: str) -> bool:
+    # 简单约定：以 "#" 开头视为一个分节（markdown 风格）
+    return line.strip().startswith('#')
+
+
+def parse_patch(patch: str) -> List[Hunk]:
+    """解析自定义 patch（*** Begin Patch / *** End Patch，@@ 开头表示 hunk）"""
+    # 如果不像一个 patch，就直接报错
+    trimmed = patch.strip()
+    if not (trimmed.startswith(BEGIN) and trimmed.endswith(END)):
+        raise ValueError('Invalid patch format')
+
+    patch_lines = to_lines(trimmed)
+
+    # 提取 @@ 分块
+    hunks: List[Hunk] = []
+    i = 0
+    # 跳过第一行 *** Begin Patch
+    if i < len(patch_lines) and patch_lines[i].strip() == BEGIN:
+        i += 1
+
+    while i < len(patch_lines):
+        line = patch_lines[i]
+        if line.strip() == END:
+            break
+        if line.startswith(HUNK_START):
+            # 解析 header
+            header = line[len(HUNK_START):].strip()
+            i += 1
+            hunk_lines: List[str] = []
+            while i < len(patch_lines):
+                l = patch_lines[i]
+                if l.startswith(HUNK_START) or l.strip() in (END, END_OF_FILE):
+                    break
+                # 只接受以 ' ', '-', '+' 开头的行；其他行当作上下文（以空格补齐）
+                if l.startswith((' ', '-', '+')):
+                    hunk_lines.append(l)
+                else:
+                    hunk_lines.append(' ' + l)
+                i += 1
+            hunks.append(Hunk(header=header, lines=hunk_lines))
+            # 如果遇到 *** End of File，跳过它
+            if i < len(patch_lines) and patch_lines[i].strip() == END_OF_FILE:
+                i += 1
+        else:
+            # 非法或空行，跳过
+            i += 1
+    return hunks
+
+
+def build_expected_and_replacement(hunk_lines: List[str]) -> Tuple[List[str], List[str]]:
+    expected: List[str] = []
+    replacement: List[str] = []
+    for hl in hunk_lines:
+        if hl == '':
+            expected.append('')
+            replacement.append('')
+            continue
+        tag = hl[0]
+        txt = hl[1:]
+        if tag == ' ':
+            expected.append(txt)
+            replacement.append(txt)
+        elif tag == '-':
+            expected.append(txt)
+        elif tag == '+':
+            replacement.append(txt)
+    return expected, replacement
+
+
+def build_context_only(hunk_lines: List[str]) -> List[str]:
+    return [l[1:] for l in hunk_lines if l.startswith(' ')]
+
+
+@dataclass
+class AppliedHunk:
+    """一个 hunk 的应用结果。kind 为 exact / normalized / fuzzy / context / append"""
+    header: str
+    kind: str
+    score: float = 1.0
+
+
+@dataclass(eq=False)
+class NoteSection:
+    """
+    note 中的一个分节：header 行（前言部分为 None）及其下的各行。
+    分节对象创建后不再修改，编辑时整体替换为新对象，因此可以安全地在快照之间共享。
+    """
+    header: str | None
+    lines: List[str]
+    _line_index: Dict[str, List[int]] | None = field(default=None, repr=False)
+    _normalized_lines: List[str] | None = field(default=None, repr=False)
+
+    @property
+    def line_index(self) -> Dict[str, List[int]]:
+        """行内容 -> 出现位置（升序），首次查找时构建"""
+        if self._line_index is None:
+            index: Dict[str, List[int]] = {}
+            for i, line in enumerate(self.lines):
+                index.setdefault(line, []).append(i)
+            self._line_index = index
+        return self._line_index
+
+    @property
+    def normalized_lines(self) -> List[str]:
+        """容错匹配用的规范化行，首次使用时计算"""
+        if self._normalized_lines is None:
+            self._normalized_lines = [normalize_line(l) for l in self.lines]
+        return self._normalized_lines
+
+    def find(self, needle: List[str], start: int = 0, end: int | None = None) -> int:
+        """在 lines[start:end] 中查找连续子序列，返回起始位置，找不到返回 -1"""
+        if not needle:
+            return -1
+        if end is None:
+            end = len(self.lines)
+        last_start = end - len(needle)
+        lines = self.lines
+        for pos in self.line_index.get(needle[0], ()):
+            if pos < start:
+                continue
+            if pos > last_start:
+                break
+            if lines[pos:pos + len(needle)] == needle:
+                return pos
+        return -1
+
+    def all_lines(self) -> List[str]:
+        return self.lines if self.header is None else [self.header, *self.lines]
+
+
+def section_from_lines(lines: List[str]) -> NoteSection:
+    """all_lines() 的逆操作"""
+    if lines and is_section_header(lines[0]):
+        return NoteSection(lines[0], lines[1:])
+    return NoteSection(None, list(lines))
+
+
+def section_changes(before: List[NoteSection],
+                    after: List[NoteSection]) -> List[Tuple[int, List[NoteSection], List[NoteSection]]]:
+    """
+    修改前后两个分节列表的差异：[(修改前的起始下标, 被替换的分节, 新分节)]，按下标升序。
+    未修改的分节是同一个对象，按对象比较；整体重建过的区间再去掉首尾内容相同的分节
+    """
+    matcher = SequenceMatcher(None, [id(s) for s in before], [id(s) for s in after], autojunk=False)
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        old, new = before[i1:i2], after[j1:j2]
+        while old and new and old[0].all_lines() == new[0].all_lines():
+            old, new, i1 = old[1:], new[1:], i1 + 1
+        while old and new and old[-1].all_lines() == new[-1].all_lines():
+            old, new = old[:-1], new[:-1]
+        if old or new:
+            changes.append((i1, old, new))
+    return changes
+
+
+def describe_change(old: List[NoteSection], new: List[NoteSection]) -> List[str]:
+    """用 patch 语言的形式描述一处修改：按分节分组的 '-' / '+' 行"""
+    old_lines = [line for section in old for line in section.all_lines()]
+    new_lines = [line for section in new for line in section.all_lines()]
+    headers = [section.header for section in new for _ in section.all_lines()]
+    old_headers = [section.header for section in old for _ in section.all_lines()]
+    result: List[str] = []
+    current: str | None = None
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == 'equal' or not any(line.strip() for line in old_lines[i1:i2] + new_lines[j1:j2]):
+            continue  # 只增删空行（例如 note 末尾的空行被整理）不展示
+        header = headers[j1] if j1 < len(headers) else (old_headers[i1] if i1 < len(old_headers) else None)
+        header = header or (headers[-1] if headers else None) or '(top)'
+        if header != current:
+            result.append(f'@@ {header}')
+            current = header
+        result += [f'-{line}' for line in old_lines[i1:i2]]
+        result += [f'+{line}' for line in new_lines[j1:j2]]
+    return result
+
+
+def split_sections(header: str | None, lines: Iterable[str]) -> List[NoteSection]:
+    sections = [NoteSection(header, [])]
+    for line in lines:
+        if is_section_header(line):
+            sections.append(NoteSection(line, []))
+        else:
+            sections[-1].lines.append(line)
+    return sections
+
+
+class NoteDocument:
+    """
+    按 markdown header 分节索引的 note。
+
+    - header -> 分节下标的索引，定位分节为 O(1)；
+    - 每个分节单独保存行数组，并按行内容建立哈希索引，hunk 匹配只在目标分节内按候选位置校验；
+    - 一个 patch 的多个 hunk（以及多个 patch）在同一份结构上依次应用，只在最后渲染一次字符串。
+
+    不带 matcher 时 apply_patch 的语义与 agent.utils.apply_patch 完全一致；
+    带 matcher 时，精确匹配失败的 hunk 会再尝试规范化/模糊匹配，仍失败则抛出带最接近候选的 PatchMatchError。
+    """
+
+    def __init__(self, sections: List[NoteSection], matcher: PatchMatcher | None = None):
+        self.sections = sections
+        self.matcher = matcher
+        self._header_index: Dict[str, int] = {}
+        self._rendered: str | None = None
+        self._reindex()
+
+    @classmethod
+    def from_text(cls, text: str, matcher: PatchMatcher | None = None) -> 'NoteDocument':
+        doc = cls(split_sections(None, to_lines(text)), matcher)
+        doc._rendered = text
+        return doc
+
+    def render(self) -> str:
+        if self._rendered is None:
+            self._rendered = '\n'.join(
+                line for section in self.sections for line in section.all_lines())
+        return self._rendered
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def _reindex(self) -> None:
+        self._header_index = {}
+        for k, section in enumerate(self.sections):
+            if section.header is not None:
+                self._header_index.setdefault(section.header.strip(), k)
+
+    def replace_sections(self, start: int, stop: int, sections: List[NoteSection]) -> None:
+        self.sections[start:stop] = sections
+        self._reindex()
+        self._rendered = None
+
+    def section(self, header: str) -> NoteSection | None:
+        k = self._header_index.get(header.strip())
+        return self.sections[k] if k is not None else None
+
+    # ---- 定位 ----
+
+    def _locate_header(self, header: str) -> Tuple[int, int] | None:
+        """返回 (分节下标, 搜索起点)；搜索范围到该分节末尾为止"""
+        if not header:
+            return None
+        h = header.strip()
+        if is_section_header(h):
+            k = self._header_index.get(h)
+            return (k, 0) if k is not None else None
+        # header 不是 markdown 标题时，与原实现一样按普通行定位（较少见，线性扫描）
+        for k, section in enumerate(self.sections):
+            for offset, line in enumerate(section.lines):
+                if line.strip() == h:
+                    return k, offset + 1
+        return None
+
+    @staticmethod
+    def _find_in(lines: List[str], needle: List[str]) -> int:
+        """在展平的整篇文档中查找（未指定 header 或 header 不存在时），找不到返回 -1"""
+        if not needle:
+            return -1
+        first = needle[0]
+        for pos, line in enumerate(lines):
+            if line == first and lines[pos:pos + len(needle)] == needle:
+                return pos
+        return -1
+
+    # ---- 编辑 ----
+
+    def _splice(self, k: int, start: int, stop: int, items: List[str]) -> None:
+        """把第 k 个分节的 lines[start:stop] 替换为 items；新行中若出现 header 则拆分出新分节"""
+        section = self.sections[k]
+        new_lines = section.lines[:start] + items + section.lines[stop:]
+        if any(is_section_header(line) for line in items):
+            self.sections[k:k + 1] = split_sections(section.header, new_lines)
+            self._reindex()
+        else:
+            self.sections[k] = NoteSection(section.header, new_lines)
+        self._rendered = None
+
+    def _splice_flat(self, pos: int, remove_count: int, items: List[str]) -> None:
+        """按展平行号替换（可能跨分节），整体重建分节"""
+        flat = [line for section in self.sections for line in section.all_lines()]
+        flat[pos:pos + remove_count] = items
+        self.sections = split_sections(None, flat)
+        self._reindex()
+        self._rendered = None
+
+    def _append(self, items: List[str]) -> None:
+        last = len(self.sections) - 1
+        self._splice(last, len(self.sections[last].lines),
+                     len(self.sections[last].lines), items)
+
+    def _last_line(self) -> str | None:
+        for section in reversed(self.sections):
+            if section.lines:
+                return section.lines[-1]
+            if section.header is not None:
+                return section.header
+        return None
+
+    def _trim_end(self) -> None:
+        """等价于对渲染结果去掉末尾换行并 rstrip"""
+        while True:
+            section = self.sections[-1]
+            if section.lines and not section.lines[-1].strip():
+                self.sections[-1] = NoteSection(section.header, section.lines[:-1])
+                self._rendered = None
+                continue
+            break
+        section = self.sections[-1]
+        if section.lines:
+            if section.lines[-1] != section.lines[-1].rstrip():
+                self.sections[-1] = NoteSection(
+                    section.header, section.lines[:-1] + [section.lines[-1].rstrip()])
+                self._rendered = None
+        elif section.header is not None:
+            if section.header != section.header.rstrip():
+                self.sections[-1] = NoteSection(section.header.rstrip(), [])
+                self._rendered = None
+        else:
+            # 整篇为空：与 ''.split('\n') 保持一致
+            self.sections[-1] = NoteSection(None, [''])
+            self._rendered = None
+
+    def apply_hunk(self, h: Hunk) -> AppliedHunk:
+        expected, replacement = build_expected_and_replacement(h.lines)
+        context_only = build_context_only(h.lines)
+        has_removals = any(l.startswith('-') for l in h.lines)
+        requires_exact_match = has_removals or len(context_only) > 0
+        header_label = (h.header or '').strip()
+
+        # 确定搜索范围：找到 header 时只在该分节内搜索，否则在整篇文档中搜索
+        located = self._locate_header(h.header) if h.header else None
+        lines: List[str]
+        find: Callable[[List[str]], int]
+        splice: Callable[[int, int, List[str]], None]
+        normalized_lines: List[str] | None = None
+        if located is not None:
+            k, search_start = located
+            section = self.sections[k]
+            lines = section.lines
+            def find(needle): return section.find(needle, search_start)
+            def splice(pos, remove_count, items): self._splice(k, pos, pos + remove_count, items)
+        else:
+            search_start = 0
+            lines = [line for section in self.sections for line in section.all_lines()]
+            def find(needle): return self._find_in(lines, needle)
+            splice = self._splice_flat
+
+        # 1) 期望块替换
+        where = find(expected)
+        if where >= 0:
+            splice(where, len(expected), replacement)
+            return AppliedHunk(header_label, 'exact')
+
+        closest = None
+        ambiguous = False
+        if requires_exact_match and self.matcher is not None:
+            if located is not None:
+                normalized_lines = self.sections[located[0]].normalized_lines
+            result = self.matcher.match(lines, expected, search_start,
+                                        normalized_lines=normalized_lines)
+            if result.match is not None:
+                m = result.match
+                window = lines[m.start:m.start + m.length]
+                splice(m.start, m.length, merge_replacement(h.lines, window))
+                return AppliedHunk(header_label, m.kind, m.score)
+            closest, ambiguous = result.closest, result.ambiguous
+
+        # 2) 仅上下文匹配后插入新增
+        if len(context_only) > 0:
+            # 只插入 '+' 产生且不在上下文里的行
+            to_insert = [l for l in replacement if l not in context_only]
+            ctx_where = find(context_only)
+            if ctx_where >= 0:
+                insert_pos = ctx_where + len(context_only)  # 紧跟上下文末尾插入
+                splice(insert_pos, 0, to_insert)
+                return AppliedHunk(header_label, 'context')
+            if self.matcher is not None:
+                result = self.matcher.match(lines, context_only, search_start,
+                                            normalized_lines=normalized_lines)
+                if result.match is not None:
+                    m = result.match
+                    splice(m.start + m.length, 0, to_insert)
+                    return AppliedHunk(header_label, 'context', m.score)
+
+        if requires_exact_match:
+            closest_lines = lines[closest.start:closest.start + closest.length] if closest else []
+            raise PatchMatchError(header_label, expected, closest, closest_lines, ambiguous)
+
+        # 3) 兜底：基于 header 追加；若无 header 或未找到，则在文末追加
+        if located is not None:
+            k = located[0]
+            self._splice(k, len(self.sections[k].lines),
+                         len(self.sections[k].lines), replacement)
+        else:
+            # 如果提供了 header 但未找到，先创建 header
+            items: List[str] = []
+            if h.header:
+                last_line = self._last_line()
+                if last_line is not None and last_line != '':
+                    items.append('')
+                items.append(h.header)
+            self._append(items + replacement)
+        return AppliedHunk(header_label, 'append')
+
+    def apply_patch(self, patch: str) -> List[AppliedHunk]:
+        return self.apply_patches([patch])
+
+    def apply_patches(self, patches: Iterable[str]) -> List[AppliedHunk]:
+        """依次应用多个 patch；任一 hunk 失败则整体回滚"""
+        saved_sections = list(self.sections)
+        saved_rendered = self._rendered
+        applied: List[AppliedHunk] = []
+        try:
+            for patch in patches:
+                for h in parse_patch(patch):
+                    applied.append(self.apply_hunk(h))
+                self._trim_end()
+        except Exception:
+            self.sections = saved_sections
+            self._rendered = saved_rendered
+            self._reindex()
+            raise
+        return applied
@@ -0,0 +1,126 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+from .note import NoteDocument, NoteSection
+from .tokens import default_counter
+
+# 英文/数字按单词切分；中日文没有分词器，按相邻两字切分（单字成段时保留单字）
+_TERM_RUN = re.compile(r'[a-z0-9_]+|[\u3400-\u4dbf\u4e00-\u9fff\u3040-\u30ff]+')
+_WORD = re.compile(r'[a-z0-9_]+')
+
+
+def terms(text: str) -> List[str]:
+    result: List[str] = []
+    for run in _TERM_RUN.findall(text.lower()):
+        if _WORD.fullmatch(run) or len(run) == 1:
+            result.append(run)
+        else:
+            result.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return result
+
+
+def message_text(message: Any) -> str:
+    """消息中参与检索的文本：工具参数、工具输出和消息内容"""
+    if not isinstance(message, dict):
+        return ''
+    if message.get('type') == 'function_call':
+        return message.get('arguments', '')
+    if message.get('type') == 'function_call_output':
+        output = message.get('output', '')
+        return output if isinstance(output, str) else ''
+    content = message.get('content', '')
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content if isinstance(content, str) else ''
+
+
+@dataclass
+class _SectionStats:
+    section: NoteSection
+    term_counts: Counter
+    length: int
+    tokens: int
+
+
+@dataclass
+class NoteSelection:
+    sections: List[NoteSection]  # 注入的分节（按 note 中的顺序）
+    omitted: List[NoteSection]   # 未注入的分节
+
+    def render(self) -> str:
+        return '\n'.join(line for section in self.sections for line in section.all_lines())
+
+
+class NoteIndex:
+    """
+    note 分节的本地 BM25 索引，不访问网络。
+    NoteSection 创建后不再修改，按对象缓存各分节的词频和 token 数，note 被编辑后只为新分节重新计算。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._stats: Dict[int, _SectionStats] = {}
+
+    def _section_stats(self, document: NoteDocument) -> List[_SectionStats]:
+        stats: Dict[int, _SectionStats] = {}
+        for section in document.sections:
+            cached = self._stats.get(id(section))
+            if cached is None or cached.section is not section:
+                text = '\n'.join(section.all_lines())
+                section_terms = terms(text)
+                cached = _SectionStats(section, Counter(section_terms), len(section_terms),
+                                       default_counter.count_text(text))
+            stats[id(section)] = cached
+        self._stats = stats
+        return list(stats.values())
+
+    def rank(self, document: NoteDocument, query: str) -> List[Tuple[float, NoteSection]]:
+        """按与 query 的相关度从高到低返回带标题的分节（不含前言）"""
+        stats = [s for s in self._section_stats(document) if s.section.header is not None]
+        if not stats:
+            return []
+        query_terms = set(terms(query))
+        average_length = sum(s.length for s in stats) / len(stats) or 1.0
+        document_frequency = Counter(term for s in stats for term in query_terms if term in s.term_counts)
+        scored: List[Tuple[float, NoteSection]] = []
+        for s in stats:
+            score = 0.0
+            for term in query_terms:
+                tf = s.term_counts.get(term)
+                if not tf:
+                    continue
+                df = document_frequency[term]
+                idf = math.log(1 + (len(stats) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * s.length / average_length))
+            scored.append((score, s.section))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored
+
+    def select(self, document: NoteDocument, query: str, budget: int) -> NoteSelection:
+        """
+        选出与 query 相关的分节，总 token 数不超过 budget（前言、开头的一级标题和最相关的一节总是保留）。
+        整个 note 不超过 budget 时全部注入
+        """
+        stats = {id(s.section): s for s in self._section_stats(document)}
+        if sum(s.tokens for s in stats.values()) <= budget:
+            return NoteSelection(list(document.sections), [])
+        chosen = {id(section) for section in document.sections if section.header is None}
+        titled = [section for section in document.sections if section.header is not None]
+        if titled and titled[0].header.startswith('# '):  # type: ignore
+            chosen.add(id(titled[0]))
+        used = sum(stats[i].tokens for i in chosen)
+        picked = False
+        for score, section in self.rank(document, query):
+            if score <= 0:
+                break
+            tokens = stats[id(section)].tokens
+            if used + tokens > budget and picked:
+                continue
+            chosen.add(id(section))
+            used += tokens
+            picked = True
+        return NoteSelection([s for s in document.sections if id(s) in chosen],
+                             [s for s in document.sections if id(s) not in chosen])
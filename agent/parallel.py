@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import List, Mapping, Sequence, Tuple
+from agents import Agent, Model, RunConfig
+from .context import StackAndHeapContext
+from .runtime import run_turn
+from .summarizer import summary_results
+from .telemetry import detached_context
+
+logger = logging.getLogger(__name__)
+
+# 并行子任务在独立的对话中运行，不能与用户交互，也不再继续并行展开
+DETACHED_EXCLUDED_TOOLS = ("send_message", "start_parallel_subtasks")
+
+
+@dataclass
+class SiblingResult:
+    subtask_id: str
+    return_value: str
+    patches: List[str] = field(default_factory=list)
+    finished: bool = True
+
+
+@dataclass
+class MergeConflict:
+    subtask_id: str
+    patch: str
+    error: str
+    applied: bool = False  # True 表示按近似匹配应用了，可能覆盖了其它子任务的修改
+
+
+class ParallelSubtaskRunner:
+    """
+    并行运行多个兄弟子任务。
+    每个子任务在父上下文的 copy-on-write 分支中压入自己的 frame，作为独立的对话并发运行到 pop_subtask；
+    分支里的 note 修改不影响父上下文。全部结束后按子任务给出的顺序把各自成功应用过的 note patch
+    重新应用到父上下文，与之前的 patch 冲突（无法定位或已被改动）的 patch 不应用，连同原文一起报告给父任务。
+    父任务在同一个工具调用的输出中得到所有返回值。
+
+    子任务看到的是本轮开始时父上下文中的对话，同一次运行中尚未写回上下文的工具调用不可见。
+    子任务在不绑定父任务当前轮的 contextvars 上下文中运行，它们的工具调用和模型用量不计入父任务的轮次指标。
+    """
+
+    def __init__(self, starting_agent: Agent[StackAndHeapContext] | None = None,
+                 run_config: RunConfig | None = None,
+                 stage_models: Mapping[str, Model] | None = None,
+                 max_turns: int = 30,
+                 max_concurrency: int = 4):
+        self.starting_agent = starting_agent
+        self.run_config = run_config
+        self.stage_models = stage_models
+        self.max_turns = max_turns  # 每个子任务最多运行的轮数
+        self.max_concurrency = max_concurrency
+        self._agent: Agent[StackAndHeapContext] | None = None
+
+    @property
+    def agent(self) -> Agent[StackAndHeapContext]:
+        if self._agent is None:
+            base = self.starting_agent
+            if base is None:
+                from .main_agent import agent as base
+            self._agent = base.clone(tools=[tool for tool in base.tools
+                                             if tool.name not in DETACHED_EXCLUDED_TOOLS])
+        return self._agent
+
+    async def run(self, ctx: StackAndHeapContext, subtasks: Sequence[Tuple[str, str]],
+                  parent_call_id: str = '') -> str:
+        """
+        并发运行 (subtask_id, subtask_goal) 列表中的子任务，合并 note，返回给父任务的报告。
+        parent_call_id 为 start_parallel_subtasks 的调用 id，用于生成各子任务对话中确定的 start_subtask 调用 id
+        """
+        ids = [subtask_id for subtask_id, _ in subtasks]
+        if len(set(ids)) != len(ids):
+            raise ValueError(f'Duplicate subtask ids: {ids}')
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def limited(subtask_id: str, goal: str) -> SiblingResult:
+            async with semaphore:
+                return await self._run_sibling(ctx, subtask_id, goal, parent_call_id)
+
+        # 调用发生在父任务的轮内，子任务不能继承该轮的 telemetry recorder
+        results = await asyncio.gather(*(asyncio.create_task(limited(subtask_id, goal), context=detached_context())
+                                         for subtask_id, goal in subtasks))
+        applied, conflicts = merge_note_patches(ctx, results)
+        return merge_report(results, applied, conflicts)
+
+    async def _run_sibling(self, ctx: StackAndHeapContext, subtask_id: str, goal: str,
+                           parent_call_id: str = '') -> SiblingResult:
+        sibling = sibling_context(ctx, subtask_id, goal, parent_call_id)
+        depth = len(ctx.stack)
+        start = len(sibling.chat_history)
+        try:
+            for _ in range(self.max_turns):
+                if len(sibling.stack) <= depth:
+                    break
+                await run_turn(sibling, self.agent, run_config=self.run_config,
+                               stage_models=self.stage_models)
+        except Exception as e:
+            logger.exception('Parallel subtask %s failed', subtask_id)
+            patches, _ = summary_results(sibling, start)
+            return SiblingResult(subtask_id, f'(failed: {e})', patches, finished=False)
+        patches, return_value = summary_results(sibling, start)
+        if return_value is None:
+            return SiblingResult(subtask_id, f'(not finished within {self.max_turns} turns)', patches,
+                                 finished=False)
+        return SiblingResult(subtask_id, return_value, patches)
+
+
+def sibling_context(ctx: StackAndHeapContext, subtask_id: str, goal: str,
+                    parent_call_id: str = '') -> StackAndHeapContext:
+    """
+    父上下文的分支，栈顶压入子任务 frame，并补上对应的 start_subtask 调用，使其与普通子任务的对话形式一致。
+    补上的调用 id 由父调用 id 和 subtask_id 确定，重复运行时请求不变，响应缓存和回放才能命中
+    """
+    sibling = ctx.fork()
+    digest = hashlib.sha256(f'{parent_call_id}\0{subtask_id}'.encode('utf-8')).hexdigest()[:16]
+    call_id = f'call_parallel_{digest}'
+    sibling.push_subtask(subtask_id, goal, start_call_id=call_id)
+    sibling.add_messages([
+        {'type': 'function_call', 'name': 'start_subtask', 'call_id': call_id, 'status': 'completed',
+         'arguments': json.dumps({'subtask_id': subtask_id, 'subtask_goal': goal}, ensure_ascii=False)},
+        {'type': 'function_call_output', 'call_id': call_id,
+         'output': f'subtask started successfully. You are now working on subtask: {subtask_id} '
+                   f'with subgoal: {goal}\nThis subtask runs in parallel with other subtasks and '
+                   f'cannot talk to the user.'},
+    ])
+    return sibling
+
+
+def merge_note_patches(ctx: StackAndHeapContext,
+                       results: Sequence[SiblingResult]) -> Tuple[int, List[MergeConflict]]:
+    """
+    按顺序把各子任务的 patch 应用到父上下文的 note，返回成功数和冲突。
+    子任务写 patch 时看到的是分支前的 note，在父 note 上只能近似匹配的 patch 也作为冲突报告
+    """
+    applied = 0
+    conflicts: List[MergeConflict] = []
+    for result in results:
+        for patch in result.patches:
+            try:
+                hunks = ctx.apply_patch_to_note(patch)
+            except ValueError as e:
+                conflicts.append(MergeConflict(result.subtask_id, patch, str(e)))
+                continue
+            applied += 1
+            approximate = [h for h in hunks if h.kind in ('normalized', 'fuzzy')]
+            if approximate:
+                conflicts.append(MergeConflict(
+                    result.subtask_id, patch,
+                    '; '.join(f'"{h.header}" matched approximately ({h.kind}, similarity {h.score:.2f})'
+                              for h in approximate),
+                    applied=True))
+    return applied, conflicts
+
+
+def merge_report(results: Sequence[SiblingResult], applied: int, conflicts: Sequence[MergeConflict]) -> str:
+    lines = ['Parallel subtasks finished. Return values:']
+    lines += [f'- {result.subtask_id}: {result.return_value}' for result in results]
+    lines.append(f'Note merge: {applied} patch(es) applied, {len(conflicts)} conflict(s).')
+    for conflict in conflicts:
+        if conflict.applied:
+            lines.append(f'Patch from {conflict.subtask_id} was applied to the closest lines ({conflict.error}). '
+                         f'Check that it did not overwrite another subtask\'s change:\n{conflict.patch}')
+        else:
+            lines.append(f'Conflicting patch from {conflict.subtask_id} was NOT applied ({conflict.error}). '
+                         f'Re-apply it manually if it is still needed:\n{conflict.patch}')
+    return '\n'.join(lines)
@@ -0,0 +1,144 @@
+import unicodedata
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import List, Literal, Sequence
+
+
+# NFKC 之外，再把常见的中文全角标点折叠为 ASCII
+PUNCTUATION_MAP = str.maketrans({
+    '。': '.', '、': ',', '“': '"', '”': '"', '‘': "'", '’': "'",
+    '「': '"', '」': '"', '『': '"', '』': '"', '【': '[', '】': ']',
+    '《': '<', '》': '>', '〈': '<', '〉': '>', '—': '-', '～': '~',
+})
+
+
+def normalize_line(line: str) -> str:
+    """忽略首尾/连续空白、全角半角差异后的行内容"""
+    line = unicodedata.normalize('NFKC', line).translate(PUNCTUATION_MAP)
+    return ' '.join(line.split())
+
+
+@dataclass
+class LineMatch:
+    start: int
+    length: int
+    kind: Literal['exact', 'normalized', 'fuzzy']
+    score: float = 1.0
+
+
+class PatchMatchError(ValueError):
+    """hunk 无法匹配。附带最接近的候选，便于 agent 一次修正 patch"""
+
+    def __init__(self, header: str, expected: List[str],
+                 closest: LineMatch | None = None, closest_lines: Sequence[str] = (),
+                 ambiguous: bool = False):
+        self.header = header
+        self.expected = expected
+        self.closest = closest
+        self.closest_lines = list(closest_lines)
+        self.ambiguous = ambiguous
+        super().__init__(self._format())
+
+    def _format(self) -> str:
+        location_msg = f' near "{self.header}"' if self.header else ''
+        message = f'Patch hunk{location_msg} did not match target content'
+        if self.closest is None:
+            return message
+        lines = [message + '.']
+        if self.ambiguous:
+            lines.append('Several places match about equally well; add context lines (" " prefix) to disambiguate.')
+        lines.append(f'Closest candidate (similarity {self.closest.score:.2f}):')
+        lines.extend(f'  |{l}' for l in self.closest_lines)
+        lines.append('Your hunk expected:')
+        lines.extend(f'  |{l}' for l in self.expected)
+        lines.append('Copy the candidate lines exactly in "-"/" " lines and retry.')
+        return '\n'.join(lines)
+
+
+@dataclass
+class MatchResult:
+    match: LineMatch | None
+    closest: LineMatch | None = None
+    ambiguous: bool = False
+
+
+@dataclass
+class PatchMatcher:
+    """
+    精确匹配失败后的容错匹配：
+      1) 规范化匹配：忽略空白与全角/半角标点差异；
+      2) 有界模糊匹配：逐行相似度取平均，超过阈值且不存在同样接近的其它位置时采用。
+    """
+    fuzzy_threshold: float = 0.85
+    ambiguity_margin: float = 0.03
+    max_fuzzy_lines: int = 2000  # 搜索范围超过该行数时跳过模糊匹配
+
+    def match(self, lines: Sequence[str], needle: List[str],
+              start: int = 0, end: int | None = None,
+              normalized_lines: Sequence[str] | None = None) -> MatchResult:
+        if not needle:
+            return MatchResult(None)
+        if end is None:
+            end = len(lines)
+        if normalized_lines is None:
+            normalized_lines = [normalize_line(l) for l in lines[start:end]]
+            offset = start
+        else:
+            offset = 0
+        last_start = end - len(needle)
+        normalized_needle = [normalize_line(l) for l in needle]
+
+        for s in range(start, last_start + 1):
+            if normalized_lines[s - offset:s - offset + len(needle)] == normalized_needle:
+                return MatchResult(LineMatch(s, len(needle), 'normalized'))
+
+        if end - start > self.max_fuzzy_lines:
+            return MatchResult(None)
+
+        # 先用 quick_ratio（相似度上界）给每个窗口排序，再按上界从高到低计算真实相似度，
+        # 上界已不可能超过当前最优（扣除歧义余量）时停止
+        def window(s: int) -> Sequence[str]:
+            return normalized_lines[s - offset:s - offset + len(needle)]
+
+        def line_scores(s: int, quick: bool) -> float:
+            total = 0.0
+            for a, b in zip(window(s), normalized_needle):
+                if a == b:
+                    total += 1.0
+                else:
+                    matcher = SequenceMatcher(None, a, b, autojunk=False)
+                    total += matcher.quick_ratio() if quick else matcher.ratio()
+            return total / len(needle)
+
+        starts = range(start, max(last_start, start) + 1)
+        if not window(start):
+            return MatchResult(None)
+        bounds = sorted(((line_scores(s, True), s) for s in starts), key=lambda b: (-b[0], b[1]))
+        scored: List[LineMatch] = []
+        for bound, s in bounds:
+            if scored and bound < scored[0].score - self.ambiguity_margin:
+                break
+            scored.append(LineMatch(s, len(window(s)), 'fuzzy', line_scores(s, False)))
+            scored.sort(key=lambda m: (-m.score, m.start))
+        best = scored[0]
+        runner_up = next((m for m in scored[1:]
+                          if abs(m.start - best.start) >= len(needle)), None)
+        ambiguous = runner_up is not None and best.score - runner_up.score < self.ambiguity_margin
+        if best.score >= self.fuzzy_threshold and best.length == len(needle) and not ambiguous:
+            return MatchResult(best, best)
+        return MatchResult(None, best, ambiguous and best.score >= self.fuzzy_threshold)
+
+
+def merge_replacement(hunk_lines: List[str], window: Sequence[str]) -> List[str]:
+    """按 hunk 生成替换内容；上下文行保留文档中的原文（容错匹配时二者可能略有不同）"""
+    out: List[str] = []
+    j = 0
+    for hl in hunk_lines:
+        if hl == '' or hl[0] == ' ':
+            out.append(window[j])
+            j += 1
+        elif hl[0] == '-':
+            j += 1
+        elif hl[0] == '+':
+            out.append(hl[1:])
+    return out
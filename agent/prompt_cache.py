@@ -0,0 +1,60 @@
+from __future__ import annotations
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Tuple
+
+if TYPE_CHECKING:
+    from agents import TResponseInputItem
+
+
+@dataclass
+class PrefixReport:
+    """两轮请求之间的前缀复用情况，用于估计 provider 侧 prompt cache 的命中潜力"""
+    total_items: int
+    stable_items: int   # 与上一轮请求逐字节相同的前缀消息数
+    total_bytes: int
+    stable_bytes: int
+    prefix_hash: str    # 稳定前缀的链式哈希
+
+    @property
+    def stable_ratio(self) -> float:
+        return self.stable_bytes / self.total_bytes if self.total_bytes else 0.0
+
+    def __str__(self) -> str:
+        return (f'prefix {self.stable_items}/{self.total_items} items, '
+                f'{self.stable_bytes}/{self.total_bytes} bytes ({self.stable_ratio:.1%}) '
+                f'hash={self.prefix_hash}')
+
+
+def item_digest(item: TResponseInputItem) -> Tuple[str, int]:
+    """返回 (消息的规范化哈希, 序列化字节数)"""
+    encoded = json.dumps(item, sort_keys=True, ensure_ascii=False,
+                         separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest(), len(encoded)
+
+
+class PrefixTracker:
+    """记录上一轮请求的逐条哈希，与本轮比较得到可复用的前缀"""
+
+    def __init__(self):
+        self._last: List[str] = []
+
+    def report(self, conversation: List[TResponseInputItem]) -> PrefixReport:
+        digests = [item_digest(item) for item in conversation]
+        stable_items = 0
+        for (digest, _), last in zip(digests, self._last):
+            if digest != last:
+                break
+            stable_items += 1
+        chain = hashlib.sha256()
+        for digest, _ in digests[:stable_items]:
+            chain.update(digest.encode('ascii'))
+        self._last = [digest for digest, _ in digests]
+        return PrefixReport(
+            total_items=len(digests),
+            stable_items=stable_items,
+            total_bytes=sum(size for _, size in digests),
+            stable_bytes=sum(size for _, size in digests[:stable_items]),
+            prefix_hash=chain.hexdigest()[:16],
+        )
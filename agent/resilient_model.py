@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Set, Tuple, TypeVar
+import httpx
+import openai
+from agents import ModelResponse, ModelSettings
+from agents.models.interface import Model
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """超时、连接错误、限流和服务端 5xx 可以重试；参数错误、鉴权失败、缓存未命中等不重试"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError,
+                          httpx.TransportError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    return isinstance(status, int) and status in RETRYABLE_STATUS
+
+
+@dataclass
+class RetryPolicy:
+    attempt_timeout: float | None = 120.0  # 单次请求的超时；流式请求为首个事件及相邻事件之间的超时
+    max_attempts: int = 3
+    backoff_base: float = 0.5  # 第 n 次重试前等待 backoff_base * 2^n 秒（不超过 backoff_max），另加 ±jitter 比例的抖动
+    backoff_max: float = 8.0
+    jitter: float = 0.2
+    hedge_after: float | None = None  # 请求超过该秒数仍未返回时，再发一个相同的请求，取先返回的结果
+    max_hedges: int = 1
+
+    def backoff(self, retry: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** retry)
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+class ResilientModel(Model):
+    """
+    为模型请求加上单次超时、指数退避重试和对冲请求。
+    对冲：请求在 hedge_after 秒内没有返回时发出相同的请求，先成功的结果胜出，其余请求被取消。
+    流式请求在收到第一个事件之前可以重试和对冲；一旦开始输出就不再重试，避免重复的流式回调。
+    attempt_settings 覆盖每次尝试的 ModelSettings（例如关闭 provider 客户端自带的重试）。
+    """
+
+    def __init__(self, model: Model, policy: RetryPolicy | None = None,
+                 retryable: Callable[[BaseException], bool] = is_retryable,
+                 attempt_settings: ModelSettings | None = None):
+        self.model = model
+        self.policy = policy or RetryPolicy()
+        self.retryable = retryable
+        self.attempt_settings = attempt_settings
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def _retrying(self, start: Callable[[], Awaitable[T]],
+                        discard: Callable[[T], None] | None = None) -> T:
+        for retry in range(self.policy.max_attempts):
+            try:
+                return await self._hedged(start, discard)
+            except Exception as e:
+                if retry + 1 >= self.policy.max_attempts or not self.retryable(e):
+                    raise
+                delay = self.policy.backoff(retry)
+                self.retries += 1
+                logger.warning('Model request failed (%r); retrying in %.2fs (%d/%d)',
+                               e, delay, retry + 1, self.policy.max_attempts - 1)
+                await asyncio.sleep(delay)
+        raise AssertionError('unreachable')
+
+    async def _hedged(self, start: Callable[[], Awaitable[T]],
+                      discard: Callable[[T], None] | None = None) -> T:
+        """运行 start()，超过 hedge_after 仍未完成时并发再运行一次，返回最先成功的结果；同时成功的其它结果交给 discard"""
+        tasks: Set[asyncio.Task] = set()
+        hedged: Set[asyncio.Task] = set()
+
+        def launch() -> asyncio.Task:
+            self.attempts += 1
+            task = asyncio.ensure_future(start())
+            tasks.add(task)
+            return task
+
+        launch()
+        winner: asyncio.Task | None = None
+        error: BaseException | None = None
+        try:
+            while tasks and winner is None:
+                can_hedge = self.policy.hedge_after is not None and len(hedged) < self.policy.max_hedges
+                done, _ = await asyncio.wait(tasks, timeout=self.policy.hedge_after if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    hedged.add(launch())
+                    continue
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        discard(task.result())
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        if winner is None:
+            assert error is not None
+            raise error
+        if winner in hedged:
+            self.hedge_wins += 1
+        return winner.result()
+
+    def _settings(self, model_settings: ModelSettings) -> ModelSettings:
+        return model_settings.resolve(self.attempt_settings)
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema,
+                           handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                           prompt=None) -> ModelResponse:
+        settings = self._settings(model_settings)
+        return await self._retrying(lambda: asyncio.wait_for(self.model.get_response(
+            system_instructions, input, settings, tools, output_schema, handoffs, tracing,
+            previous_response_id=previous_response_id, conversation_id=conversation_id, prompt=prompt),
+            self.policy.attempt_timeout))
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema,
+                              handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                              prompt=None) -> AsyncIterator[Any]:  # type: ignore[override]
+        settings = self._settings(model_settings)
+
+        # 每次尝试由一个任务完整地消费内层的流并放入队列：内层生成器（及其中的 tracing span）始终在同一个任务中运行
+        async def pump(queue: asyncio.Queue) -> None:
+            try:
+                async for event in self.model.stream_response(
+                        system_instructions, input, settings, tools, output_schema, handoffs, tracing,
+                        previous_response_id=previous_response_id, conversation_id=conversation_id, prompt=prompt):
+                    queue.put_nowait((event, None))
+                queue.put_nowait((_END, None))
+            except Exception as e:
+                queue.put_nowait((None, e))
+
+        async def start() -> Tuple[asyncio.Task, asyncio.Queue, Any]:
+            queue: asyncio.Queue = asyncio.Queue()
+            producer = asyncio.ensure_future(pump(queue))
+            try:
+                first = await self._next(queue)
+            except BaseException:
+                producer.cancel()
+                raise
+            return producer, queue, first
+
+        producer, queue, first = await self._retrying(start, discard=lambda attempt: attempt[0].cancel())
+        try:
+            event = first
+            while event is not _END:
+                yield event
+                event = await self._next(queue)
+        finally:
+            producer.cancel()
+
+    async def _next(self, queue: asyncio.Queue) -> Any:
+        event, error = await asyncio.wait_for(queue.get(), self.policy.attempt_timeout)
+        if error is not None:
+            raise error
+        return event
+
+
+_END = object()
@@ -0,0 +1,264 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, List, Literal, Tuple
+from agents import FunctionTool, ModelResponse, ModelSettings, Usage
+from agents.models.interface import Model
+from openai.types.responses import ResponseCompletedEvent, ResponseOutputItem
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails
+from pydantic import BaseModel, TypeAdapter
+from .streaming import response_events
+
+logger = logging.getLogger(__name__)
+
+_output_items = TypeAdapter(List[ResponseOutputItem])
+
+
+class CacheMissError(LookupError):
+    """严格回放模式下请求不在缓存中"""
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json', exclude_none=True)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    return repr(value)
+
+
+def _tool_schema(tool: Any) -> Dict[str, Any]:
+    if isinstance(tool, FunctionTool):
+        return {'name': tool.name, 'description': tool.description,
+                'parameters': tool.params_json_schema, 'strict': tool.strict_json_schema}
+    return {'name': getattr(tool, 'name', type(tool).__name__)}
+
+
+def request_key(namespace: str, system_instructions: str | None, input: Any,
+                model_settings: ModelSettings, tools: List[Any], output_schema: Any,
+                handoffs: List[Any], previous_response_id: str | None = None,
+                conversation_id: str | None = None, prompt: Any = None) -> str:
+    """按渲染后的 instructions、工具 schema、输入消息和模型设置计算请求的缓存键"""
+    request = {
+        'namespace': namespace,
+        'instructions': system_instructions,
+        'input': input,
+        'settings': model_settings.to_json_dict(),
+        'tools': [_tool_schema(tool) for tool in tools],
+        'output_schema': output_schema.json_schema() if output_schema is not None else None,
+        'handoffs': [getattr(handoff, 'tool_name', repr(handoff)) for handoff in handoffs],
+        'previous_response_id': previous_response_id,
+        'conversation_id': conversation_id,
+        'prompt': prompt,
+    }
+    text = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=_jsonable)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """
+    磁盘上的 JSON 缓存，每个条目一个文件：`<root>/<key[:2]>/<key>.json`。
+    按文件修改时间做 LRU：命中时更新时间，总大小超过 max_bytes 时删除最久未用的文件。
+    """
+
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f'{key}.json')
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get_json(self, key: str) -> Any | None:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            data = None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning('Ignoring unreadable cache entry %s: %s', path, e)
+            data = None
+        with self._lock:  # 调用方可能在线程池中并发读取
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put_json(self, key: str, data: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        with self._lock:
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            self._size += os.path.getsize(path) - old
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def discard(self, key: str) -> None:
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            self._size -= size
+
+    def _evict(self) -> None:
+        # 一次清到上限的 90%，避免每次写入都扫描目录
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+class ResponseCache(DiskCache):
+    """磁盘上的模型响应缓存（见 DiskCache），键由 request_key 计算"""
+
+    def __init__(self, root: str = 'logs/llm_cache', max_bytes: int = 512 * 1024 * 1024):
+        super().__init__(root, max_bytes)
+
+    def get(self, key: str) -> ModelResponse | None:
+        data = self.get_json(key)
+        return _load_response(data) if data is not None else None
+
+    def put(self, key: str, response: ModelResponse) -> None:
+        self.put_json(key, _dump_response(response))
+
+
+def _dump_response(response: ModelResponse) -> Dict[str, Any]:
+    usage = response.usage
+    return {
+        'output': [item.model_dump(mode='json', exclude_none=True) for item in response.output],
+        'usage': {
+            'requests': usage.requests,
+            'input_tokens': usage.input_tokens,
+            'output_tokens': usage.output_tokens,
+            'total_tokens': usage.total_tokens,
+            'cached_tokens': usage.input_tokens_details.cached_tokens,
+            'reasoning_tokens': usage.output_tokens_details.reasoning_tokens,
+        },
+        'response_id': response.response_id,
+    }
+
+
+def _load_response(data: Dict[str, Any]) -> ModelResponse:
+    usage = data['usage']
+    return ModelResponse(
+        output=_output_items.validate_python(data['output']),
+        usage=Usage(
+            requests=usage['requests'],
+            input_tokens=usage['input_tokens'],
+            output_tokens=usage['output_tokens'],
+            total_tokens=usage['total_tokens'],
+            input_tokens_details=InputTokensDetails(cached_tokens=usage['cached_tokens']),
+            output_tokens_details=OutputTokensDetails(reasoning_tokens=usage['reasoning_tokens']),
+        ),
+        response_id=data['response_id'],
+    )
+
+
+class CachedModel(Model):
+    """
+    带响应缓存的模型包装。
+    read_write：命中直接返回，未命中调用内层模型并写入缓存；
+    replay：严格回放，未命中抛出 CacheMissError，不会访问内层模型（用于崩溃复现、回归测试和 CI）。
+    命中时返回录制时的 usage，使回放得到的指标与原始运行一致。
+    缓存的读写（打开文件、解析 JSON、更新 LRU 时间）在线程中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, model: Model, cache: ResponseCache, namespace: str = '',
+                 mode: Literal["read_write", "replay"] = "read_write"):
+        self.model = model
+        self.cache = cache
+        self.namespace = namespace
+        self.mode = mode
+
+    def _key(self, system_instructions, input, model_settings, tools, output_schema, handoffs,
+             previous_response_id, conversation_id, prompt) -> str:
+        return request_key(self.namespace, system_instructions, input, model_settings, tools,
+                           output_schema, handoffs, previous_response_id, conversation_id, prompt)
+
+    async def _lookup(self, key: str) -> ModelResponse | None:
+        response = await asyncio.to_thread(self.cache.get, key)
+        if response is None and self.mode == "replay":
+            raise CacheMissError(f'Model request {key[:12]} is not in the response cache ({self.cache.root}).')
+        return response
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema,
+                           handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                           prompt=None) -> ModelResponse:
+        key = self._key(system_instructions, input, model_settings, tools, output_schema, handoffs,
+                        previous_response_id, conversation_id, prompt)
+        if (response := await self._lookup(key)) is not None:
+            return response
+        response = await self.model.get_response(
+            system_instructions, input, model_settings, tools, output_schema, handoffs, tracing,
+            previous_response_id=previous_response_id, conversation_id=conversation_id, prompt=prompt)
+        await asyncio.to_thread(self.cache.put, key, response)
+        return response
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema,
+                              handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                              prompt=None) -> AsyncIterator[Any]:  # type: ignore[override]
+        key = self._key(system_instructions, input, model_settings, tools, output_schema, handoffs,
+                        previous_response_id, conversation_id, prompt)
+        if (response := await self._lookup(key)) is not None:
+            for event in response_events(response):
+                yield event
+            return
+        async for event in self.model.stream_response(
+                system_instructions, input, model_settings, tools, output_schema, handoffs, tracing,
+                previous_response_id=previous_response_id, conversation_id=conversation_id, prompt=prompt):
+            if isinstance(event, ResponseCompletedEvent):
+                usage = event.response.usage
+                await asyncio.to_thread(self.cache.put, key, ModelResponse(
+                    output=event.response.output,
+                    usage=Usage(
+                        requests=1,
+                        input_tokens=usage.input_tokens,
+                        output_tokens=usage.output_tokens,
+                        total_tokens=usage.total_tokens,
+                        input_tokens_details=usage.input_tokens_details,
+                        output_tokens_details=usage.output_tokens_details,
+                    ) if usage else Usage(),
+                    response_id=event.response.id))
+            yield event
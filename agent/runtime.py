@@ -0,0 +1,99 @@
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, List, Mapping
+from agents import Agent, Model, MaxTurnsExceeded, RunConfig, Runner, RunItem, RunResult, RunResultStreaming, TResponseInputItem
+from .context import StackAndHeapContext
+from .prompt_cache import PrefixReport
+from .main_agent import agent
+from .streaming import StreamHandler, consume_stream
+from .telemetry import Telemetry, maybe_span
+
+if TYPE_CHECKING:
+    from .summarizer import BackgroundSummarizer
+
+
+@dataclass
+class TurnResult:
+    new_items: List[TResponseInputItem]
+    prefix: PrefixReport
+
+
+async def run_turn(ctx: StackAndHeapContext,
+                   starting_agent: Agent[StackAndHeapContext] | None = None,
+                   run_config: RunConfig | None = None,
+                   stream: StreamHandler | None = None,
+                   max_turns: int = 10,
+                   stage_models: Mapping[str, Model] | None = None,
+                   summarizer: 'BackgroundSummarizer | None' = None,
+                   telemetry: Telemetry | None = None) -> TurnResult:
+    """
+    执行一轮：检查 token 预算 -> 构建对话 -> 调用模型/工具 -> 把新消息写回上下文并落盘。
+    传入 stream 时使用流式运行，推理内容、工具参数和 send_message 的内容会在生成过程中回调给 handler；
+    写回上下文的 new_items 与非流式完全相同。
+    多工具模式（multi_tool_agent）下一次运行可能包含多次模型调用，超过 max_turns 时
+    工具已经修改了栈和 note，因此仍把已完成的消息写回上下文，下一轮从这里继续；
+    其他异常（包括取消）时本次运行的消息被丢弃，栈和阶段恢复到运行之前，然后重新抛出。
+    stage_models 按当前阶段覆盖 run_config 中的模型（例如总结阶段使用更便宜的模型）；
+    传入 summarizer 时，进入总结阶段的 frame 会被临时弹出并在后台总结，本轮直接继续主循环。
+    传入 telemetry 时记录本轮各阶段的耗时、模型用量、工具结果和栈/note 大小。
+    """
+    telemetry_turn = telemetry.turn(ctx) if telemetry is not None else nullcontext(None)
+    with telemetry_turn as recorder:
+        with maybe_span(recorder, 'enforce_budget'):
+            ctx.enforce_budget()
+            if summarizer is not None and ctx.current_stage == "summarizing":
+                summarizer.start(ctx)
+        run_config = stage_run_config(ctx, run_config, stage_models)
+        with maybe_span(recorder, 'build_conversation'):
+            conversation = ctx.build_conversation()
+            prefix = ctx.prefix_report(conversation)
+        hooks = telemetry.hooks if telemetry is not None else None
+        response: RunResult | RunResultStreaming
+        items: List[RunItem]
+        # 运行中工具已经修改了栈，而出错时本次运行的消息不会写回；出错时把 frame 恢复到运行之前
+        mark = ctx.mark_frames()
+        with maybe_span(recorder, 'run'):
+            try:
+                if stream is None:
+                    response = await Runner.run(
+                        starting_agent=starting_agent or agent,
+                        input=conversation,
+                        context=ctx,
+                        run_config=run_config,
+                        max_turns=max_turns,
+                        hooks=hooks,
+                    )
+                else:
+                    response = Runner.run_streamed(
+                        starting_agent=starting_agent or agent,
+                        input=conversation,
+                        context=ctx,
+                        run_config=run_config,
+                        max_turns=max_turns,
+                        hooks=hooks,
+                    )
+                    await consume_stream(response, stream)
+                items = response.new_items
+            except MaxTurnsExceeded as e:
+                if e.run_data is None:
+                    ctx.restore_frames(mark)
+                    raise
+                items = e.run_data.new_items
+            except BaseException:
+                ctx.restore_frames(mark)
+                raise
+        new_items = [item.to_input_item() for item in items]
+        with maybe_span(recorder, 'add_messages'):
+            ctx.add_messages(new_items)
+        with maybe_span(recorder, 'sync'):
+            ctx.sync()
+    return TurnResult(new_items=new_items, prefix=prefix)
+
+
+def stage_run_config(ctx: StackAndHeapContext, run_config: RunConfig | None,
+                     stage_models: Mapping[str, Model] | None) -> RunConfig | None:
+    """当前阶段配置了专用模型时，返回覆盖了模型的 RunConfig"""
+    stage_model = (stage_models or {}).get(ctx.current_stage)
+    if stage_model is None:
+        return run_config
+    return replace(run_config or RunConfig(), model=stage_model)
@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import json
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Sequence
+from agents import ModelResponse, Usage
+from agents.models.interface import Model
+from openai.types.responses import ResponseFunctionToolCall, ResponseOutputMessage, ResponseOutputText
+from .streaming import response_events
+from .tokens import estimate_tokens
+
+
+@dataclass
+class ScriptedCall:
+    name: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+
+
+class ScriptedModel(Model):
+    """
+    确定性的本地替身模型：忽略输入，按脚本依次返回一个工具调用，不访问网络。
+    用于基准测试和离线评估，驱动真实的 agent + StackAndHeapContext 循环。
+    脚本需要与阶段/栈的变化相符（例如 pop_subtask 只能出现在 finish_subtask 与 apply_patch_to_note 之后），
+    default_script() 给出一个合法的循环脚本。usage 中的 token 数按输入大小估算。
+    """
+
+    def __init__(self, script: Sequence[ScriptedCall], loop: bool = True,
+                 latency: float = 0.0, chunk_size: int = 16):
+        assert script, "Script must not be empty."
+        self.script = list(script)
+        self.loop = loop
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._ids = itertools.count()
+
+    def _next_call(self) -> ResponseFunctionToolCall:
+        if self.calls >= len(self.script) and not self.loop:
+            raise RuntimeError(f'Script exhausted after {len(self.script)} calls.')
+        step = self.script[self.calls % len(self.script)]
+        self.calls += 1
+        n = next(self._ids)
+        return ResponseFunctionToolCall(
+            type='function_call', name=step.name, status='completed',
+            arguments=json.dumps(step.arguments, ensure_ascii=False),
+            call_id=f'call_scripted_{n}', id=f'fc_scripted_{n}')
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema,
+                           handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                           prompt=None) -> ModelResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        output = self._next_call()
+        return ModelResponse(output=[output],
+                             usage=estimated_usage(system_instructions, input, output.arguments), response_id=None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema,
+                              handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                              prompt=None) -> AsyncIterator[Any]:  # type: ignore[override]
+        response = await self.get_response(system_instructions, input, model_settings, tools,
+                                           output_schema, handoffs, tracing)
+        for event in response_events(response, self.chunk_size):
+            yield event
+
+
+class ScriptedReplyModel(Model):
+    """
+    确定性的本地替身模型：忽略输入，依次返回 replies 中的一条文本消息（用完后循环），不访问网络。
+    用于离线评估中扮演模拟用户。usage 中的 token 数按输入大小估算
+    """
+
+    def __init__(self, replies: Sequence[str], chunk_size: int = 16):
+        assert replies, "Replies must not be empty."
+        self.replies = list(replies)
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema,
+                           handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                           prompt=None) -> ModelResponse:
+        text = self.replies[self.calls % len(self.replies)]
+        output = ResponseOutputMessage(
+            id=f'msg_scripted_{self.calls}', role='assistant', status='completed', type='message',
+            content=[ResponseOutputText(annotations=[], text=text, type='output_text')])
+        self.calls += 1
+        return ModelResponse(output=[output], usage=estimated_usage(system_instructions, input, text),
+                             response_id=None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema,
+                              handoffs, tracing, *, previous_response_id=None, conversation_id=None,
+                              prompt=None) -> AsyncIterator[Any]:  # type: ignore[override]
+        response = await self.get_response(system_instructions, input, model_settings, tools,
+                                           output_schema, handoffs, tracing)
+        for event in response_events(response, self.chunk_size):
+            yield event
+
+
+def estimated_usage(system_instructions: str | None, input: Any, output: str) -> Usage:
+    text = input if isinstance(input, str) else json.dumps(input, ensure_ascii=False)
+    input_tokens = estimate_tokens((system_instructions or '') + text)
+    output_tokens = estimate_tokens(output)
+    return Usage(requests=1, input_tokens=input_tokens, output_tokens=output_tokens,
+                 total_tokens=input_tokens + output_tokens)
+
+
+def subtask_script(subtask_id: str, depth: int = 1, messages: int = 1,
+                   section: str = '## Log') -> List[ScriptedCall]:
+    """
+    一个完整子任务的调用序列：start_subtask -> brainstorm -> (嵌套子任务) -> send_message × messages
+    -> finish_subtask -> apply_patch_to_note -> pop_subtask。depth > 1 时在其中嵌套一层更深的子任务。
+    patch 在 section 下追加一行，note 中需要有该标题。
+    """
+    calls = [ScriptedCall('start_subtask', {'subtask_id': subtask_id, 'subtask_goal': f'goal of {subtask_id}'}),
+             ScriptedCall('brainstorm', {'thinking': f'Plan for {subtask_id}: ask the user, then record the answer.'})]
+    if depth > 1:
+        calls += subtask_script(f'{subtask_id}.1', depth - 1, messages, section)
+    calls += [ScriptedCall('send_message', {'content': f'[{subtask_id}] message {i}'}) for i in range(messages)]
+    calls += [
+        ScriptedCall('finish_subtask'),
+        ScriptedCall('apply_patch_to_note', {
+            'patch': f'*** Begin Patch\n@@ {section}\n+{subtask_id}: done\n*** End Patch'}),
+        ScriptedCall('pop_subtask', {'return_value': f'{subtask_id} completed'}),
+    ]
+    return calls
+
+
+def default_script(subtasks: int = 3, depth: int = 2, messages: int = 2,
+                   section: str = '## Log') -> List[ScriptedCall]:
+    """从主任务开始的循环脚本：brainstorm 后依次完成 subtasks 个子任务，循环执行后栈回到主任务"""
+    calls = [ScriptedCall('brainstorm', {'thinking': 'Start by greeting the user.'})]
+    for i in range(subtasks):
+        calls += subtask_script(f'task{i}', depth, messages, section)
+    return calls
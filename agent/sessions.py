@@ -0,0 +1,226 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import re
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Literal, Mapping, Tuple
+from agents import Agent, RunConfig
+from agents.models.interface import Model
+from .channels import QueueChannel
+from .context import StackAndHeapContext
+from .runtime import run_turn
+from .parallel import ParallelSubtaskRunner
+from .web_search import WebSearch
+from .summarizer import BackgroundSummarizer
+from .telemetry import Telemetry
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class TurnScheduler:
+    """
+    限制所有会话同时进行的模型调用数。
+    有空位时优先放行累计调用次数最少的会话，避免个别高频会话占满后端。
+    """
+
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.served: Dict[str, int] = defaultdict(int)
+        self._waiters: List[Tuple[int, int, str, asyncio.Future[None]]] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, session_id: str) -> None:
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.served[session_id] += 1
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (self.served[session_id], next(self._seq), session_id, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 空位已经交给了本会话，转交给下一个
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, session_id, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # 已取消
+            # 空位直接转交，active 不变
+            self.served[session_id] += 1
+            future.set_result(None)
+            return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, session_id: str) -> AsyncIterator[None]:
+        await self.acquire(session_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ScheduledModel(Model):
+    """包装模型：每次调用前向 TurnScheduler 申请空位"""
+
+    def __init__(self, model: Model, scheduler: TurnScheduler, session_id: str):
+        self.model = model
+        self.scheduler = scheduler
+        self.session_id = session_id
+
+    async def get_response(self, *args, **kwargs):
+        async with self.scheduler.slot(self.session_id):
+            return await self.model.get_response(*args, **kwargs)
+
+    async def stream_response(self, *args, **kwargs):  # type: ignore[override]
+        async with self.scheduler.slot(self.session_id):
+            async for event in self.model.stream_response(*args, **kwargs):
+                yield event
+
+
+@dataclass
+class Session:
+    session_id: str
+    ctx: StackAndHeapContext
+    channel: QueueChannel
+    status: Literal["running", "stopped", "failed"] = "running"
+    error: str | None = None
+    turns: int = 0
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def waiting_for_user(self) -> bool:
+        return self.channel.waiting
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            'session_id': self.session_id,
+            'status': self.status,
+            'waiting_for_user': self.waiting_for_user,
+            'turns': self.turns,
+            'stack_depth': len(self.ctx.stack),
+            'current_task': self.ctx.stack[-1].task_id,
+            'error': self.error,
+        }
+
+
+class SessionManager:
+    """
+    在同一个事件循环中托管多个 StackAndHeapContext 会话。
+    每个会话持久化到 `<root>/<session_id>.jsonl`（journal 模式），用户通过 QueueChannel 收发消息，
+    所有会话的模型调用共享一个 TurnScheduler。
+    stage_models 按阶段选择模型（默认取自 agent.model.get_stage_models()）；
+    background_summaries 为 True 时各会话的总结阶段在后台进行（见 BackgroundSummarizer）；
+    parallel_subtasks 为 True 时各会话可以用 start_parallel_subtasks 并发运行兄弟子任务（见 ParallelSubtaskRunner）；
+    传入 web_search 时各会话共享这个搜索客户端（线程池和缓存）。
+    传入 telemetry 时所有会话的每轮指标写入同一组输出，按 session 区分。
+    """
+
+    def __init__(self, root: str = 'logs/sessions', max_concurrency: int = 4,
+                 starting_agent: Agent[StackAndHeapContext] | None = None,
+                 reply_timeout: float | None = None,
+                 stage_models: Mapping[str, Model] | None = None,
+                 background_summaries: bool = False,
+                 parallel_subtasks: bool = False,
+                 web_search: WebSearch | None = None,
+                 telemetry: Telemetry | None = None):
+        from .main_agent import agent
+        from .model import get_stage_models
+        self.root = root
+        self.scheduler = TurnScheduler(max_concurrency)
+        self.agent = starting_agent or agent
+        self.reply_timeout = reply_timeout
+        self.stage_models = get_stage_models() if stage_models is None else stage_models
+        self.background_summaries = background_summaries
+        self.parallel_subtasks = parallel_subtasks
+        self.web_search = web_search
+        self.telemetry = telemetry
+        self.sessions: Dict[str, Session] = {}
+
+    def session_path(self, session_id: str) -> str:
+        return os.path.join(self.root, f'{session_id}.jsonl')
+
+    def create_session(self, session_id: str | None = None) -> Session:
+        """创建会话；若同名会话的日志已存在，则从日志恢复"""
+        session_id = session_id or uuid.uuid4().hex[:12]
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f'Invalid session id: {session_id!r}')
+        if (existing := self.sessions.get(session_id)) and existing.status == "running":
+            return existing
+        if existing:
+            # 旧会话已结束，先关闭它的日志，再从同一个文件重新打开
+            existing.ctx.close_journal()
+        ctx = StackAndHeapContext.open_journal(self.session_path(session_id))
+        channel = QueueChannel(timeout=self.reply_timeout)
+        ctx.set_user_channel(channel)
+        session = Session(session_id=session_id, ctx=ctx, channel=channel)
+        self.sessions[session_id] = session
+        session.task = asyncio.create_task(self._run(session), name=f'session-{session_id}')
+        return session
+
+    def resume_all(self) -> List[Session]:
+        """恢复 root 目录下所有已持久化的会话"""
+        if not os.path.isdir(self.root):
+            return []
+        return [self.create_session(name[:-len('.jsonl')])
+                for name in sorted(os.listdir(self.root)) if name.endswith('.jsonl')]
+
+    async def _run(self, session: Session) -> None:
+        assert isinstance(self.agent.model, Model), "SessionManager requires the agent to hold a Model instance."
+        run_config = RunConfig(model=ScheduledModel(self.agent.model, self.scheduler, session.session_id))
+        stage_models = {stage: ScheduledModel(model, self.scheduler, session.session_id)
+                        for stage, model in self.stage_models.items()}
+        summarizer = BackgroundSummarizer(self.agent, run_config, stage_models) \
+            if self.background_summaries else None
+        if summarizer is not None:
+            summarizer.resume(session.ctx)
+        if self.parallel_subtasks:
+            session.ctx.set_subtask_runner(ParallelSubtaskRunner(self.agent, run_config, stage_models))
+        session.ctx.set_web_search(self.web_search)
+        telemetry = self.telemetry.bind(session.session_id) if self.telemetry is not None else None
+        try:
+            while session.status == "running":
+                await run_turn(session.ctx, self.agent, run_config=run_config,
+                               stage_models=stage_models, summarizer=summarizer, telemetry=telemetry)
+                session.turns += 1
+        except asyncio.CancelledError:
+            session.status = "stopped"
+        except Exception as e:
+            logger.exception('Session %s failed', session.session_id)
+            session.status = "failed"
+            session.error = repr(e)
+        finally:
+            if summarizer is not None:
+                await summarizer.cancel()
+            session.ctx.sync()
+
+    def get(self, session_id: str) -> Session:
+        if session_id not in self.sessions:
+            raise KeyError(session_id)
+        return self.sessions[session_id]
+
+    def reply(self, session_id: str, text: str) -> None:
+        self.get(session_id).channel.reply(text)
+
+    async def stop(self, session_id: str) -> None:
+        session = self.get(session_id)
+        if session.task is not None and not session.task.done():
+            session.task.cancel()
+            await asyncio.gather(session.task, return_exceptions=True)
+        session.status = "stopped"
+
+    async def shutdown(self) -> None:
+        for session_id in list(self.sessions):
+            await self.stop(session_id)
@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Callable, Dict, List, Set, Tuple
+from .scripted_model import ScriptedCall
+from .tokens import estimate_tokens
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class StandinOpenAIServer:
+    """
+    本地的 OpenAI 兼容替身服务（仅依赖标准库），用于在不访问网络的情况下测试模型传输层：
+    POST /v1/chat/completions，支持 stream，连接保持 keep-alive。
+
+    latency(n) / fail(n) 按请求序号（从 0 开始）给出延迟秒数和要返回的错误状态码（None 表示正常），
+    用来模拟长尾延迟、限流和服务端错误。请求带有 tools 且给了 tool_call 时返回该工具调用，否则返回文本 reply。
+    requests / connections 记录收到的请求数和建立的连接数。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, reply: str = 'OK',
+                 tool_call: ScriptedCall | None = None,
+                 latency: Callable[[int], float] = lambda n: 0.0,
+                 fail: Callable[[int], int | None] = lambda n: None):
+        self.host = host
+        self.port = port
+        self.reply = reply
+        self.tool_call = tool_call
+        self.latency = latency
+        self.fail = fail
+        self.requests = 0
+        self.connections = 0
+        self._ids = itertools.count()
+        self._server: asyncio.Server | None = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/v1'
+
+    async def start(self) -> 'StandinOpenAIServer':
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # 客户端连接池中空闲的 keep-alive 连接不会自己断开，wait_closed 会一直等待它们
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> 'StandinOpenAIServer':
+        return await self.start()
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                path, body = request
+                if not await self._respond(writer, path, body):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, path: str, body: Dict[str, Any]) -> bool:
+        """写出一个响应；返回连接是否可以继续使用"""
+        n = self.requests
+        self.requests += 1
+        if path.rstrip('/') != '/v1/chat/completions':
+            await _write_json(writer, 404, {'error': {'message': f'Unknown path {path}'}})
+            return True
+        if delay := self.latency(n):
+            await asyncio.sleep(delay)
+        if (status := self.fail(n)) is not None:
+            await _write_json(writer, status, {'error': {'message': f'Injected failure for request {n}',
+                                                         'type': 'standin_error', 'code': status}})
+            return True
+        completion = self._completion(body)
+        if not body.get('stream'):
+            await _write_json(writer, 200, completion)
+            return True
+        # 流式响应不带 Content-Length，写完后关闭连接
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n')
+        for chunk in _stream_chunks(completion):
+            writer.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            await writer.drain()
+        writer.write(b'data: [DONE]\n\n')
+        await writer.drain()
+        return False
+
+    def _completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        n = next(self._ids)
+        message: Dict[str, Any] = {'role': 'assistant', 'content': self.reply}
+        finish_reason = 'stop'
+        if body.get('tools') and self.tool_call is not None:
+            message = {'role': 'assistant', 'content': None, 'tool_calls': [{
+                'id': f'call_standin_{n}', 'type': 'function',
+                'function': {'name': self.tool_call.name,
+                             'arguments': json.dumps(self.tool_call.arguments, ensure_ascii=False)}}]}
+            finish_reason = 'tool_calls'
+        prompt_tokens = estimate_tokens(json.dumps(body.get('messages', []), ensure_ascii=False))
+        completion_tokens = estimate_tokens(json.dumps(message, ensure_ascii=False))
+        return {
+            'id': f'chatcmpl-standin-{n}', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'standin'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+
+def _stream_chunks(completion: Dict[str, Any]) -> List[Dict[str, Any]]:
+    message = completion['choices'][0]['message']
+    base = {key: completion[key] for key in ('id', 'created', 'model')} | {'object': 'chat.completion.chunk'}
+    delta: Dict[str, Any] = {'role': 'assistant'}
+    if message.get('tool_calls'):
+        delta['tool_calls'] = [{'index': i, **call} for i, call in enumerate(message['tool_calls'])]
+    else:
+        delta['content'] = message['content']
+    return [
+        base | {'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]},
+        base | {'choices': [{'index': 0, 'delta': {}, 'finish_reason': completion['choices'][0]['finish_reason']}]},
+        base | {'choices': [], 'usage': completion['usage']},
+    ]
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, Dict[str, Any]] | None:
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    if not request_line:
+        return None
+    _, path, _ = request_line.split(' ', 2)
+    content_length = 0
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-length':
+            content_length = int(value.strip())
+    body = json.loads(await reader.readexactly(content_length)) if content_length else {}
+    return path.split('?', 1)[0], body
+
+
+async def _write_json(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    writer.write(
+        f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+        f'Content-Type: application/json; charset=utf-8\r\n'
+        f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii') + body)
+    await writer.drain()
@@ -0,0 +1,230 @@
+import itertools
+import re
+import sys
+import time
+from typing import Dict, Iterator, List, TextIO
+from agents import ModelResponse, RunResultStreaming
+from agents.stream_events import RawResponsesStreamEvent
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseFunctionCallArgumentsDeltaEvent,
+    ResponseFunctionToolCall,
+    ResponseOutputItemAddedEvent,
+    ResponseOutputItemDoneEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseStreamEvent,
+    ResponseTextDeltaEvent,
+    ResponseUsage,
+)
+
+
+class PartialJsonStringField:
+    """
+    从流式到达的 JSON 参数中增量解出某个字符串字段的值，
+    用于在 send_message 的参数生成过程中就开始显示消息内容。
+    """
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field: str):
+        self._start_pattern = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._buffer = ''
+        self._pos: int | None = None  # 字段值中下一个待解析字符在 buffer 中的位置
+        self.done = False
+
+    def feed(self, delta: str) -> str:
+        """追加参数片段，返回新解出的文本"""
+        self._buffer += delta
+        if self.done:
+            return ''
+        if self._pos is None:
+            match = self._start_pattern.search(self._buffer)
+            if not match:
+                return ''
+            self._pos = match.end()
+        out: List[str] = []
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer):
+            ch = buffer[pos]
+            if ch == '"':
+                self.done = True
+                pos += 1
+                break
+            if ch != '\\':
+                out.append(ch)
+                pos += 1
+                continue
+            if pos + 1 >= len(buffer):
+                break  # 转义序列不完整，等待后续片段
+            esc = buffer[pos + 1]
+            if esc != 'u':
+                out.append(self._ESCAPES.get(esc, esc))
+                pos += 2
+                continue
+            if pos + 6 > len(buffer):
+                break
+            code = int(buffer[pos + 2:pos + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # UTF-16 代理对需要等低位也到齐
+                if pos + 12 > len(buffer):
+                    break
+                low = int(buffer[pos + 8:pos + 12], 16)
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                pos += 12
+            else:
+                out.append(chr(code))
+                pos += 6
+        self._pos = pos
+        return ''.join(out)
+
+
+class StreamHandler:
+    """流式回调。默认实现什么都不做，按需覆盖"""
+
+    def on_reasoning_delta(self, text: str) -> None:
+        pass
+
+    def on_text_delta(self, text: str) -> None:
+        pass
+
+    def on_tool_call_started(self, name: str) -> None:
+        pass
+
+    def on_tool_arguments_delta(self, name: str, delta: str) -> None:
+        pass
+
+    def on_message_delta(self, text: str) -> None:
+        """send_message 的 content 参数随生成增量到达"""
+        pass
+
+    def on_response_done(self) -> None:
+        pass
+
+
+class ConsoleStreamHandler(StreamHandler):
+    """把流式内容直接打印到终端"""
+
+    def __init__(self, out: TextIO = sys.stdout, show_arguments: bool = True):
+        self.out = out
+        self.show_arguments = show_arguments
+        self._section: str | None = None
+
+    def _enter(self, section: str, title: str) -> None:
+        if self._section != section:
+            self.out.write(f'\n[{title}] ')
+            self._section = section
+
+    def _write(self, text: str) -> None:
+        self.out.write(text)
+        self.out.flush()
+
+    def on_reasoning_delta(self, text: str) -> None:
+        self._enter('reasoning', 'reasoning')
+        self._write(text)
+
+    def on_text_delta(self, text: str) -> None:
+        self._enter('text', 'text')
+        self._write(text)
+
+    def on_tool_call_started(self, name: str) -> None:
+        self._section = None
+        self._enter(f'tool:{name}', f'tool call: {name}')
+
+    def on_tool_arguments_delta(self, name: str, delta: str) -> None:
+        if self.show_arguments and name != 'send_message':
+            self._write(delta)
+
+    def on_message_delta(self, text: str) -> None:
+        self._enter('message', 'message to user')
+        self._write(text)
+
+    def on_response_done(self) -> None:
+        if self._section is not None:
+            self._write('\n')
+        self._section = None
+
+
+async def consume_stream(result: RunResultStreaming, handler: StreamHandler) -> None:
+    """把 Runner.run_streamed 的原始事件分发给 handler，直到本次运行结束"""
+    # 以 output_index 区分同一响应中的多个工具调用
+    tool_names: Dict[int, str] = {}
+    message_fields: Dict[int, PartialJsonStringField] = {}
+    async for event in result.stream_events():
+        if not isinstance(event, RawResponsesStreamEvent):
+            continue
+        data = event.data
+        match data.type:
+            case 'response.reasoning_summary_text.delta' | 'response.reasoning_text.delta':
+                handler.on_reasoning_delta(data.delta)  # type: ignore[union-attr]
+            case 'response.output_text.delta':
+                handler.on_text_delta(data.delta)  # type: ignore[union-attr]
+            case 'response.output_item.added':
+                item = data.item  # type: ignore[union-attr]
+                if item.type == 'function_call':
+                    index = data.output_index  # type: ignore[union-attr]
+                    tool_names[index] = item.name
+                    handler.on_tool_call_started(item.name)
+                    if item.name == 'send_message':
+                        message_fields[index] = PartialJsonStringField('content')
+            case 'response.function_call_arguments.delta':
+                _arguments_delta(handler, tool_names, message_fields,
+                                 data.output_index, data.delta)  # type: ignore[union-attr]
+            case 'response.completed':
+                handler.on_response_done()
+                tool_names.clear()
+                message_fields.clear()
+
+
+def _arguments_delta(handler: StreamHandler, tool_names: Dict[int, str],
+                     message_fields: Dict[int, PartialJsonStringField], index: int, delta: str) -> None:
+    name = tool_names.get(index, '')
+    handler.on_tool_arguments_delta(name, delta)
+    if index in message_fields:
+        if text := message_fields[index].feed(delta):
+            handler.on_message_delta(text)
+
+
+def response_events(response: ModelResponse, chunk_size: int = 16) -> Iterator[ResponseStreamEvent]:
+    """
+    把一个完整的 ModelResponse 还原为流式事件（用于本地替身模型和缓存命中时的流式输出）。
+    工具参数和文本按 chunk_size 切成增量，最后的 response.completed 携带完整输出和用量
+    """
+    seq = itertools.count()
+    for index, item in enumerate(response.output):
+        if isinstance(item, ResponseFunctionToolCall):
+            yield ResponseOutputItemAddedEvent(
+                item=item.model_copy(update={'arguments': ''}), output_index=index,
+                type='response.output_item.added', sequence_number=next(seq))
+            for i in range(0, len(item.arguments), chunk_size):
+                yield ResponseFunctionCallArgumentsDeltaEvent(
+                    delta=item.arguments[i:i + chunk_size], item_id=item.id or '', output_index=index,
+                    type='response.function_call_arguments.delta', sequence_number=next(seq))
+        elif isinstance(item, ResponseOutputMessage):
+            yield ResponseOutputItemAddedEvent(
+                item=item.model_copy(update={'content': []}), output_index=index,
+                type='response.output_item.added', sequence_number=next(seq))
+            for content_index, content in enumerate(item.content):
+                if not isinstance(content, ResponseOutputText):
+                    continue
+                for i in range(0, len(content.text), chunk_size):
+                    yield ResponseTextDeltaEvent(
+                        delta=content.text[i:i + chunk_size], item_id=item.id, output_index=index,
+                        content_index=content_index, logprobs=[],
+                        type='response.output_text.delta', sequence_number=next(seq))
+        else:
+            yield ResponseOutputItemAddedEvent(item=item, output_index=index,  # type: ignore[arg-type]
+                                               type='response.output_item.added', sequence_number=next(seq))
+        yield ResponseOutputItemDoneEvent(item=item, output_index=index,  # type: ignore[arg-type]
+                                          type='response.output_item.done', sequence_number=next(seq))
+    usage = response.usage
+    completed = Response(
+        id=response.response_id or 'resp_local', created_at=time.time(), model='local',
+        object='response', output=response.output, tool_choice='auto', tools=[], top_p=None,
+        parallel_tool_calls=False,
+        usage=ResponseUsage(
+            input_tokens=usage.input_tokens, output_tokens=usage.output_tokens,
+            total_tokens=usage.total_tokens, input_tokens_details=usage.input_tokens_details,
+            output_tokens_details=usage.output_tokens_details))
+    yield ResponseCompletedEvent(response=completed, type='response.completed', sequence_number=next(seq))
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Dict, List, Mapping, Set, Tuple
+from agents import Agent, Model, RunConfig
+from .context import PendingSummary, StackAndHeapContext
+from .message_log import MessageLog
+from .runtime import run_turn
+from .telemetry import detached_context
+
+logger = logging.getLogger(__name__)
+
+# 对应 tools.py 中 apply_patch_to_note / undo_note_patch / redo_note_patch 的成功输出
+PATCH_APPLIED = re.compile(r'Patch applied successfully\. The note is now at version (\d+)\.')
+PATCH_UNDONE = re.compile(r'Undid the change of version (\d+)\.')
+PATCH_REDONE = re.compile(r'Redid the change of version (\d+)\.')
+
+
+class BackgroundSummarizer:
+    """
+    推测式后台总结。
+    frame 进入 summarizing 阶段时不在主对话中等待总结：先临时弹出（pop_subtask(pending=True)），
+    主循环立刻继续；总结阶段在独立的临时上下文中运行，结束后把其中成功的 note patch
+    重新应用到主上下文，并用真正的返回值替换占位输出。
+    与主循环期间的 note 修改冲突的 patch 会被丢弃，并在总结输出中注明。
+    后台运行出错时 pending 记录保留在上下文中，下次 resume() 时重试。
+    """
+
+    def __init__(self, starting_agent: Agent[StackAndHeapContext] | None = None,
+                 run_config: RunConfig | None = None,
+                 stage_models: Mapping[str, Model] | None = None,
+                 max_turns: int = 8):
+        self.starting_agent = starting_agent
+        self.run_config = run_config
+        self.stage_models = stage_models
+        self.max_turns = max_turns
+        self.tasks: Set[asyncio.Task] = set()
+        self._running: Set[int] = set()  # 正在总结的 PendingSummary.message_id
+
+    def start(self, ctx: StackAndHeapContext) -> None:
+        """临时弹出栈顶 frame，并在后台运行它的总结阶段"""
+        ctx.pop_subtask('', pending=True)
+        ctx.set_stage("main_loop")
+        self._spawn(ctx, ctx.pending_summaries[-1])
+
+    def resume(self, ctx: StackAndHeapContext) -> None:
+        """重新启动上下文中尚未完成的后台总结（例如进程重启之后）"""
+        for pending in ctx.pending_summaries:
+            if pending.message_id not in self._running:
+                self._spawn(ctx, pending)
+
+    def _spawn(self, ctx: StackAndHeapContext, pending: PendingSummary) -> None:
+        self._running.add(pending.message_id)
+        # start() 在主循环的轮内调用，后台任务不能继承该轮的 telemetry recorder
+        task = asyncio.create_task(self._summarize(ctx, pending), name=f'summary-{pending.message_id}',
+                                   context=detached_context())
+        self.tasks.add(task)
+
+        def done(task: asyncio.Task) -> None:
+            self.tasks.discard(task)
+            self._running.discard(pending.message_id)
+        task.add_done_callback(done)
+
+    async def drain(self) -> None:
+        """等待所有后台总结完成"""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+    async def cancel(self) -> None:
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+    async def _summarize(self, ctx: StackAndHeapContext, pending: PendingSummary) -> None:
+        scratch = summary_context(ctx, pending)
+        start = len(scratch.chat_history)
+        try:
+            for _ in range(self.max_turns):
+                if scratch.current_stage != "summarizing":
+                    break
+                await run_turn(scratch, self.starting_agent, run_config=self.run_config,
+                               stage_models=self.stage_models)
+        except Exception:
+            logger.exception('Background summary of message %d failed', pending.message_id)
+            return
+        patches, return_value = summary_results(scratch, start)
+        if return_value is None:
+            logger.warning('Background summary of message %d did not pop within %d turns',
+                           pending.message_id, self.max_turns)
+            return_value = '(summary not finished)'
+        failed = 0
+        for patch in patches:
+            try:
+                ctx.apply_patch_to_note(patch)
+            except ValueError as e:
+                failed += 1
+                logger.warning('Dropped a background summary patch: %s', e)
+        notice = f' {failed} note patch(es) from the summary conflicted with later edits and were dropped.' if failed else ''
+        ctx.resolve_pending_summary(pending.message_id, return_value, notice)
+        ctx.sync()
+
+
+def summary_context(ctx: StackAndHeapContext, pending: PendingSummary) -> StackAndHeapContext:
+    """用弹出前的栈重建独立的总结上下文。消息是物化后的副本，不与主上下文共享日志"""
+    history = MessageLog()
+    frames = [frame.model_copy(update={'message_ids': list(history.extend(ctx.frame_messages(frame)))})
+              for frame in pending.frames]
+    return StackAndHeapContext(
+        stack=frames,
+        note=ctx.note,
+        current_stage="summarizing",
+        chat_history=history,
+        conversation_layout=ctx.conversation_layout,
+        compaction_keep_last=ctx.compaction_keep_last,
+    )
+
+
+def summary_results(scratch: StackAndHeapContext, start: int) -> Tuple[List[str], str | None]:
+    """
+    从总结上下文中 start 之后的消息取出最终生效的 note patch 和 pop_subtask 的返回值。
+    按顺序重放 apply/undo/redo：被撤销的 patch 不计入，重做后重新计入
+    """
+    calls = {}
+    applied: Dict[int, str] = {}  # 版本号 -> 产生该版本的 patch，按生效顺序
+    undone: Dict[int, str] = {}
+    return_value = None
+    for message_id in range(start, len(scratch.chat_history)):
+        message = scratch.chat_history[message_id]
+        if message.get('type') == 'function_call':
+            calls[message['call_id']] = message  # type: ignore
+            continue
+        call = calls.get(message.get('call_id'))  # type: ignore
+        if message.get('type') != 'function_call_output' or call is None:
+            continue
+        output = message['output']  # type: ignore
+        arguments = json.loads(call['arguments'])  # type: ignore
+        if call['name'] == 'apply_patch_to_note' and (match := PATCH_APPLIED.match(output)):
+            applied[int(match[1])] = arguments['patch']
+            undone.clear()  # 新的 patch 之后不能再重做
+        elif call['name'] == 'undo_note_patch' and (match := PATCH_UNDONE.match(output)):
+            version = int(match[1])
+            if version in applied:
+                undone[version] = applied.pop(version)
+            else:
+                logger.warning('Undo of note version %d predates the summary and is not carried over', version)
+        elif call['name'] == 'redo_note_patch' and (match := PATCH_REDONE.match(output)):
+            if (version := int(match[1])) in undone:
+                applied[version] = undone.pop(version)
+        elif call['name'] == 'pop_subtask' and 'error' not in output:  # type: ignore
+            return_value = arguments['return_value']
+    return list(applied.values()), return_value
@@ -0,0 +1,271 @@
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
+from dataclasses import replace
+from typing import Any, Dict, Iterator, List, Tuple
+from agents import Agent, FunctionTool, ModelResponse, RunContextWrapper, RunHooks, TResponseInputItem
+from .context import StackAndHeapContext
+
+# agents SDK 默认的工具异常输出（default_tool_error_function）
+TOOL_ERROR_PREFIX = 'An error occurred while running the tool.'
+
+_current_turn: ContextVar['TurnRecorder | None'] = ContextVar('stackandheap_turn', default=None)
+
+
+def detached_context() -> Context:
+    """当前 contextvars 上下文的副本，但不绑定到当前轮；在轮内创建、生命周期超出本轮的后台任务应在其中运行"""
+    context = copy_context()
+    context.run(_current_turn.set, None)
+    return context
+
+
+class TurnRecorder:
+    """收集一轮中的计时 span、模型用量和工具结果。通过 contextvar 绑定到当前轮，hooks 和被包装的工具据此写入"""
+
+    def __init__(self, session_id: str, turn: int):
+        self.session_id = session_id
+        self.turn = turn
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.model_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.tools: List[Dict[str, Any]] = []
+        self.patches: Dict[str, int] = defaultdict(int)
+        self._llm_start: float | None = None
+
+    def _add_span(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        self.spans.append({'name': name, 'start_ms': round((start - self._start) * 1000, 3),
+                           'ms': round((end - start) * 1000, 3), **attrs})
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_span(name, start, time.perf_counter(), **attrs)
+
+    def llm_started(self) -> None:
+        self._llm_start = time.perf_counter()
+
+    def llm_finished(self, response: ModelResponse) -> None:
+        end = time.perf_counter()
+        usage = response.usage
+        self.model_calls += 1
+        self.input_tokens += usage.input_tokens
+        self.output_tokens += usage.output_tokens
+        self.cached_tokens += usage.input_tokens_details.cached_tokens or 0
+        self._add_span('model', self._llm_start if self._llm_start is not None else end, end,
+                       input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+        self._llm_start = None
+
+    def tool_finished(self, name: str, start: float, result: Any) -> None:
+        end = time.perf_counter()
+        status = 'error' if isinstance(result, str) and result.startswith(TOOL_ERROR_PREFIX) else 'ok'
+        self._add_span(f'tool:{name}', start, end, status=status)
+        self.tools.append({'name': name, 'status': status, 'ms': round((end - start) * 1000, 3)})
+        if name == 'apply_patch_to_note':
+            if status == 'error':
+                self.patches['failed'] += 1
+            elif 'did not match exactly' in str(result):
+                self.patches['approximate'] += 1
+            else:
+                self.patches['exact'] += 1
+
+    def to_record(self, ctx: StackAndHeapContext, error: str | None = None) -> Dict[str, Any]:
+        return {
+            'ts': self.started_at,
+            'session': self.session_id,
+            'turn': self.turn,
+            'ms': round((time.perf_counter() - self._start) * 1000, 3),
+            'error': error,
+            'stage': ctx.current_stage,
+            'model_calls': self.model_calls,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cached_tokens': self.cached_tokens,
+            'tools': self.tools,
+            'patches': dict(self.patches),
+            'stack_depth': len(ctx.stack),
+            'frame_messages': [len(subtask.message_ids) for subtask in ctx.stack],
+            'frame_tokens': [ctx.frame_tokens(subtask) for subtask in ctx.stack],
+            'note_chars': len(ctx.note),
+            'note_tokens': ctx.note_tokens(),
+            'spans': self.spans,
+        }
+
+
+class TelemetryHooks(RunHooks[StackAndHeapContext]):
+    """记录每次模型调用的耗时和 token 用量"""
+
+    async def on_llm_start(self, context: RunContextWrapper[StackAndHeapContext],
+                           agent: Agent[StackAndHeapContext], system_prompt: str | None,
+                           input_items: List[TResponseInputItem]) -> None:
+        if recorder := _current_turn.get():
+            recorder.llm_started()
+
+    async def on_llm_end(self, context: RunContextWrapper[StackAndHeapContext],
+                         agent: Agent[StackAndHeapContext], response: ModelResponse) -> None:
+        if recorder := _current_turn.get():
+            recorder.llm_finished(response)
+
+
+def instrumented_tool(tool: FunctionTool) -> FunctionTool:
+    """包装工具：当前轮启用了 telemetry 时记录执行耗时和成功/失败；否则直接调用原工具"""
+    invoke = tool.on_invoke_tool
+
+    async def on_invoke_tool(ctx, input: str) -> Any:
+        recorder = _current_turn.get()
+        if recorder is None:
+            return await invoke(ctx, input)
+        start = time.perf_counter()
+        result = await invoke(ctx, input)
+        recorder.tool_finished(tool.name, start, result)
+        return result
+
+    return replace(tool, on_invoke_tool=on_invoke_tool)
+
+
+class _Metrics:
+    """累计指标，按 Prometheus 文本格式输出。计数器跨会话汇总，gauge 按会话区分"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+        self.gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, record: Dict[str, Any]) -> None:
+        session = record['session']
+        with self.lock:
+            self.inc('stackandheap_turns_total')
+            if record['error']:
+                self.inc('stackandheap_turn_errors_total')
+            self.inc('stackandheap_turn_seconds_sum', record['ms'] / 1000)
+            self.inc('stackandheap_turn_seconds_count')
+            self.inc('stackandheap_model_calls_total', record['model_calls'])
+            for kind in ('input', 'output', 'cached'):
+                self.inc('stackandheap_tokens_total', record[f'{kind}_tokens'], kind=kind)
+            for tool in record['tools']:
+                self.inc('stackandheap_tool_calls_total', tool=tool['name'], status=tool['status'])
+            for result, count in record['patches'].items():
+                self.inc('stackandheap_note_patches_total', count, result=result)
+            for span in record['spans']:
+                name = 'tool' if span['name'].startswith('tool:') else span['name']
+                self.inc('stackandheap_span_seconds_sum', span['ms'] / 1000, span=name)
+                self.inc('stackandheap_span_seconds_count', span=name)
+            self.set('stackandheap_stack_depth', record['stack_depth'], session=session)
+            self.set('stackandheap_top_frame_tokens', record['frame_tokens'][-1], session=session)
+            self.set('stackandheap_context_tokens', sum(record['frame_tokens']) + record['note_tokens'],
+                     session=session)
+            self.set('stackandheap_note_chars', record['note_chars'], session=session)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                declared = set()
+                for (name, labels), value in sorted(values.items()):
+                    # xxx_sum / xxx_count 是 summary xxx 的两个序列
+                    base, metric_type = name, kind
+                    if name.endswith(('_sum', '_count')):
+                        base, metric_type = name.rsplit('_', 1)[0], 'summary'
+                    if base not in declared:
+                        declared.add(base)
+                        lines.append(f'# TYPE {base} {metric_type}')
+                    label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    lines.append(f'{name}{{{label_text}}} {value:g}' if label_text else f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Telemetry:
+    """
+    每轮的观测数据：run_turn 记录 build_conversation / 模型运行 / add_messages / sync 等 span，
+    TelemetryHooks 记录模型调用和 token 用量，instrumented_tool 记录工具耗时与失败，
+    轮末附上栈深度、各 frame 大小和 note 大小。
+
+    每轮一行写入按大小轮转的 JSONL 文件；设置 prometheus_path 时同时把累计指标以
+    Prometheus 文本格式原子地写入该文件（可交给 node_exporter 的 textfile collector）。
+    多个会话共享同一个 Telemetry 时，用 bind(session_id) 得到各自的句柄。
+    """
+
+    def __init__(self, path: str = 'logs/metrics.jsonl', max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5, prometheus_path: str | None = None, session_id: str = 'main'):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.session_id = session_id
+        self.hooks = TelemetryHooks()
+        self._handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self._metrics = _Metrics()
+        self._turns = 0
+
+    def bind(self, session_id: str) -> 'Telemetry':
+        """同一输出文件、同一组累计指标下的另一个会话句柄"""
+        bound = copy.copy(self)
+        bound.session_id = session_id
+        bound._turns = 0
+        return bound
+
+    @contextmanager
+    def turn(self, ctx: StackAndHeapContext) -> Iterator[TurnRecorder]:
+        """记录一轮；期间的 hooks 和工具调用都写入返回的 recorder，结束时导出"""
+        self._turns += 1
+        recorder = TurnRecorder(self.session_id, self._turns)
+        token = _current_turn.set(recorder)
+        error = None
+        try:
+            yield recorder
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            _current_turn.reset(token)
+            self.export(recorder.to_record(ctx, error))
+
+    def export(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        self._handler.handle(logging.makeLogRecord({'msg': line, 'levelno': logging.INFO}))
+        self._metrics.observe(record)
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+    def write_prometheus(self, path: str) -> None:
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self._metrics.render())
+        os.replace(tmp, path)
+
+    def close(self) -> None:
+        self._handler.close()
+
+
+@contextmanager
+def maybe_span(recorder: TurnRecorder | None, name: str) -> Iterator[None]:
+    if recorder is None:
+        yield
+    else:
+        with recorder.span(name):
+            yield
@@ -0,0 +1,56 @@
+import json
+import logging
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# 每条消息在请求中的固定开销（role/type 等结构字段）
+MESSAGE_OVERHEAD = 4
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF
+            or 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF)
+
+
+def estimate_tokens(text: str) -> int:
+    """无分词器时的估算：中日文字符约 1 token/字，其余约 4 字符/token"""
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenCounter:
+    """
+    消息 token 计数。优先使用 tiktoken 的编码；tiktoken 不可用（未安装、无法下载词表）时退回估算。
+    计数只用于预算控制，不要求与 provider 的计费完全一致。
+    """
+
+    def __init__(self, encoding_name: str = 'o200k_base'):
+        self.encoding_name = encoding_name
+        self._encode: Callable[[str], List[int]] | None = None
+        self._loaded = False
+
+    def _load(self) -> None:
+        self._loaded = True
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(self.encoding_name)
+            self._encode = lambda text: encoding.encode(text, disallowed_special=())
+        except Exception as e:
+            logger.info('tiktoken unavailable (%s); using estimated token counts', e)
+
+    def count_text(self, text: str) -> int:
+        if not self._loaded:
+            self._load()
+        if self._encode is not None:
+            return len(self._encode(text))
+        return estimate_tokens(text)
+
+    def count_item(self, item: Any) -> int:
+        if isinstance(item, str):
+            return self.count_text(item) + MESSAGE_OVERHEAD
+        return self.count_text(json.dumps(item, ensure_ascii=False, separators=(',', ':'))) + MESSAGE_OVERHEAD
+
+
+default_counter = TokenCounter()
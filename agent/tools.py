@@ -1,8 +1,11 @@
 from agents import function_tool, RunContextWrapper
+from agents.tool_context import ToolContext
 from functools import wraps
+import inspect
 from .context import StackAndHeapContext
-from typing import Callable, TypeVar, cast
-from .context import StackAndHeapContext
+from .web_search import format_pages, format_search_results
+from pydantic import BaseModel
+from typing import Callable, List, TypeVar, cast
 
 
 F = TypeVar('F', bound=Callable[..., object])
@@ -10,12 +13,22 @@ F = TypeVar('F', bound=Callable[..., object])
 
 def require_not_in_main_loop(func: F) -> F:
     """tools装饰器，确保当前属于某个子任务的范畴"""
-    @wraps(func)
-    def wrapper(wrapper: RunContextWrapper[StackAndHeapContext], *args, **kwargs):
+    def check(wrapper: RunContextWrapper[StackAndHeapContext]):
         if len(wrapper.context.stack) == 1:
             raise RuntimeError(
                 "You are in the main loop now. You MUST start a new subtask before calling this tool."
             )
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(wrapper: RunContextWrapper[StackAndHeapContext], *args, **kwargs):
+            check(wrapper)
+            return await func(wrapper, *args, **kwargs)
+        return cast(F, async_wrapper)
+
+    @wraps(func)
+    def wrapper(wrapper: RunContextWrapper[StackAndHeapContext], *args, **kwargs):
+        check(wrapper)
         return func(wrapper, *args, **kwargs)
     return cast(F, wrapper)
 
@@ -43,7 +56,7 @@ Returns:
 
 
 @function_tool(is_enabled=lambda wrapper, _: wrapper.context.current_stage == "main_loop")
-def start_subtask(wrapper: RunContextWrapper[StackAndHeapContext], subtask_id: str, subtask_goal: str):
+def start_subtask(wrapper: ToolContext[StackAndHeapContext], subtask_id: str, subtask_goal: str):
     """ Start a new subtask. You will concentrate on the subgoal.
 
 IMPORTANT：If you are in main task now, you MUST start a new subtask. Otherwise, you will fail to call other tools.
@@ -53,19 +66,76 @@ Args:
     subtask_goal: Description of the subtask's goal
     """
     cm = wrapper.context
-    cm.push_subtask(subtask_id, subtask_goal)
+    cm.push_subtask(subtask_id, subtask_goal, start_call_id=wrapper.tool_call_id)
     return f'subtask started successfully. You are now working on subtask: {subtask_id} with subgoal: {subtask_goal}'
 
 
+class ParallelSubtask(BaseModel):
+    subtask_id: str
+    subtask_goal: str
+
+
+@function_tool(is_enabled=lambda wrapper, _: wrapper.context.current_stage == "main_loop"
+               and wrapper.context.subtask_runner is not None)
+async def start_parallel_subtasks(wrapper: ToolContext[StackAndHeapContext], subtasks: List[ParallelSubtask]):
+    """ Run several independent subtasks at the same time (e.g. lookups that do not depend on each other).
+Each subtask runs as a separate conversation: it works on its own goal, records what it learns in the note with apply_patch_to_note, and pops with a return value. Parallel subtasks CANNOT talk to the user.
+When all of them have finished, their note patches are merged into your note and you get every return value, plus any patches that conflicted and were not applied.
+
+Args:
+    subtasks: The subtasks to run. Each needs a unique subtask_id and a self-contained subtask_goal.
+    """
+    runner = wrapper.context.subtask_runner
+    if runner is None:
+        raise RuntimeError("Parallel subtasks are not enabled.")
+    if not subtasks:
+        raise ValueError("Provide at least one subtask.")
+    return await runner.run(wrapper.context, [(s.subtask_id, s.subtask_goal) for s in subtasks],
+                            parent_call_id=wrapper.tool_call_id)
+
+
+@function_tool(is_enabled=lambda wrapper, _: wrapper.context.web_search is not None)
+async def web_search(wrapper: RunContextWrapper[StackAndHeapContext], queries: List[str]):
+    """ Search the web. Several queries run at the same time, so put every query you need into one call.
+Results already returned for an earlier query in the same call are not repeated.
+
+Args:
+    queries: Search queries, e.g. ["python 3.12 release date", "asyncio TaskGroup"]
+    """
+    client = wrapper.context.web_search
+    if client is None:
+        raise RuntimeError("Web search is not enabled.")
+    if not queries:
+        raise ValueError("Provide at least one query.")
+    return format_search_results(await client.search(queries))
+
+
+@function_tool(is_enabled=lambda wrapper, _: wrapper.context.web_search is not None)
+async def fetch_pages(wrapper: RunContextWrapper[StackAndHeapContext], urls: List[str]):
+    """ Fetch the text of web pages (e.g. results of web_search). Several pages are fetched at the same time; long pages are truncated.
+
+Args:
+    urls: Page URLs to fetch
+    """
+    client = wrapper.context.web_search
+    if client is None:
+        raise RuntimeError("Web search is not enabled.")
+    if not urls:
+        raise ValueError("Provide at least one URL.")
+    return format_pages(await client.fetch(urls))
+
+
 @function_tool(is_enabled=lambda wrapper, _: wrapper.context.current_stage == "main_loop")
 @require_not_in_main_loop
-def send_message(wrapper: RunContextWrapper[StackAndHeapContext], content: str):
+async def send_message(wrapper: RunContextWrapper[StackAndHeapContext], content: str):
     """ Send a message to the user. When you want the character to communicate with the user, you must call this tool. Then wait for the user's response before proceeding.
 
 Args:
     content: The content of the message to send
     """
-    user_response = input(f"User received message: {content}\nYour reply: ")
+    user_response = await wrapper.context.user_channel.ask(content)
+    if user_response is None:
+        return "<system>The user did not reply in time</system>"
     if not user_response.strip():
         return "<system>No response</system>"
     return f'<system>The user replied: {user_response}</system>'
@@ -77,7 +147,7 @@ def finish_subtask(wrapper: RunContextWrapper[StackAndHeapContext]):
     """ Finish the current subtask. Call this tool when you have completed the subtask or determined that it cannot be completed."""
     cm = wrapper.context
     current_subtask = cm.stack[-1]
-    cm.current_stage = "summarizing"
+    cm.set_stage("summarizing")
     return f'Subtask {current_subtask.task_id} finished. Switching to summarizing stage.'
 
 
@@ -131,9 +201,50 @@ Args:
     patch: The patch string to apply, following the specified format. 
 """
     cm = wrapper.context
-    cm.apply_patch_to_note(patch)
+    applied = cm.apply_patch_to_note(patch)
+    approximate = [
+        f'Hunk under "{h.header}" did not match exactly and was applied to the closest lines ({h.kind}, similarity {h.score:.2f}).'
+        for h in applied if h.kind in ('normalized', 'fuzzy')]
+    notice = '\n'.join(approximate) + '\n' if approximate else ''
+
+    return (f'Patch applied successfully. The note is now at version {cm.note_version}.\n{notice}'
+            f'Changes:\n{cm.last_note_delta.describe()}')  # type: ignore
+
+
+@function_tool
+@require_not_in_main_loop
+def undo_note_patch(wrapper: RunContextWrapper[StackAndHeapContext]):
+    """ Undo the most recent change to the note (a patch or a redo). Can be called repeatedly to undo earlier changes."""
+    cm = wrapper.context
+    delta = cm.undo_note()
+    return f'Undid the change of version {delta.version}. The note is now at version {cm.note_version}.\nChanges:\n{delta.describe(undo=True)}'
+
+
+@function_tool
+@require_not_in_main_loop
+def redo_note_patch(wrapper: RunContextWrapper[StackAndHeapContext]):
+    """ Redo the most recently undone note change. Not available after a new patch has been applied."""
+    cm = wrapper.context
+    delta = cm.redo_note()
+    return f'Redid the change of version {delta.version}. The note is now at version {cm.note_version}.\nChanges:\n{delta.describe()}'
+
 
-    return f'Patch applied successfully.\nThe note is now:\n{cm.note}'
+@function_tool
+def read_note_sections(wrapper: RunContextWrapper[StackAndHeapContext], headers: List[str]):
+    """ Read the current note. Pass section title lines to read only those sections, or an empty list to read the whole note.
+
+Args:
+    headers: Section title lines exactly as they appear in the note, e.g. ["## 用户画像", "## 计划"]; [] for the whole note
+    """
+    cm = wrapper.context
+    if not headers:
+        return f'Note version {cm.note_version}:\n{cm.note}'
+    document = cm.note_document
+    missing = [header for header in headers if document.section(header) is None]
+    if missing:
+        available = ', '.join(s.header for s in document.sections if s.header is not None)
+        raise ValueError(f"Unknown note sections: {missing}. Available sections: {available}")
+    return '\n\n'.join('\n'.join(document.section(header).all_lines()) for header in headers)  # type: ignore
 
 
 @function_tool(is_enabled=lambda wrapper, _: wrapper.context.current_stage == "summarizing")
@@ -146,5 +257,5 @@ Args:
     """
     cm = wrapper.context
     cm.pop_subtask(return_value)
-    cm.current_stage = "main_loop"
+    cm.set_stage("main_loop")
     return return_value
@@ -0,0 +1,352 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from urllib.parse import urlsplit, urlunsplit
+from .response_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SearchResult:
+    title: str
+    url: str
+    snippet: str
+
+
+@dataclass
+class QueryResults:
+    query: str
+    results: List[SearchResult]
+    error: str | None = None
+    cached: bool = False
+
+
+@dataclass
+class FetchedPage:
+    url: str
+    text: str
+    error: str | None = None
+    cached: bool = False
+
+
+def normalize_query(query: str) -> str:
+    """缓存和去重用的查询形式：NFKC、小写、合并空白"""
+    return ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+
+
+def normalize_url(url: str) -> str:
+    """去掉 fragment 和末尾的 '/'，scheme 和域名小写"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+
+def truncate(text: str, limit: int) -> str:
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + '…'
+
+
+def one_line(text: str) -> str:
+    return ' '.join(text.split())
+
+
+class SearchBackend(ABC):
+    """搜索后端。方法是阻塞的，由 WebSearch 放到线程池中运行"""
+
+    @abstractmethod
+    def search(self, query: str, max_results: int) -> List[SearchResult]:
+        ...
+
+    @abstractmethod
+    def fetch(self, url: str) -> str:
+        """返回网页的正文文本"""
+        ...
+
+
+class DDGSBackend(SearchBackend):
+    """ddgs 元搜索；网页用 httpx 下载后去掉标签"""
+
+    def __init__(self, region: str = 'us-en', timeout: float = 10.0, backend: str = 'auto'):
+        self.region = region
+        self.timeout = timeout
+        self.backend = backend
+        self._local = threading.local()
+
+    @functools.cached_property
+    def _http(self) -> Any:
+        import httpx
+        return httpx.Client(timeout=self.timeout, follow_redirects=True,
+                            headers={'User-Agent': 'Mozilla/5.0 (compatible; StackAndHeap)'})
+
+    def _ddgs(self) -> Any:
+        # DDGS 内部的 HTTP 会话不保证线程安全，每个工作线程一个实例
+        if (client := getattr(self._local, 'ddgs', None)) is None:
+            from ddgs import DDGS
+            client = self._local.ddgs = DDGS(timeout=int(self.timeout))
+        return client
+
+    def search(self, query: str, max_results: int) -> List[SearchResult]:
+        from ddgs.exceptions import DDGSException
+        try:
+            items = self._ddgs().text(query, region=self.region, max_results=max_results, backend=self.backend)
+        except DDGSException as e:
+            if 'no results' in str(e).lower():
+                return []
+            raise
+        return [SearchResult(item.get('title', ''), item.get('href', ''), item.get('body', '')) for item in items]
+
+    def fetch(self, url: str) -> str:
+        response = self._http.get(url)
+        response.raise_for_status()
+        if 'html' in response.headers.get('content-type', 'text/html'):
+            return html_to_text(response.text)
+        return response.text
+
+
+class StandinSearchBackend(SearchBackend):
+    """
+    本地的替身后端，不访问网络，用于测试和基准：results(query) 给出搜索结果，pages 给出网页正文；
+    latency 秒的阻塞延迟模拟网络请求。calls 记录实际到达后端的请求
+    """
+
+    def __init__(self, results: Callable[[str], List[SearchResult]] | None = None,
+                 pages: Dict[str, str] | None = None, latency: float = 0.0):
+        self.results = results or self._default_results
+        self.pages = pages or {}
+        self.latency = latency
+        self.calls: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default_results(query: str) -> List[SearchResult]:
+        slug = '-'.join(normalize_query(query).split())
+        return [SearchResult(f'{query} — result {i}', f'https://example.com/{slug}/{i}',
+                             f'Stand-in result {i} for "{query}".') for i in range(3)]
+
+    def _record(self, kind: str, value: str) -> None:
+        with self._lock:
+            self.calls.append((kind, value))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def search(self, query: str, max_results: int) -> List[SearchResult]:
+        self._record('search', query)
+        return self.results(query)[:max_results]
+
+    def fetch(self, url: str) -> str:
+        self._record('fetch', url)
+        if url not in self.pages:
+            raise LookupError(f'404 Not Found: {url}')
+        return self.pages[url]
+
+
+class SearchCache(DiskCache):
+    """
+    搜索结果和网页的磁盘缓存（见 DiskCache 的 LRU 淘汰）。
+    键为 (种类, 规范化后的查询或 URL, 结果数) 的哈希；条目超过 ttl 秒视为过期
+    """
+
+    def __init__(self, root: str = 'logs/search_cache', ttl: float = 24 * 3600,
+                 max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(root, max_bytes)
+        self.ttl = ttl
+
+    @staticmethod
+    def key(kind: str, value: str) -> str:
+        return hashlib.sha256(f'{kind}\0{value}'.encode('utf-8')).hexdigest()
+
+    def get_entry(self, key: str) -> Any | None:
+        entry = self.get_json(key)
+        if entry is None:
+            return None
+        if time.time() - entry['created'] > self.ttl:
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            self.discard(key)
+            return None
+        return entry['value']
+
+    def put_entry(self, key: str, value: Any) -> None:
+        self.put_json(key, {'created': time.time(), 'value': value})
+
+
+class WebSearch:
+    """
+    并发的网页搜索/抓取。
+    一次调用中的多个查询（或 URL）按规范化形式去重，未命中缓存的在有界线程池中并发请求后端，
+    结果按 URL 去重（先出现的查询保留）并截断，成功的结果写入磁盘缓存。单个查询失败只影响它自己
+    """
+
+    def __init__(self, backend: SearchBackend | None = None, cache: SearchCache | None = None,
+                 max_workers: int = 4, max_results: int = 5, max_snippet_chars: int = 300,
+                 max_page_chars: int = 4000, timeout: float | None = 30.0):
+        self.backend = backend or DDGSBackend()
+        self.cache = cache
+        self.max_results = max_results
+        self.max_snippet_chars = max_snippet_chars
+        self.max_page_chars = max_page_chars
+        self.timeout = timeout  # 单个后端请求的超时（秒）；超时的线程继续运行，但不再等待它
+        self.backend_calls = 0
+        self._calls_lock = threading.Lock()  # backend_calls 在线程池中更新
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='web-search')
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _call(self, key: str, request: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        返回 (结果, 是否命中缓存)。读缓存和请求后端在同一次线程池调用中完成，不在事件循环上读磁盘；
+        同一个键正在查询时（例如并行子任务查同一个问题）共享这次查询
+        """
+        if (pending := self._inflight.get(key)) is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.ensure_future(self._request(key, request))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _request(self, key: str, request: Callable[[], Any]) -> Tuple[Any, bool]:
+        loop = asyncio.get_running_loop()
+        result, cached = await asyncio.wait_for(
+            loop.run_in_executor(self._executor, self._cached_or_request, key, request), self.timeout)
+        if not cached and self.cache is not None:
+            await loop.run_in_executor(self._executor, self.cache.put_entry, key, result)
+        return result, cached
+
+    def _cached_or_request(self, key: str, request: Callable[[], Any]) -> Tuple[Any, bool]:
+        """在线程池中运行：先查磁盘缓存，未命中时请求后端"""
+        if self.cache is not None and (cached := self.cache.get_entry(key)) is not None:
+            return cached, True
+        with self._calls_lock:
+            self.backend_calls += 1
+        return request(), False
+
+    async def _search_one(self, query: str) -> QueryResults:
+        normalized = normalize_query(query)
+        key = SearchCache.key('search', f'{normalized}\0{self.max_results}')
+        try:
+            items, cached = await self._call(key, lambda: [
+                asdict(result) for result in self.backend.search(query, self.max_results)])
+        except Exception as e:
+            logger.warning('Search for %r failed: %r', query, e)
+            return QueryResults(query, [], error=_describe(e))
+        return QueryResults(query, [SearchResult(**item) for item in items], cached=cached)
+
+    async def search(self, queries: Sequence[str]) -> List[QueryResults]:
+        unique: Dict[str, str] = {}
+        for query in queries:
+            if (normalized := normalize_query(query)) and normalized not in unique:
+                unique[normalized] = query.strip()
+        answers = await asyncio.gather(*(self._search_one(query) for query in unique.values()))
+        seen: set[str] = set()
+        for answer in answers:
+            kept = []
+            for result in answer.results:
+                url = normalize_url(result.url)
+                if url in seen:
+                    continue
+                seen.add(url)
+                kept.append(SearchResult(truncate(one_line(result.title), 200), result.url,
+                                         truncate(one_line(result.snippet), self.max_snippet_chars)))
+            answer.results = kept
+        return answers
+
+    async def _fetch_one(self, url: str) -> FetchedPage:
+        key = SearchCache.key('fetch', normalize_url(url))
+        try:
+            text, cached = await self._call(key, lambda: self.backend.fetch(url))
+        except Exception as e:
+            logger.warning('Fetching %s failed: %r', url, e)
+            return FetchedPage(url, '', error=_describe(e))
+        return FetchedPage(url, truncate(text, self.max_page_chars), cached=cached)
+
+    async def fetch(self, urls: Sequence[str]) -> List[FetchedPage]:
+        unique: Dict[str, str] = {}
+        for url in urls:
+            if url.strip():
+                unique.setdefault(normalize_url(url), url.strip())
+        return list(await asyncio.gather(*(self._fetch_one(url) for url in unique.values())))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return 'timed out'
+    return f'{type(error).__name__}: {error}'
+
+
+def format_search_results(answers: Sequence[QueryResults]) -> str:
+    blocks = []
+    for answer in answers:
+        lines = [f'## {answer.query}']
+        if answer.error is not None:
+            lines.append(f'(search failed: {answer.error})')
+        elif not answer.results:
+            lines.append('(no new results)')
+        lines += [f'- [{result.title}]({result.url})\n  {result.snippet}' for result in answer.results]
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def format_pages(pages: Sequence[FetchedPage]) -> str:
+    return '\n\n'.join(f'## {page.url}\n' + (f'(fetch failed: {page.error})' if page.error is not None else page.text)
+                       for page in pages)
+
+
+class _TextExtractor(HTMLParser):
+    SKIP = {'script', 'style', 'noscript', 'svg', 'head', 'template'}
+    BLOCK = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'pre'}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag: str, attrs: Any) -> None:
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_data(self, data: str) -> None:
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.parts).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+@functools.cache
+def default_web_search() -> WebSearch:
+    """
+    由环境变量配置的 WebSearch：WEB_SEARCH_BACKEND=ddgs（默认）或 standin；
+    WEB_SEARCH_CACHE_DIR 为空字符串时不缓存，WEB_SEARCH_CACHE_TTL 为缓存有效期（秒）
+    """
+    backend = StandinSearchBackend() if os.getenv('WEB_SEARCH_BACKEND') == 'standin' else DDGSBackend()
+    cache_dir = os.getenv('WEB_SEARCH_CACHE_DIR', 'logs/search_cache')
+    cache = SearchCache(cache_dir, ttl=float(os.getenv('WEB_SEARCH_CACHE_TTL') or 24 * 3600),
+                        max_bytes=int(os.getenv('WEB_SEARCH_CACHE_MAX_MB') or 64) * 1024 * 1024) \
+        if cache_dir else None
+    return WebSearch(backend, cache, max_workers=int(os.getenv('WEB_SEARCH_MAX_WORKERS') or 4))
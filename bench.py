@@ -0,0 +1,295 @@
+"""
+离线基准测试：不访问网络，用 ScriptedModel 驱动真实的 agent 循环，并对上下文/patch 的热点路径做微基准。
+
+    uv run bench.py                          # 默认规模
+    uv run bench.py --quick                  # 小规模，快速检查
+    uv run bench.py --json bench.json        # 同时保存结果
+    uv run bench.py --baseline bench.json    # 与之前的结果比较，变慢超过 --tolerance 时返回非零
+    uv run bench.py --only startup           # 冷启动：在新进程中导入各模块的耗时
+
+每项报告单次操作的平均/最好耗时（多次重复）和一次操作期间的峰值内存（tracemalloc）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+from agents import RunConfig, set_tracing_disabled
+from agent.channels import UserChannel
+from agent.context import StackAndHeapContext, Subtask
+from agent.main_agent import agent, multi_tool_agent
+from agent.message_log import MessageLog
+from agent.runtime import run_turn
+from agent.scripted_model import ScriptedModel, default_script
+from agent.streaming import StreamHandler
+from agent.utils import apply_patch
+from agent.web_search import SearchCache, StandinSearchBackend, WebSearch
+
+
+@dataclass
+class BenchResult:
+    name: str
+    params: str
+    mean_ms: float
+    best_ms: float
+    peak_kib: float
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}[{self.params}]'
+
+    def __str__(self) -> str:
+        return f'{self.key:<58} mean {self.mean_ms:10.3f} ms  best {self.best_ms:10.3f} ms  peak {self.peak_kib:10.1f} KiB'
+
+
+def measure(name: str, params: str, setup: Callable[[], Any], op: Callable[[Any], Any],
+            repeat: int, number: int = 1) -> BenchResult:
+    """每次重复先 setup（不计时），再执行 number 次 op；峰值内存另外单独跑一次"""
+    times: List[float] = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            op(state)
+        times.append((time.perf_counter() - start) / number)
+    state = setup()
+    tracemalloc.start()
+    try:
+        op(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchResult(name, params, statistics.mean(times) * 1000, min(times) * 1000, peak / 1024)
+
+
+# ---- 合成数据 ----
+
+def synthetic_note(lines: int, sections: int = 10) -> str:
+    per_section = max(1, lines // sections)
+    parts = ['# Note', '']
+    for s in range(sections):
+        parts.append(f'## Section {s}')
+        parts += [f'- item {s}.{i}: 用户提到的一条信息 with some english words' for i in range(per_section)]
+        parts.append('')
+    return '\n'.join(parts) + '\n'
+
+
+def _call_pair(name: str, call_id: str, arguments: Dict[str, Any], output: str) -> List[Dict[str, Any]]:
+    return [
+        {'type': 'function_call', 'name': name, 'call_id': call_id, 'id': f'fc_{call_id}',
+         'arguments': json.dumps(arguments, ensure_ascii=False), 'status': 'completed'},
+        {'type': 'function_call_output', 'call_id': call_id, 'output': output},
+    ]
+
+
+def synthetic_context(depth: int, messages_per_frame: int, note_lines: int = 100,
+                      history: int = 0) -> StackAndHeapContext:
+    """
+    depth 层的栈（含主任务），每个 frame 约 messages_per_frame 条消息；
+    history 条已弹出、不再被引用的历史消息放在日志开头
+    """
+    log = MessageLog()
+    counter = 0
+
+    def pairs(name: str, arguments: Dict[str, Any], output: str) -> range:
+        nonlocal counter
+        counter += 1
+        return log.extend(_call_pair(name, f'call_{counter}', arguments, output))  # type: ignore
+
+    for i in range(history // 2):
+        pairs('brainstorm', {'thinking': f'old thought {i} ' * 8}, 'None')
+    stack: List[Subtask] = []
+    for d in range(depth):
+        ids: List[int] = []
+        if d:
+            ids += pairs('start_subtask', {'subtask_id': f'task{d}', 'subtask_goal': f'goal {d}'},
+                         f'subtask started successfully. You are now working on subtask: task{d}')
+        for i in range(messages_per_frame // 2):
+            if i % 2:
+                ids += pairs('send_message', {'content': f'消息 {d}.{i}'}, '<system>The user replied: 好的</system>')
+            else:
+                ids += pairs('brainstorm', {'thinking': f'thinking about step {d}.{i} ' * 8}, 'None')
+        stack.append(Subtask(task_id=f'task{d}' if d else 'main', goal=f'goal {d}' if d else 'main',
+                             message_ids=ids))
+    return StackAndHeapContext(stack=stack, chat_history=log, note=synthetic_note(note_lines))
+
+
+def middle_line_patches(note: str) -> Tuple[str, str]:
+    """替换中间一节里的一行，以及把它改回去的反向 patch"""
+    lines = note.split('\n')
+    headers = [i for i, line in enumerate(lines) if line.startswith('## ')]
+    header = headers[len(headers) // 2]
+    target = lines[header + 1]
+    forward = f'*** Begin Patch\n@@ {lines[header]}\n-{target}\n+{target} (updated)\n*** End Patch'
+    backward = f'*** Begin Patch\n@@ {lines[header]}\n-{target} (updated)\n+{target}\n*** End Patch'
+    return forward, backward
+
+
+# ---- 微基准 ----
+
+def bench_micro(quick: bool) -> List[BenchResult]:
+    repeat = 5 if quick else 20
+    results: List[BenchResult] = []
+    frame_sizes = [(2, 50), (8, 50), (4, 500)] if quick else [(2, 50), (8, 50), (4, 500), (16, 200), (4, 2000)]
+    for depth, per_frame in frame_sizes:
+        params = f'depth={depth},frame={per_frame}'
+        ctx = synthetic_context(depth, per_frame, note_lines=200, history=1000)
+        results.append(measure('build_conversation', params, lambda: ctx,
+                               lambda c: c.build_conversation(), repeat, number=10))
+        results.append(measure('add_messages', params,
+                               lambda: synthetic_context(depth, per_frame, note_lines=200),
+                               lambda c: c.add_messages(_call_pair('brainstorm', 'call_x', {'thinking': 'x' * 200}, 'None')),
+                               repeat, number=50))
+        if depth > 1:
+            results.append(measure('pop_subtask', params,
+                                   lambda: synthetic_context(depth, per_frame, note_lines=200),
+                                   lambda c: c.pop_subtask('done'), repeat))
+
+    histories = [1_000, 10_000] if quick else [1_000, 10_000, 100_000]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'conversation.json')
+        for history in histories:
+            params = f'history={history}'
+            ctx = synthetic_context(4, 100, note_lines=200, history=history)
+            results.append(measure('save', params, lambda: ctx, lambda c: c.save(path), repeat))
+            ctx.save(path)
+            results.append(measure('load', params, lambda: None,
+                                   lambda _: StackAndHeapContext.load(path), repeat))
+
+    note_sizes = [100, 1_000] if quick else [100, 1_000, 10_000]
+    for note_lines in note_sizes:
+        note = synthetic_note(note_lines)
+        forward, backward = middle_line_patches(note)
+        results.append(measure('apply_patch', f'note_lines={note_lines}', lambda: None,
+                               lambda _: apply_patch(forward, note), repeat, number=10))
+        # 交替应用正反两个 patch，note 保持原样，测量上下文持有 NoteDocument 的增量路径
+        ctx = StackAndHeapContext(stack=[Subtask(), Subtask(task_id='t')], note=note)
+        results.append(measure('apply_patch_to_note', f'note_lines={note_lines}', lambda: ctx,
+                               lambda c: (c.apply_patch_to_note(forward), c.apply_patch_to_note(backward)),
+                               repeat, number=5))
+
+    # 8 个查询，替身后端每次请求阻塞 50ms：冷缓存时在线程池中并发，热缓存时不访问后端
+    queries = [f'query {i}' for i in range(8)]
+    with tempfile.TemporaryDirectory() as tmp:
+        def search_client(cache_dir: str) -> WebSearch:
+            return WebSearch(StandinSearchBackend(latency=0.05), SearchCache(cache_dir), max_workers=4)
+
+        results.append(measure('web_search', 'queries=8,cache=cold',
+                               lambda: search_client(tempfile.mkdtemp(dir=tmp)),
+                               lambda client: asyncio.run(client.search(queries)), repeat))
+        warm = search_client(os.path.join(tmp, 'warm'))
+        asyncio.run(warm.search(queries))
+        results.append(measure('web_search', 'queries=8,cache=warm', lambda: warm,
+                               lambda client: asyncio.run(client.search(queries)), repeat))
+    return results
+
+
+# ---- 端到端 ----
+
+class AutoReplyChannel(UserChannel):
+    async def _ask(self, content: str) -> str:
+        return '好的'
+
+
+def bench_agent_loop(quick: bool) -> List[BenchResult]:
+    turns = 60 if quick else 300
+    repeat = 2 if quick else 3
+    results: List[BenchResult] = []
+    modes = [('single_tool', agent, False), ('multi_tool', multi_tool_agent, False),
+             ('single_tool_stream', agent, True)]
+    for mode, starting_agent, stream in modes:
+        def setup():
+            tmp = tempfile.mkdtemp()
+            ctx = StackAndHeapContext.open_journal(os.path.join(tmp, 'conversation.jsonl'))
+            ctx.set_user_channel(AutoReplyChannel())
+            ctx.note = synthetic_note(50) + '## Log\n'
+            return ctx
+
+        def run(ctx: StackAndHeapContext) -> None:
+            model = ScriptedModel(default_script())
+            run_config = RunConfig(model=model)
+            handler = StreamHandler() if stream else None
+
+            async def loop():
+                while model.calls < turns:
+                    await run_turn(ctx, starting_agent, run_config=run_config, stream=handler, max_turns=50)
+            asyncio.run(loop())
+
+        results.append(measure('agent_loop', f'{mode},model_calls={turns}', setup, run, repeat))
+    return results
+
+
+# ---- 冷启动 ----
+
+STARTUP_IMPORTS = ['agent.utils', 'agent.context', 'agent.main_agent', 'agent.runtime']
+
+
+def bench_startup(quick: bool) -> List[BenchResult]:
+    """在新的解释器进程中导入模块的耗时（含解释器自身启动，以 python -c pass 作为对照）"""
+    repeat = 3 if quick else 10
+    results: List[BenchResult] = []
+    for module in ['', *STARTUP_IMPORTS]:
+        code = f'import {module}' if module else 'pass'
+        command = [sys.executable, '-c', code]
+        results.append(measure('startup', f'import={module or "(none)"}', lambda: None,
+                               lambda _: subprocess.run(command, check=True), repeat))
+    return results
+
+
+def compare(results: List[BenchResult], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {f"{r['name']}[{r['params']}]": r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        if (old := baseline.get(result.key)) is None:
+            continue
+        ratio = result.mean_ms / old['mean_ms'] if old['mean_ms'] else 1.0
+        marker = ''
+        if ratio > 1 + tolerance:
+            marker = '  <-- REGRESSION'
+            regressions.append(result.key)
+        print(f'{result.key:<58} {old["mean_ms"]:10.3f} -> {result.mean_ms:10.3f} ms  x{ratio:.2f}{marker}')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for StackAndHeap.")
+    parser.add_argument('--quick', action='store_true', help='小规模快速运行')
+    parser.add_argument('--only', choices=['micro', 'agent', 'startup'], help='只运行一类基准')
+    parser.add_argument('--json', help='把结果保存为 JSON')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果比较')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='平均耗时允许变慢的比例')
+    args = parser.parse_args()
+
+    set_tracing_disabled(True)
+    results: List[BenchResult] = []
+    if args.only in (None, 'micro'):
+        results += bench_micro(args.quick)
+    if args.only in (None, 'agent'):
+        results += bench_agent_loop(args.quick)
+    if args.only in (None, 'startup'):
+        results += bench_startup(args.quick)
+    for result in results:
+        print(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+    if args.baseline:
+        print()
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}.')
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+批量评估：按 persona 文件中的脚本用户或模型模拟用户，在多个进程中并发运行独立的会话，
+写出每个会话的 transcript 和汇总统计（轮数、模型调用、token、栈深度、patch 失败、耗时）。
+
+    uv run evaluate.py personas.example.jsonl --out logs/eval/baseline --processes 4 --concurrency 8
+    uv run evaluate.py personas.jsonl --context '{"note_injection": "relevant"}' --out logs/eval/relevant
+    uv run evaluate.py personas.example.jsonl --scripted-agent --processes 2   # 离线冒烟测试，不访问模型
+"""
+import argparse
+import json
+import logging
+import sys
+from agent.evaluation import EvaluationConfig, load_personas, run_evaluation
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run scripted/simulated-user evaluation sessions in batch.")
+    parser.add_argument('personas', help='JSONL 文件，每行一个 persona（见 personas.example.jsonl）')
+    parser.add_argument('--out', default='logs/evaluation', help='transcript 与统计的输出目录')
+    parser.add_argument('--processes', type=int, default=1, help='工作进程数')
+    parser.add_argument('--concurrency', type=int, default=8, help='每个进程中同时运行的会话数')
+    parser.add_argument('--max-turns', type=int, default=30, help='每个会话最多运行的轮数')
+    parser.add_argument('--multi-tool', action='store_true', help='使用多工具模式的 agent')
+    parser.add_argument('--scripted-agent', action='store_true', help='用本地脚本模型驱动 agent，模拟用户也用本地脚本回复（不访问模型）')
+    parser.add_argument('--user-model', help='模拟用户使用的模型名（默认与主模型相同；--scripted-agent 时默认为本地脚本）')
+    parser.add_argument('--context', default='{}', help='所有会话共用的上下文字段覆盖（JSON）')
+    parser.add_argument('--resume', action='store_true', help='跳过输出目录中已有 transcript 的会话')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    config = EvaluationConfig(out_dir=args.out, max_turns=args.max_turns, sessions_per_process=args.concurrency,
+                              multi_tool=args.multi_tool, scripted_agent=args.scripted_agent,
+                              user_model=args.user_model, context=json.loads(args.context))
+    summary = run_evaluation(load_personas(args.personas), config, processes=args.processes, resume=args.resume)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary.get('status', {}).get('error') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,67 @@
-from agent import agent, StackAndHeapContext
-from agents import Runner, RunResult
+from agent import StackAndHeapContext
+from agent.channels import StdinChannel
+from agent.context import ConversationLayout
+from agent.main_agent import agent, multi_tool_agent
+from agent.model import get_stage_models, load_env
+from agent.runtime import run_turn
+from agent.streaming import ConsoleStreamHandler
+from agent.parallel import ParallelSubtaskRunner
+from agent.summarizer import BackgroundSummarizer
+from agent.telemetry import Telemetry
+from agent.web_search import default_web_search
 from pprint import pprint
 import asyncio
+import json
+import os
+from typing import cast, get_args
 
 
 async def main():
-    ctx = StackAndHeapContext()
+    # 先加载 .env，下面读取的配置才能写在 .env 中
+    load_env()
+    # journal 模式：每次变更追加到日志，定期压缩为快照；重启时自动从快照+日志恢复
+    ctx = StackAndHeapContext.open_journal('logs/conversation.jsonl')
     # ctx = StackAndHeapContext.load('logs/conversation.json')
+    if layout := os.getenv("CONVERSATION_LAYOUT"):
+        if layout not in get_args(ConversationLayout):
+            raise ValueError(f'CONVERSATION_LAYOUT must be one of {get_args(ConversationLayout)}, got {layout!r}')
+        ctx.conversation_layout = cast(ConversationLayout, layout)
+    if keep_last := os.getenv("COMPACTION_KEEP_LAST"):
+        ctx.compaction_keep_last = json.loads(keep_last)
+    # 只注入与当前 frame 相关的 note 分节，其余分节按需用 read_note_sections 读取
+    if os.getenv("NOTE_INJECTION") == "relevant":
+        ctx.note_injection = "relevant"
+        ctx.note_injection_budget = int(os.getenv("NOTE_INJECTION_BUDGET", ctx.note_injection_budget))
+    # 流式模式：推理、工具参数和发给用户的消息边生成边显示
+    stream = ConsoleStreamHandler() if os.getenv("STREAM") == "1" else None
+    if stream:
+        ctx.set_user_channel(StdinChannel(echo=False))
+    # 多工具模式：brainstorm/start_subtask/apply_patch_to_note 不结束本轮，减少整段上下文的重复发送
+    stage_models = get_stage_models()
+    starting_agent = multi_tool_agent if os.getenv("MULTI_TOOL_TURNS") == "1" else agent
+    # 后台总结：finish_subtask 后先临时弹出 frame，主循环继续，note patch 稍后写回
+    summarizer = None
+    if os.getenv("BACKGROUND_SUMMARY") == "1":
+        summarizer = BackgroundSummarizer(starting_agent, stage_models=stage_models)
+        summarizer.resume(ctx)
+    # 并行子任务：互不依赖的子目标各自在独立的对话中并发运行，结束后合并 note
+    if os.getenv("PARALLEL_SUBTASKS") == "1":
+        ctx.set_subtask_runner(ParallelSubtaskRunner(starting_agent, stage_models=stage_models))
+    # 网络搜索：web_search / fetch_pages 工具，多个查询并发执行，结果缓存在磁盘上
+    if os.getenv("WEB_SEARCH") == "1":
+        ctx.set_web_search(default_web_search())
+    # 每轮指标：各阶段耗时、token 用量、工具结果、栈与 note 大小
+    telemetry = None
+    if metrics_path := os.getenv("METRICS_PATH"):
+        telemetry = Telemetry(metrics_path, prometheus_path=os.getenv("PROMETHEUS_PATH") or None)
     while True:
-        conversation = ctx.build_conversation()
-        response: RunResult = await Runner.run(
-            starting_agent=agent,
-            input=conversation,
-            context=ctx
-        )
-        new_item = [item.to_input_item() for item in response.new_items]
-        print('--- Agent Response ---')
-        pprint(new_item)
-        print('----------------------\n')
-        ctx.add_messages(new_item)
-        ctx.save('logs/conversation.json')
+        turn = await run_turn(ctx, starting_agent=starting_agent, stream=stream,
+                              stage_models=stage_models, summarizer=summarizer, telemetry=telemetry)
+        print(f'[prompt cache] {turn.prefix}')
+        if stream is None:
+            print('--- Agent Response ---')
+            pprint(turn.new_items)
+            print('----------------------\n')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import logging
+from agent.http_api import serve_http
+from agent.main_agent import multi_tool_agent
+from agent.model import load_env
+from agent.sessions import SessionManager
+from agent.telemetry import Telemetry
+from agent.web_search import default_web_search
+
+
+async def main():
+    load_env()
+    parser = argparse.ArgumentParser(description="Host many StackAndHeap sessions in one process.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--root', default='logs/sessions', help='每个会话的 journal 存放目录')
+    parser.add_argument('--max-concurrency', type=int, default=4, help='同时进行的模型调用上限')
+    parser.add_argument('--reply-timeout', type=float, default=None, help='等待用户回复的超时（秒）')
+    parser.add_argument('--resume', action='store_true', help='启动时恢复 root 目录下的所有会话')
+    parser.add_argument('--multi-tool', action='store_true',
+                        help='内部工具执行后在同一次运行中继续，只有 send_message/finish_subtask/pop_subtask 结束本轮')
+    parser.add_argument('--background-summaries', action='store_true',
+                        help='finish_subtask 后临时弹出 frame，总结阶段在后台运行')
+    parser.add_argument('--parallel-subtasks', action='store_true',
+                        help='启用 start_parallel_subtasks，互不依赖的子任务并发运行')
+    parser.add_argument('--web-search', action='store_true',
+                        help='启用 web_search / fetch_pages 工具（配置见 .env.example 中的 WEB_SEARCH_*）')
+    parser.add_argument('--metrics', help='每轮指标写入的 JSONL 文件（按大小轮转）')
+    parser.add_argument('--prometheus', help='累计指标以 Prometheus 文本格式写入的文件')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    telemetry = Telemetry(args.metrics, prometheus_path=args.prometheus) if args.metrics else None
+    manager = SessionManager(args.root, max_concurrency=args.max_concurrency,
+                             reply_timeout=args.reply_timeout,
+                             starting_agent=multi_tool_agent if args.multi_tool else None,
+                             background_summaries=args.background_summaries,
+                             parallel_subtasks=args.parallel_subtasks,
+                             web_search=default_web_search() if args.web_search else None,
+                             telemetry=telemetry)
+    if args.resume:
+        manager.resume_all()
+    server = await serve_http(manager, args.host, args.port)
+    print(f'Listening on http://{args.host}:{args.port}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await manager.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
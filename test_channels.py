@@ -0,0 +1,42 @@
+import asyncio
+import builtins
+import threading
+from agent.channels import QueueChannel, StdinChannel
+
+
+def test_queue_channel_drops_reply_to_timed_out_question():
+    async def scenario():
+        channel = QueueChannel(timeout=0.05)
+        channel.reply('early')  # 提问之前的回复照常有效
+        assert await channel.ask('q0') == 'early'
+        assert await channel.ask('q1') is None
+        channel.reply('late answer to q1')
+        channel.timeout = 1
+        asyncio.get_running_loop().call_later(0.05, channel.reply, 'answer to q2')
+        return await channel.ask('q2')
+
+    assert asyncio.run(scenario()) == 'answer to q2'
+
+
+def test_stdin_channel_drops_line_typed_after_timeout(monkeypatch):
+    lines = ['late answer to q1', 'answer to q2']
+    release = threading.Event()
+
+    def fake_input(prompt: str) -> str:
+        line = lines.pop(0)
+        if line.startswith('late'):
+            release.wait(5)
+        return line
+
+    monkeypatch.setattr(builtins, 'input', fake_input)
+
+    async def scenario():
+        channel = StdinChannel(timeout=0.05, echo=False)
+        assert await channel.ask('q1') is None
+        release.set()  # 超时之后才输入完
+        while not channel._pending.done():
+            await asyncio.sleep(0.01)
+        channel.timeout = 1
+        return await channel.ask('q2')
+
+    assert asyncio.run(scenario()) == 'answer to q2'
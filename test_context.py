@@ -0,0 +1,174 @@
+import asyncio
+import json
+from agents.tool_context import ToolContext
+from agent.context import StackAndHeapContext
+from agent.summarizer import summary_results
+from agent.tools import apply_patch_to_note, redo_note_patch, undo_note_patch
+
+
+def _call(name: str, call_id: str, arguments: dict) -> dict:
+    return {'type': 'function_call', 'name': name, 'call_id': call_id,
+            'arguments': json.dumps(arguments, ensure_ascii=False)}
+
+
+def _output(call_id: str, output: str) -> dict:
+    return {'type': 'function_call_output', 'call_id': call_id, 'output': output}
+
+
+def test_load_legacy_frames(tmp_path):
+    """旧格式：各 frame 直接保存消息副本，pop_subtask 原地改写过父 frame 中的 output"""
+    start = _call('start_subtask', 'c1', {'subtask_id': 'greet', 'subtask_goal': 'say hi'})
+    started = _output('c1', 'subtask started')
+    thinking = _call('brainstorm', 'c2', {'thinking': 'hi'})
+    thought = _output('c2', 'None')
+    popped = {**started, 'output': '[2 messages removed] You have terminated the subtask with summary "done".'}
+    current = _call('brainstorm', 'c3', {'thinking': 'only in the frame'})
+    legacy = {
+        'stack': [{'task_id': 'main', 'goal': 'main', 'messages': [start, popped, current]}],
+        'note': '# Note\n',
+        'current_stage': 'main_loop',
+        'chat_history': [start, started, thinking, thought],
+    }
+    path = tmp_path / 'legacy.json'
+    path.write_text(json.dumps(legacy, ensure_ascii=False), encoding='utf-8')
+
+    ctx = StackAndHeapContext.load(str(path))
+
+    assert ctx.stack[0].message_ids == [0, 1, 4]
+    assert list(ctx.chat_history) == [start, started, thinking, thought, current]
+    assert ctx.overlays == {1: {'output': popped['output']}}
+    assert ctx.build_conversation()[1:] == [start, popped, current]
+    # 迁移后的格式再保存、加载不变
+    ctx.save(str(path))
+    reloaded = StackAndHeapContext.load(str(path))
+    assert reloaded.build_conversation() == ctx.build_conversation()
+
+
+def test_fork_is_isolated_and_rollback_restores_checkpoint():
+    ctx = StackAndHeapContext()
+    ctx.add_messages([{'role': 'user', 'content': 'hi'}])
+    ctx.checkpoint('before')
+    branch = ctx.fork()
+
+    ctx.push_subtask('a', 'goal of a', start_call_id='c1')
+    ctx.add_messages([{'role': 'user', 'content': 'in a'}])
+    ctx.apply_patch_to_note('*** Begin Patch\n@@ # Note\n+- added\n*** End Patch\n')
+    assert '- added' in ctx.note
+    # 分支与原上下文共享消息日志，但看不到之后的修改
+    assert [subtask.task_id for subtask in branch.stack] == ['main']
+    assert branch.build_conversation()[1:] == [{'role': 'user', 'content': 'hi'}]
+    assert '- added' not in branch.note
+
+    ctx.rollback('before')
+    assert [subtask.task_id for subtask in ctx.stack] == ['main']
+    assert ctx.stack[0].message_ids == [0]
+    assert '- added' not in ctx.note
+    # 检查点保留，回滚后的修改不影响它
+    ctx.add_messages([{'role': 'user', 'content': 'again'}])
+    assert ctx.get_checkpoint('before').stack[0].message_ids == [0]
+
+
+def _invoke(ctx: StackAndHeapContext, tool, call_id: str, arguments: dict) -> str:
+    """像 Runner 一样调用工具，并把调用和输出写入上下文"""
+    payload = json.dumps(arguments, ensure_ascii=False)
+    output = asyncio.run(tool.on_invoke_tool(
+        ToolContext(ctx, tool_name=tool.name, tool_call_id=call_id, tool_arguments=payload), payload))
+    ctx.add_messages([_call(tool.name, call_id, arguments), _output(call_id, str(output))])
+    return str(output)
+
+
+def test_undo_redo_round_trip_and_summary_results():
+    ctx = StackAndHeapContext()
+    ctx.push_subtask('a', 'goal of a')
+    ctx.set_stage('summarizing')
+    start = len(ctx.chat_history)
+    original = ctx.note
+    first = '*** Begin Patch\n@@ # Note\n+- first\n*** End Patch\n'
+    second = '*** Begin Patch\n@@ # Note\n+- second\n*** End Patch\n'
+
+    _invoke(ctx, apply_patch_to_note, 'c1', {'patch': first})
+    with_first = ctx.note
+    _invoke(ctx, apply_patch_to_note, 'c2', {'patch': second})
+    with_both = ctx.note
+    assert '- first' in with_first and '- second' in with_both
+
+    assert _invoke(ctx, undo_note_patch, 'c3', {}).startswith('Undid the change of version 2.')
+    assert ctx.note == with_first
+    _invoke(ctx, undo_note_patch, 'c4', {})
+    assert ctx.note == original
+    assert _invoke(ctx, redo_note_patch, 'c5', {}).startswith('Redid the change of version 1.')
+    assert ctx.note == with_first
+    # 总结结果只包含最终生效的 patch：second 被撤销后没有重做
+    assert summary_results(ctx, start) == ([first], None)
+
+    _invoke(ctx, redo_note_patch, 'c6', {})
+    assert ctx.note == with_both
+    assert summary_results(ctx, start) == ([first, second], None)
+
+
+def test_frame_budget_warns_and_finish_policy_forces_summary():
+    ctx = StackAndHeapContext(frame_token_budget=100, budget_policy='finish')
+    ctx.add_messages([{'role': 'user', 'content': 'long ' * 200}])
+    # 主任务不受 frame 预算限制
+    assert ctx.budget_warnings() == []
+    assert not ctx.enforce_budget()
+
+    ctx.push_subtask('a', 'goal of a')
+    ctx.add_messages([{'role': 'user', 'content': 'short'}])
+    assert ctx.budget_warnings() == []
+    ctx.add_messages([{'role': 'user', 'content': 'word ' * 200}])
+    frame = ctx.stack[-1]
+    # 增量计数与重新计算一致
+    assert ctx.frame_tokens(frame) == sum(ctx.message_tokens(i) for i in frame.message_ids) > 100
+    [warning] = ctx.budget_warnings()
+    assert warning.startswith('Subtask a uses') and 'over its budget of 100' in warning
+    assert warning in ctx.build_conversation()[0]['content']
+
+    assert ctx.enforce_budget()
+    assert ctx.current_stage == 'summarizing'
+    assert 'finished automatically' in ctx.frame_messages(frame)[-1]['content']
+    assert not ctx.enforce_budget()  # 已经在总结阶段
+
+
+def test_total_budget_counts_note_and_all_frames():
+    ctx = StackAndHeapContext(total_token_budget=10_000)
+    ctx.add_messages([{'role': 'user', 'content': 'word ' * 100}])
+    ctx.push_subtask('a', 'goal of a')
+    ctx.add_messages([{'role': 'user', 'content': 'word ' * 100}])
+    used = ctx.conversation_tokens()
+    assert used == ctx.note_tokens() + sum(ctx.frame_tokens(subtask) for subtask in ctx.stack)
+    assert ctx.budget_warnings() == []
+    ctx.total_token_budget = used - 1
+    [warning] = ctx.budget_warnings()
+    assert f'The context uses {used} tokens' in warning
+    # 默认的 warn 策略只提示，不改变阶段
+    assert not ctx.enforce_budget() and ctx.current_stage == 'main_loop'
+
+
+def test_old_tool_calls_are_elided_when_building_the_conversation():
+    ctx = StackAndHeapContext(compaction_keep_last={'brainstorm': 1, 'read_note_sections': 1})
+    long_thought = 'think ' * 100
+    long_note = '## 计划\n' + '- 一行内容\n' * 60
+    ctx.add_messages([
+        _call('brainstorm', 'b1', {'thinking': long_thought}), _output('b1', 'None'),
+        _call('brainstorm', 'b2', {'thinking': 'short'}), _output('b2', 'None'),
+        _call('read_note_sections', 'r1', {'headers': ['## 计划']}), _output('r1', long_note),
+        _call('brainstorm', 'b3', {'thinking': long_thought}), _output('b3', 'None'),
+        _call('read_note_sections', 'r2', {'headers': ['## 计划']}), _output('r2', long_note),
+    ])
+    conversation = {(item.get('type'), item.get('call_id')): item for item in ctx.build_conversation()[1:]}
+
+    elided = json.loads(conversation['function_call', 'b1']['arguments'])
+    assert elided == {'thinking': f'[elided: {len(long_thought)} chars from an earlier call]'}
+    # 太短的内容不替换，最近一次调用保持原样
+    assert json.loads(conversation['function_call', 'b2']['arguments']) == {'thinking': 'short'}
+    assert json.loads(conversation['function_call', 'b3']['arguments']) == {'thinking': long_thought}
+    # 其余工具省略的是输出，只保留第一行
+    assert conversation['function_call_output', 'r1']['output'] == \
+        f'## 计划\n[elided: {len(long_note)} chars of earlier read_note_sections output]'
+    assert conversation['function_call_output', 'r2']['output'] == long_note
+    # 压缩只影响构建出的对话，不改写 chat_history
+    assert ctx.chat_history[0]['arguments'] == _call('brainstorm', 'b1', {'thinking': long_thought})['arguments']
+
+    ctx.compaction_keep_last = {}
+    assert ctx.build_conversation()[1:] == list(ctx.chat_history)
@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import sys
+import dotenv
+import pytest
+import main
+import server
+from agent.model import load_env
+from agent.web_search import StandinSearchBackend, default_web_search
+
+ENV = '''CONVERSATION_LAYOUT=note_last
+COMPACTION_KEEP_LAST={"brainstorm": 2}
+NOTE_INJECTION=relevant
+NOTE_INJECTION_BUDGET=123
+STREAM=1
+WEB_SEARCH=1
+WEB_SEARCH_BACKEND=standin
+WEB_SEARCH_CACHE_DIR=
+'''
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.fixture
+def dotenv_only(tmp_path, monkeypatch):
+    """配置只写在临时 .env 中：清掉同名环境变量，并让 load_env 读取这个文件"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / '.env').write_text(ENV, encoding='utf-8')
+    for line in ENV.splitlines():
+        name = line.partition('=')[0]
+        monkeypatch.setenv(name, '')  # 记下原值，测试结束后恢复
+        monkeypatch.delenv(name)
+    monkeypatch.setattr(dotenv, 'load_dotenv', functools.partial(dotenv.load_dotenv, tmp_path / '.env'))
+    load_env.cache_clear()
+    default_web_search.cache_clear()
+    yield
+    load_env.cache_clear()
+    default_web_search.cache_clear()
+
+
+def test_main_reads_settings_from_dotenv(dotenv_only, monkeypatch):
+    seen = {}
+
+    async def run_turn(ctx, **kwargs):
+        seen.update(ctx=ctx, **kwargs)
+        raise Stop
+
+    monkeypatch.setattr(main, 'run_turn', run_turn)
+    monkeypatch.setattr(main, 'get_stage_models', dict)
+    with pytest.raises(Stop):
+        asyncio.run(main.main())
+    ctx = seen['ctx']
+    assert ctx.conversation_layout == 'note_last'
+    assert ctx.compaction_keep_last == {'brainstorm': 2}
+    assert (ctx.note_injection, ctx.note_injection_budget) == ('relevant', 123)
+    assert seen['stream'] is not None
+    assert isinstance(ctx.web_search.backend, StandinSearchBackend)
+    assert ctx.web_search.cache is None
+    ctx.close_journal()
+
+
+def test_server_web_search_reads_settings_from_dotenv(dotenv_only, monkeypatch):
+    seen = {}
+
+    async def serve_http(manager, host, port):
+        seen['manager'] = manager
+        raise Stop
+
+    monkeypatch.setattr(server, 'serve_http', serve_http)
+    monkeypatch.setattr(sys, 'argv', ['server.py', '--web-search'])
+    with pytest.raises(Stop):
+        asyncio.run(server.main())
+    web_search = seen['manager'].web_search
+    assert isinstance(web_search.backend, StandinSearchBackend)
+    assert web_search.cache is None
+
+
+def test_main_rejects_unknown_layout(dotenv_only, tmp_path):
+    (tmp_path / '.env').write_text(ENV.replace('note_last', 'note_lats'), encoding='utf-8')
+    with pytest.raises(ValueError, match='CONVERSATION_LAYOUT'):
+        asyncio.run(main.main())
@@ -0,0 +1,74 @@
+from agent.context import StackAndHeapContext
+from agent.journal import Journal
+
+PATCH = '*** Begin Patch\n@@ # Note\n+- {}\n*** End Patch\n'
+
+
+def _first_steps(ctx: StackAndHeapContext) -> None:
+    ctx.add_messages([{'role': 'user', 'content': 'hi'}])
+    ctx.push_subtask('a', 'goal of a', start_call_id='c1')
+    ctx.add_messages([{'role': 'user', 'content': 'in a'}])
+
+
+def _later_steps(ctx: StackAndHeapContext) -> None:
+    ctx.set_stage('summarizing')
+    ctx.apply_patch_to_note(PATCH.format('first'))
+
+
+def _state(ctx: StackAndHeapContext) -> dict:
+    return ctx.model_dump(mode='json')
+
+
+def test_torn_tail_is_dropped_on_reload(tmp_path):
+    path = str(tmp_path / 'session.jsonl')
+    ctx = StackAndHeapContext.open_journal(path)
+    _first_steps(ctx)
+    ctx.compact_journal()
+    _later_steps(ctx)
+    expected = _state(ctx)
+    ctx.add_messages([{'role': 'user', 'content': 'lost in the crash'}])
+    ctx.close_journal()
+    # 崩溃时最后一条记录只写了一半
+    with open(path, 'r+', encoding='utf-8') as f:
+        content = f.read()
+        f.seek(0)
+        f.write(content[:len(content) - 20])
+        f.truncate()
+
+    reloaded = StackAndHeapContext.open_journal(path)
+    assert _state(reloaded) == expected
+    # 重新加载时写入了新快照，日志被截断，之后的追加从干净的文件开始
+    with open(path, 'r', encoding='utf-8') as f:
+        assert f.read() == ''
+    reloaded.add_messages([{'role': 'user', 'content': 'after restart'}])
+    reloaded.close_journal()
+    again = StackAndHeapContext.open_journal(path)
+    assert _state(again) == _state(reloaded)
+    again.close_journal()
+
+
+def test_only_records_after_the_snapshot_are_replayed(tmp_path):
+    path = str(tmp_path / 'session.jsonl')
+    ctx = StackAndHeapContext.open_journal(path)
+    _first_steps(ctx)
+    with open(path, 'r', encoding='utf-8') as f:
+        before_snapshot = f.read()
+    ctx.compact_journal()
+    _later_steps(ctx)
+    expected = _state(ctx)
+    ctx.close_journal()
+    # 模拟快照已落盘、日志截断前崩溃：日志里仍有快照之前的记录
+    with open(path, 'r', encoding='utf-8') as f:
+        after_snapshot = f.read()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(before_snapshot + after_snapshot)
+
+    journal = Journal(path)
+    state, records = journal.read()
+    ops = [op for op, _ in records]
+    assert ops == ['set_stage', 'apply_patch_to_note']
+    assert journal.seq == 5 and not journal.torn_tail
+
+    reloaded = StackAndHeapContext.open_journal(path)
+    assert _state(reloaded) == expected
+    reloaded.close_journal()
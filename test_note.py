@@ -0,0 +1,96 @@
+import pytest
+from agent.context import StackAndHeapContext
+from agent.note import NoteDocument
+from agent.note_index import NoteIndex, terms
+from agent.patch_matching import PatchMatcher, PatchMatchError
+
+NOTE = '# Note\n\n## 计划\n- 明天上午去超市买菜和水果\n- 下午给妈妈打电话\n\n## 用户画像\n- 喜欢猫'
+
+
+def _patch(*hunks: str) -> str:
+    return '*** Begin Patch\n' + ''.join(hunks) + '*** End Patch\n'
+
+
+def test_fuzzy_hunk_applies_to_closest_line():
+    document = NoteDocument.from_text(NOTE, PatchMatcher())
+    # 旧行抄错了几个字，只能近似匹配
+    applied = document.apply_patch(_patch('@@ ## 计划\n-- 明天上午去超市买菜和水菓\n+- 明天下午去超市\n'))
+    assert [(h.header, h.kind) for h in applied] == [('## 计划', 'fuzzy')]
+    assert 0.85 <= applied[0].score < 1.0
+    assert document.render() == NOTE.replace('- 明天上午去超市买菜和水果', '- 明天下午去超市')
+
+
+def test_normalized_hunk_ignores_whitespace():
+    document = NoteDocument.from_text(NOTE, PatchMatcher())
+    applied = document.apply_patch(_patch('@@ ## 用户画像\n--   喜欢猫  \n+- 喜欢狗\n'))
+    assert applied[0].kind == 'normalized'
+    assert '- 喜欢狗' in document.render() and '喜欢猫' not in document.render()
+
+
+def test_unrelated_hunk_is_rejected_and_note_is_unchanged():
+    document = NoteDocument.from_text(NOTE, PatchMatcher())
+    with pytest.raises(PatchMatchError):
+        document.apply_patch(_patch('@@ ## 计划\n+- 新的一行\n', '@@ ## 计划\n-- 完全无关的内容\n+- x\n'))
+    assert document.render() == NOTE
+
+
+LONG_NOTE = '\n'.join([
+    '# Note',
+    '',
+    '## 猫咪饮食',
+    *[f'- 咪咪每天吃两次干粮，第{i}周减少零食' for i in range(8)],
+    '',
+    '## 吉他练习',
+    *[f'- 每天练习指弹半小时，第{i}周学新曲子' for i in range(8)],
+    '',
+    '## 日本旅行',
+    *[f'- 第{i}天在京都参观寺庙，预算有限' for i in range(8)],
+])
+
+
+def _tokens(document: NoteDocument, *headers: str) -> int:
+    from agent.tokens import default_counter
+    return sum(default_counter.count_text('\n'.join(section.all_lines()))
+               for section in document.sections if section.header in headers)
+
+
+def test_terms_split_words_and_cjk_bigrams():
+    assert terms('Hello, World_1 喜欢猫 猫') == ['hello', 'world_1', '喜欢', '欢猫', '猫']
+
+
+def test_select_keeps_relevant_sections_within_budget():
+    document = NoteDocument.from_text(LONG_NOTE, PatchMatcher())
+    index = NoteIndex()
+    budget = _tokens(document, '# Note', '## 猫咪饮食') + 10
+    selection = index.select(document, '规划猫咪的饮食 干粮', budget)
+    # 空的前言（header 为 None）与标题一起总是保留
+    assert [section.header for section in selection.sections] == [None, '# Note', '## 猫咪饮食']
+    assert [section.header for section in selection.omitted] == ['## 吉他练习', '## 日本旅行']
+    assert _tokens(document, *(section.header for section in selection.sections)) <= budget
+    # 最相关的一节即使超出预算也保留
+    assert [s.header for s in index.select(document, '吉他 指弹', 1).sections] == [None, '# Note', '## 吉他练习']
+    # 整个 note 不超过预算时全部注入
+    assert index.select(document, '吉他', 100_000).omitted == []
+
+
+def test_index_reuses_stats_of_unchanged_sections():
+    document = NoteDocument.from_text(LONG_NOTE, PatchMatcher())
+    index = NoteIndex()
+    index.select(document, '猫', 50)
+    before = dict(index._stats)
+    document.apply_patch(_patch('@@ ## 吉他练习\n+- 换了新琴弦\n'))
+    index.select(document, '琴弦', 50)
+    reused = [key for key, stats in index._stats.items() if before.get(key) is stats]
+    assert len(reused) == len(document.sections) - 1
+    assert index.rank(document, '琴弦')[0][1].header == '## 吉他练习'
+
+
+def test_relevant_injection_follows_the_current_frame():
+    ctx = StackAndHeapContext(note=LONG_NOTE, note_injection='relevant', note_injection_budget=120)
+    ctx.push_subtask('trip', '规划日本京都旅行')
+    prompt = ctx.note_for_prompt()
+    assert '## 日本旅行' in prompt and '京都参观寺庙' in prompt
+    assert '每天练习指弹' not in prompt and '其余分节：## 猫咪饮食, ## 吉他练习' in prompt
+    # 总结阶段需要按原文写 patch，注入完整 note
+    ctx.set_stage('summarizing')
+    assert ctx.note_for_prompt() == f'```note\n{LONG_NOTE}\n```'
@@ -0,0 +1,54 @@
+import asyncio
+import json
+from agents import RunConfig
+from agent.context import StackAndHeapContext
+from agent.main_agent import agent
+from agent.parallel import ParallelSubtaskRunner, sibling_context
+from agent.runtime import run_turn
+from agent.scripted_model import ScriptedCall, ScriptedModel
+from agent.telemetry import Telemetry
+
+
+def _start_call_id(ctx: StackAndHeapContext) -> str:
+    return ctx.frame_messages(ctx.stack[-1])[0]['call_id']
+
+
+def test_sibling_start_call_id_is_deterministic():
+    ctx = StackAndHeapContext()
+    ctx.add_messages([{'role': 'user', 'content': 'hi'}])
+    first = sibling_context(ctx, 'a', 'goal of a', 'call_parent')
+    again = sibling_context(ctx, 'a', 'goal of a', 'call_parent')
+    assert first.build_conversation() == again.build_conversation()
+    assert _start_call_id(first) == first.stack[-1].start_call_id
+    assert _start_call_id(first) != _start_call_id(sibling_context(ctx, 'b', 'goal of a', 'call_parent'))
+    assert _start_call_id(first) != _start_call_id(sibling_context(ctx, 'a', 'goal of a', 'call_other'))
+
+
+def _sibling_script(subtask_id: str):
+    return [
+        ScriptedCall('finish_subtask'),
+        ScriptedCall('apply_patch_to_note', {'patch': f'*** Begin Patch\n@@ # Note\n+- {subtask_id} done\n*** End Patch'}),
+        ScriptedCall('pop_subtask', {'return_value': f'{subtask_id} completed'}),
+    ]
+
+
+def test_sibling_tool_calls_are_not_charged_to_the_parent_turn(tmp_path):
+    subtasks = [{'subtask_id': 'a', 'subtask_goal': 'goal of a'}, {'subtask_id': 'b', 'subtask_goal': 'goal of b'}]
+    parent_model = ScriptedModel([ScriptedCall('start_parallel_subtasks', {'subtasks': subtasks})], loop=False)
+    # 子任务逐个运行，共用一个按顺序的脚本
+    sibling_model = ScriptedModel(_sibling_script('a') + _sibling_script('b'), loop=False)
+    ctx = StackAndHeapContext()
+    ctx.add_messages([{'role': 'user', 'content': 'hi'}])
+    ctx.set_subtask_runner(ParallelSubtaskRunner(agent, RunConfig(model=sibling_model), stage_models={},
+                                                 max_concurrency=1))
+    metrics = tmp_path / 'metrics.jsonl'
+    telemetry = Telemetry(str(metrics))
+    asyncio.run(run_turn(ctx, agent, run_config=RunConfig(model=parent_model), telemetry=telemetry))
+    telemetry.close()
+
+    assert '- a done' in ctx.note and '- b done' in ctx.note
+    assert sibling_model.calls == 6
+    [record] = [json.loads(line) for line in metrics.read_text(encoding='utf-8').splitlines()]
+    assert [tool['name'] for tool in record['tools']] == ['start_parallel_subtasks']
+    assert record['model_calls'] == 1
+    assert record['patches'] == {}
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import litellm
+import openai
+import pytest
+from agents import ModelSettings
+from agents.models.interface import ModelTracing
+from agent import model as model_module
+from agent.model import build_model, retry_policy, shared_http_client
+from agent.resilient_model import ResilientModel
+from agent.standin_server import StandinOpenAIServer
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """build_model 指向本地替身服务；连接池和重试策略按每个测试的环境变量重新创建"""
+    monkeypatch.delenv('LLM_CACHE', raising=False)
+    monkeypatch.setenv('LLM_ATTEMPT_TIMEOUT', '5')
+    monkeypatch.setenv('LLM_MAX_ATTEMPTS', '3')
+    monkeypatch.delenv('LLM_HEDGE_AFTER', raising=False)
+
+    def clear():
+        for cached in (retry_policy, shared_http_client, model_module.response_cache):
+            cached.cache_clear()
+        litellm.aclient_session = None
+
+    clear()
+    yield monkeypatch
+    clear()
+
+
+async def _ask(server: StandinOpenAIServer) -> tuple[ResilientModel, str]:
+    built = build_model('openai/standin', 'sk-standin', server.base_url)
+    assert isinstance(built, ResilientModel)
+    built.policy.backoff_base = 0.05
+    response = await built.get_response('be brief', 'hi', ModelSettings(), [], None, [], ModelTracing.DISABLED)
+    return built, response.output[0].content[0].text
+
+
+def test_rate_limits_and_server_errors_are_retried_with_backoff(transport):
+    async def main():
+        async with StandinOpenAIServer(reply='recovered', fail=lambda n: {0: 429, 1: 503}.get(n)) as server:
+            started = time.perf_counter()
+            built, text = await _ask(server)
+            return built, text, server.requests, time.perf_counter() - started
+
+    built, text, requests, elapsed = asyncio.run(main())
+    assert text == 'recovered'
+    # litellm 自带的重试被关闭，每次尝试正好对应一个 HTTP 请求
+    assert (requests, built.attempts, built.retries) == (3, 3, 2)
+    # 两次退避 0.05 + 0.1 秒（±20% 抖动）
+    assert elapsed >= 0.12
+
+
+def test_gives_up_after_max_attempts_and_on_client_errors(transport):
+    transport.setenv('LLM_MAX_ATTEMPTS', '2')
+
+    async def main(status):
+        async with StandinOpenAIServer(fail=lambda n: status) as server:
+            with pytest.raises(openai.APIStatusError) as raised:
+                await _ask(server)
+            return raised.value.status_code, server.requests
+
+    assert asyncio.run(main(500)) == (500, 2)
+    retry_policy.cache_clear()
+    shared_http_client.cache_clear()
+    assert asyncio.run(main(400)) == (400, 1)
+
+
+def test_slow_attempt_times_out_and_is_retried(transport):
+    transport.setenv('LLM_ATTEMPT_TIMEOUT', '0.2')
+
+    async def main():
+        async with StandinOpenAIServer(reply='fast', latency=lambda n: 2.0 if n == 0 else 0.0) as server:
+            started = time.perf_counter()
+            built, text = await _ask(server)
+            return built, text, server.requests, time.perf_counter() - started
+
+    built, text, requests, elapsed = asyncio.run(main())
+    assert (text, requests, built.retries) == ('fast', 2, 1)
+    assert 0.2 <= elapsed < 1.5
+
+
+def test_hedged_request_wins_and_the_slow_one_is_cancelled(transport):
+    transport.setenv('LLM_HEDGE_AFTER', '0.1')
+
+    async def main():
+        async with StandinOpenAIServer(reply='hedged', latency=lambda n: 3.0 if n == 0 else 0.0) as server:
+            started = time.perf_counter()
+            built, text = await _ask(server)
+            elapsed = time.perf_counter() - started
+            return built, text, server.requests, elapsed
+
+    built, text, requests, elapsed = asyncio.run(main())
+    assert text == 'hedged'
+    assert (requests, built.attempts, built.hedges, built.hedge_wins, built.retries) == (2, 2, 1, 1, 0)
+    # 落后的请求被取消，而不是等它返回
+    assert elapsed < 1.5
+
+
+def test_requests_share_the_pooled_client(transport):
+    async def main():
+        async with StandinOpenAIServer() as server:
+            for _ in range(3):
+                await _ask(server)
+            sequential = server.connections
+            await asyncio.gather(*(_ask(server) for _ in range(4)))
+            for _ in range(3):
+                await _ask(server)
+            return sequential, server.requests, server.connections
+
+    sequential, requests, connections = asyncio.run(main())
+    assert litellm.aclient_session is shared_http_client()
+    assert requests == 10
+    # 顺序请求复用同一条 keep-alive 连接，并发时最多为每个并发请求各开一条，之后继续复用
+    assert sequential == 1 and connections <= 4
@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from agents import ModelSettings
+from agents.models.interface import ModelTracing
+from agent.response_cache import CacheMissError, CachedModel, ResponseCache, request_key
+from agent.scripted_model import ScriptedCall, ScriptedModel
+from agent.tools import brainstorm
+
+INPUT = [{'role': 'user', 'content': 'hi', 'type': 'message'}]
+
+
+def _key(input=INPUT, instructions='be brief', settings=ModelSettings(temperature=0.2), tools=(brainstorm,)) -> str:
+    return request_key('model-a', instructions, input, settings, list(tools), None, [])
+
+
+def test_request_key_is_stable_and_covers_the_request():
+    assert _key() == _key()
+    # 字典键的顺序不影响键
+    assert _key([{'type': 'message', 'content': 'hi', 'role': 'user'}]) == _key()
+    assert len({_key(), _key([{'role': 'user', 'content': 'hello', 'type': 'message'}]), _key(instructions='be long'),
+                _key(settings=ModelSettings(temperature=0.3)), _key(tools=())}) == 5
+    assert request_key('model-b', 'be brief', INPUT, ModelSettings(temperature=0.2), [brainstorm], None, []) != _key()
+
+
+def _get(model, input=INPUT):
+    return model.get_response('be brief', input, ModelSettings(), [brainstorm], None, [], ModelTracing.DISABLED)
+
+
+def _script() -> ScriptedModel:
+    return ScriptedModel([ScriptedCall('brainstorm', {'thinking': 'x'})])
+
+
+def test_read_write_then_replay(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    inner = _script()
+    recorder = CachedModel(inner, cache, namespace='model-a')
+    first = asyncio.run(_get(recorder))
+    second = asyncio.run(_get(recorder))
+    assert inner.calls == 1 and (cache.hits, cache.misses) == (1, 1)
+    assert second.output == first.output and second.usage.input_tokens == first.usage.input_tokens
+
+    replay_inner = _script()
+    replay = CachedModel(replay_inner, ResponseCache(str(tmp_path)), namespace='model-a', mode='replay')
+    assert asyncio.run(_get(replay)).output == first.output
+    with pytest.raises(CacheMissError):
+        asyncio.run(_get(replay, [{'role': 'user', 'content': 'not recorded', 'type': 'message'}]))
+    assert replay_inner.calls == 0
+
+
+def test_streamed_responses_are_recorded_and_replayed(tmp_path):
+    async def stream(model):
+        return [event async for event in model.stream_response(
+            'be brief', INPUT, ModelSettings(), [brainstorm], None, [], ModelTracing.DISABLED)]
+
+    recorded = asyncio.run(stream(CachedModel(_script(), ResponseCache(str(tmp_path)))))
+    replay_inner = _script()
+    replayed = asyncio.run(stream(CachedModel(replay_inner, ResponseCache(str(tmp_path)), mode='replay')))
+    assert replay_inner.calls == 0
+    assert replayed[-1].response.output == recorded[-1].response.output
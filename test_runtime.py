@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from agents import RunConfig
+from agent.context import StackAndHeapContext
+from agent.main_agent import multi_tool_agent
+from agent.runtime import run_turn
+from agent.scripted_model import ScriptedCall, ScriptedModel
+
+
+def test_failed_run_restores_frames():
+    ctx = StackAndHeapContext()
+    ctx.add_messages([{'role': 'user', 'content': 'hi'}])
+    # 多工具模式下 start_subtask 之后继续调用模型，脚本用尽时抛出异常
+    model = ScriptedModel([ScriptedCall('start_subtask', {'subtask_id': 'a', 'subtask_goal': 'goal'})], loop=False)
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_turn(ctx, multi_tool_agent, run_config=RunConfig(model=model)))
+    assert [subtask.task_id for subtask in ctx.stack] == ['main']
+    assert ctx.stack[0].message_ids == [0]
+    assert ctx.current_stage == 'main_loop'
+
+
+def test_restore_frames_undoes_pops_and_pushes():
+    ctx = StackAndHeapContext()
+    ctx.add_messages([{'role': 'user', 'content': 'hi'}])
+    ctx.push_subtask('a', 'goal', start_call_id='c1')
+    ctx.add_messages([
+        {'type': 'function_call', 'name': 'start_subtask', 'call_id': 'c1', 'arguments': '{}'},
+        {'type': 'function_call_output', 'call_id': 'c1', 'output': 'started'},
+    ])
+    before = ctx.build_conversation()
+    mark = ctx.mark_frames()
+
+    ctx.pop_subtask('done')
+    ctx.push_subtask('b', 'goal of b')
+    ctx.set_stage('summarizing')
+    ctx.restore_frames(mark)
+
+    assert [subtask.task_id for subtask in ctx.stack] == ['main', 'a']
+    assert ctx.stack[0].message_ids == [0] and ctx.stack[1].message_ids == [1, 2]
+    assert ctx.overlays == {} and ctx.current_stage == 'main_loop'
+    assert ctx.build_conversation() == before
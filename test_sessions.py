@@ -0,0 +1,79 @@
+import asyncio
+import json
+from agent.http_api import serve_http
+from agent.main_agent import agent
+from agent.scripted_model import ScriptedCall, ScriptedModel
+from agent.sessions import SessionManager, TurnScheduler
+
+
+class RecordingScheduler(TurnScheduler):
+    """按获得空位的顺序记录会话"""
+
+    def __init__(self, max_concurrency: int):
+        super().__init__(max_concurrency)
+        self.order = []
+
+    async def acquire(self, session_id: str) -> None:
+        await super().acquire(session_id)
+        self.order.append(session_id)
+
+
+def test_scheduler_interleaves_sessions(tmp_path):
+    model = ScriptedModel([ScriptedCall('brainstorm', {'thinking': 'keep going'})], latency=0.005)
+    manager = SessionManager(str(tmp_path), max_concurrency=1, starting_agent=agent.clone(model=model),
+                             stage_models={})
+    scheduler = manager.scheduler = RecordingScheduler(1)
+
+    async def scenario():
+        manager.create_session('a')
+        manager.create_session('b')
+        while len(scheduler.order) < 12:
+            await asyncio.sleep(0.01)
+        await manager.shutdown()
+
+    asyncio.run(scenario())
+    order = scheduler.order[:12]
+    assert all(first != second for first, second in zip(order, order[1:])), order
+    assert abs(scheduler.served['a'] - scheduler.served['b']) <= 1
+
+
+async def _request(port: int, method: str, target: str, body: object = None, raw_headers: str = ''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = b'' if body is None else json.dumps(body).encode('utf-8')
+    writer.write(f'{method} {target} HTTP/1.1\r\nContent-Length: {len(data)}\r\n{raw_headers}\r\n'.encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(payload)
+
+
+def test_http_round_trip_and_bad_requests(tmp_path):
+    model = ScriptedModel([ScriptedCall('start_subtask', {'subtask_id': 'chat', 'subtask_goal': 'greet'}),
+                           ScriptedCall('send_message', {'content': 'hello'}),
+                           ScriptedCall('send_message', {'content': 'again'})], loop=False)
+    manager = SessionManager(str(tmp_path), starting_agent=agent.clone(model=model), stage_models={})
+
+    async def scenario():
+        server = await serve_http(manager, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            assert (await _request(port, 'POST', '/sessions', {'session_id': 'chat'}))[0] == 201
+            status, payload = await _request(port, 'GET', '/sessions/chat/messages?wait=1')
+            assert (status, payload) == (200, {'messages': ['hello']})
+            assert (await _request(port, 'POST', '/sessions/chat/reply', {'text': 'hi'}))[0] == 200
+            status, payload = await _request(port, 'GET', '/sessions/chat/messages?wait=1')
+            assert (status, payload) == (200, {'messages': ['again']})
+            status, session = await _request(port, 'GET', '/sessions/chat')
+            assert status == 200 and session['status'] == 'running' and session['waiting_for_user']
+
+            assert (await _request(port, 'POST', '/sessions', {'session_id': 42}))[0] == 400
+            assert (await _request(port, 'POST', '/sessions', {'session_id': '../x'}))[0] == 400
+            assert (await _request(port, 'GET', '/sessions/chat/messages?wait=-1'))[0] == 400
+            assert (await _request(port, 'GET', '/sessions/chat/messages?wait=soon'))[0] == 400
+            assert (await _request(port, 'GET', '/sessions/missing'))[0] == 404
+        finally:
+            server.close()
+            await manager.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,34 @@
+import json
+from agent.streaming import PartialJsonStringField
+
+CONTENT = 'Hi "you"\\ 换行\n制表\t/ é 😀 end'
+
+
+def _arguments() -> str:
+    # 目标字段前后都有别的字段；ensure_ascii 让中文和 emoji 变成 \u 转义（emoji 是代理对）
+    return json.dumps({'other': 'x"y', 'content': CONTENT, 'after': 'not part of it'})
+
+
+def test_field_is_decoded_from_deltas_of_any_size():
+    arguments = _arguments()
+    for size in (1, 2, 3, 5, 7, len(arguments)):
+        field = PartialJsonStringField('content')
+        parts = [field.feed(arguments[i:i + size]) for i in range(0, len(arguments), size)]
+        assert ''.join(parts) == CONTENT, size
+        assert field.done
+
+
+def test_text_is_emitted_before_the_value_is_complete():
+    arguments = _arguments()
+    field = PartialJsonStringField('content')
+    cut = arguments.index('end')
+    assert field.feed(arguments[:cut]) == CONTENT[:-len('end')]
+    assert not field.done
+    assert field.feed(arguments[cut:]) == 'end'
+    assert field.feed('{"content": "again"}') == ''
+
+
+def test_missing_field_yields_nothing():
+    field = PartialJsonStringField('content')
+    assert field.feed('{"thinking": "content"}') == ''
+    assert not field.done
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from agent.web_search import SearchCache, SearchResult, StandinSearchBackend, WebSearch
+
+
+def _search(web: WebSearch, *queries: str):
+    return asyncio.run(web.search(queries))
+
+
+def _results(query: str):
+    if query == 'boom':
+        raise ConnectionError('backend down')
+    shared = SearchResult('Shared', 'https://Example.com/shared/#top', 'appears in every query')
+    return [SearchResult(f'{query} result', f'https://example.com/{query}', f'about {query}'), shared]
+
+
+def test_queries_are_normalized_and_urls_deduplicated(tmp_path):
+    backend = StandinSearchBackend(_results)
+    web = WebSearch(backend, SearchCache(str(tmp_path)))
+    answers = _search(web, 'cats', '  CATS ', 'dogs', '')
+    # 规范化后相同的查询只请求一次，保留第一次出现的写法
+    assert backend.calls == [('search', 'cats'), ('search', 'dogs')]
+    assert [answer.query for answer in answers] == ['cats', 'dogs']
+    # 多个查询返回的同一个 URL 只保留在先出现的查询中
+    assert [r.url for r in answers[0].results] == ['https://example.com/cats', 'https://Example.com/shared/#top']
+    assert [r.url for r in answers[1].results] == ['https://example.com/dogs']
+    assert web.backend_calls == 2
+    web.close()
+
+
+def test_titles_snippets_and_pages_are_truncated(tmp_path):
+    backend = StandinSearchBackend(
+        lambda query: [SearchResult('t' * 300, 'https://example.com/long', 'line one\n\n  line two ' + 's' * 100)],
+        pages={'https://example.com/long': 'p' * 100})
+    web = WebSearch(backend, SearchCache(str(tmp_path)), max_snippet_chars=20, max_page_chars=30)
+    result = _search(web, 'long')[0].results[0]
+    assert result.title == 't' * 200 + '…'
+    assert result.snippet == 'line one line two ss…'
+    pages = asyncio.run(web.fetch(['https://example.com/long', 'https://EXAMPLE.com/long/', 'https://example.com/missing']))
+    assert [page.text for page in pages[:1]] == ['p' * 30 + '…']
+    assert len(pages) == 2 and pages[1].error == 'LookupError: 404 Not Found: https://example.com/missing'
+    web.close()
+
+
+def test_warm_cache_hits_and_ttl_expiry(tmp_path):
+    backend = StandinSearchBackend()
+    web = WebSearch(backend, SearchCache(str(tmp_path), ttl=0.2))
+    assert [answer.cached for answer in _search(web, 'cats')] == [False]
+    # 新的 WebSearch 共用同一个缓存目录，命中时不再请求后端
+    warm = WebSearch(backend, SearchCache(str(tmp_path), ttl=0.2))
+    assert [answer.cached for answer in _search(warm, 'Cats', 'dogs')] == [True, False]
+    assert backend.calls == [('search', 'cats'), ('search', 'dogs')]
+    assert warm.backend_calls == 1 and warm.cache.hits == 1
+    time.sleep(0.3)
+    assert [answer.cached for answer in _search(warm, 'cats')] == [False]
+    assert backend.calls[-1] == ('search', 'cats') and warm.backend_calls == 2
+    web.close()
+    warm.close()
+
+
+def test_concurrent_identical_requests_share_one_backend_call(tmp_path):
+    backend = StandinSearchBackend(latency=0.1)
+    web = WebSearch(backend, SearchCache(str(tmp_path)))
+
+    async def main():
+        return await asyncio.gather(web.search(['cats']), web.search(['CATS']), web.fetch(['https://example.com/a']),
+                                    web.fetch(['https://example.com/a#b']))
+
+    first, second, page, same_page = asyncio.run(main())
+    assert backend.calls == [('search', 'cats'), ('fetch', 'https://example.com/a')]
+    assert first[0].results == second[0].results and not first[0].cached and not second[0].cached
+    assert page[0].error == same_page[0].error is not None
+    assert web.backend_calls == 2
+    web.close()
+
+
+def test_one_failing_query_does_not_affect_the_others(tmp_path):
+    backend = StandinSearchBackend(_results)
+    web = WebSearch(backend, SearchCache(str(tmp_path)))
+    answers = _search(web, 'cats', 'boom', 'dogs')
+    assert [answer.error for answer in answers] == [None, 'ConnectionError: backend down', None]
+    assert [len(answer.results) for answer in answers] == [2, 0, 1]
+    # 失败不写入缓存，下次仍会请求后端
+    assert [answer.cached for answer in _search(web, 'cats', 'boom')] == [True, False]
+    assert backend.calls.count(('search', 'boom')) == 2
+    web.close()